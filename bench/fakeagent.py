@@ -0,0 +1,171 @@
+# Copyright (c) 2017 Iotic Labs Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://github.com/Iotic-Labs/py-IoticBulkData/blob/master/LICENSE
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""In-memory stand-in for the subset of IOT.Client used by the Stash workers (no network or agent required)
+"""
+
+from __future__ import unicode_literals
+
+from collections import Counter
+from threading import Lock
+from time import sleep
+from uuid import uuid4
+
+from IoticAgent.Core.compat import monotonic
+from IoticAgent.IOT.ThingMeta import ThingMeta
+from IoticAgent.IOT.PointMeta import PointMeta
+
+
+_RDF = '<http://example.com/%s> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> <http://example.com/%s> .\n'
+# Points also refer to their thing
+_RDF_PARENT = '<http://example.com/%s> <http://example.com/parent> <http://example.com/%s> .\n'
+
+# Requests which (like with the real agent) can be in flight at the same time, via their *_async variant
+ASYNC_METHODS = frozenset(('set_public', 'create_tag', 'set_recent_config', 'create_value', 'share'))
+
+
+class FakeResource(object):
+    """Thing or point, counting (and delaying) each request made"""
+
+    def __init__(self, client, kind, parent=None):
+        self.guid = uuid4().hex
+        self.__client = client
+        self.__kind = kind
+        self.__rdf = _RDF % (self.guid, kind)
+        if parent is not None:
+            self.__rdf += _RDF_PARENT % (self.guid, parent.guid)
+
+    def get_meta(self):
+        self.__client.request('get_meta')
+        meta_cls = ThingMeta if self.__kind == 'thing' else PointMeta
+        return meta_cls(self, self.__rdf, self.__client.default_lang, fmt='n3')
+
+    def get_meta_rdf(self, fmt='n3'):  # pylint: disable=unused-argument
+        self.__client.request('get_meta_rdf')
+        return self.__rdf
+
+    def set_meta_rdf(self, rdf, fmt='n3'):  # pylint: disable=unused-argument
+        self.__client.request('set_meta_rdf')
+        self.__rdf = rdf
+
+    def create_feed(self, pid):  # pylint: disable=unused-argument
+        self.__client.request('create_feed')
+        return FakeResource(self.__client, 'feed', parent=self)
+
+    def create_control(self, pid, func):  # pylint: disable=unused-argument
+        self.__client.request('create_control')
+        return FakeResource(self.__client, 'control', parent=self)
+
+    def __getattr__(self, name):
+        if name.endswith('_async'):
+            method = name[:-len('_async')]
+            if not self.__client.async_requests or method not in ASYNC_METHODS:
+                raise AttributeError(name)
+
+            def request_async(*args, **kwargs):  # pylint: disable=unused-argument
+                return self.__client.request_async(method)
+            return request_async
+
+        def request(*args, **kwargs):  # pylint: disable=unused-argument
+            self.__client.request(name)
+        return request
+
+
+class FakeEvent(object):
+    """Returned by asynchronous requests, to pass to FakeClient._wait_and_except_if_failed"""
+
+    __slots__ = ('due', 'waited')
+
+    def __init__(self, due):
+        # Time at which the request completes
+        self.due = due
+        # Whether the round trip of this request has already been counted
+        self.waited = False
+
+
+class FakeClient(object):
+    """Counts requests (by method) and delays each by latency seconds. If async_requests is set, some requests can be in
+    flight at the same time (see ASYNC_METHODS). round_trips counts sequential round trips: Each synchronous request
+    counts as one (also completing any asynchronous requests issued before it) as does waiting for asynchronous
+    requests in flight together. (Only meaningful with a single worker.)"""
+
+    default_lang = 'en'
+
+    def __init__(self, latency=0, async_requests=False):
+        self.__latency = latency
+        self.async_requests = async_requests
+        self.__lock = Lock()
+        self.requests = Counter()
+        self.round_trips = 0
+        # Asynchronous requests not yet waited for
+        self.__in_flight = []
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def __count(self, name):
+        with self.__lock:
+            self.requests[name] += 1
+
+    def request(self, name):
+        self.__count(name)
+        with self.__lock:
+            self.round_trips += 1
+            # Asynchronous requests issued before this one complete within its round trip
+            self.__complete_in_flight()
+        if self.__latency:
+            sleep(self.__latency)
+
+    def request_async(self, name):
+        self.__count(name)
+        event = FakeEvent(monotonic() + self.__latency)
+        with self.__lock:
+            self.__in_flight.append(event)
+        return event
+
+    def __complete_in_flight(self):
+        for event in self.__in_flight:
+            event.waited = True
+        del self.__in_flight[:]
+
+    def _wait_and_except_if_failed(self, event):
+        with self.__lock:
+            if not event.waited:
+                # All requests in flight complete within the same round trip
+                self.round_trips += 1
+                self.__complete_in_flight()
+        remaining = event.due - monotonic()
+        if remaining > 0:
+            sleep(remaining)
+
+    def create_thing(self, lid):  # pylint: disable=unused-argument
+        self.request('create_thing')
+        return FakeResource(self, 'thing')
+
+    def register_catchall_controlreq(self, callback, callback_parsed=None):  # pylint: disable=unused-argument
+        pass
+
+
+class FakeClientFactory(object):
+    """Client factory (see ClientPool.create_iot_client) for worker processes, creating a FakeClient each. Requests made
+    in worker processes are not counted in the parent."""
+
+    def __init__(self, latency=0, async_requests=False):
+        self.__latency = latency
+        self.__async_requests = async_requests
+
+    def __call__(self, agentfile):  # pylint: disable=unused-argument
+        return FakeClient(self.__latency, self.__async_requests)
@@ -0,0 +1,217 @@
+# Copyright (c) 2017 Iotic Labs Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://github.com/Iotic-Labs/py-IoticBulkData/blob/master/LICENSE
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""End-to-end throughput of the Stash -> ThreadPool pipeline (see fakeagent for the agent stand-in).
+
+Each thing count is run in a separate process, so that peak memory is measured per run. The first round of each run
+provisions all things, further rounds only share new values. Results are printed (or written) as JSON, e.g. from the
+repository root:
+
+    PYTHONPATH=src python bench/pipeline.py --things 1000 100000 1000000 --latency 0.002 --output results.json
+
+With --processes, diffs are handled by that many worker processes (see ProcessPool) instead of threads in the
+benchmark process, e.g. to compare scaling:
+
+    for p in 1 2 4; do PYTHONPATH=src python bench/pipeline.py --things 20000 --processes $p; done
+"""
+
+from __future__ import unicode_literals, print_function
+
+from argparse import ArgumentParser, SUPPRESS
+from datetime import datetime
+from os.path import join
+from platform import python_version, python_implementation
+from shutil import rmtree
+from subprocess import check_output
+from tempfile import mkdtemp
+from threading import Thread
+import json
+import logging
+import sys
+
+try:
+    from resource import getrusage, RUSAGE_SELF
+except ImportError:  # e.g. Windows
+    getrusage = None
+
+from IoticAgent.Core.compat import Queue, monotonic
+
+from Ioticiser.Metrics import REGISTRY
+from Ioticiser.Stash import Stash
+from Ioticiser.Stash.ClientPool import ClientPool
+
+from fakeagent import FakeClient, FakeClientFactory
+
+
+NAME = 'bench'
+PERCENTILES = (50, 90, 99, 100)
+# Fixed so that shared data (and thus the stash) is identical between runs
+SHARE_TIME = datetime(2017, 1, 1)
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {}
+    return {'p%d' % pct: values[min(len(values) - 1, len(values) * pct // 100)] for pct in PERCENTILES}
+
+
+def metric_value(name):
+    """Returns value of metric for this benchmark's stash from the metrics registry (or None if not recorded)"""
+    prefix = '%s{source="%s"} ' % (name, NAME)
+    for line in REGISTRY.render().splitlines():
+        if line.startswith(prefix):
+            return float(line[len(prefix):])
+    return None
+
+
+class CompletionWaiter(object):
+    """Waits for updates (in the order they were made) to record their latency. Since completions are observed in
+    order, latencies of updates which complete out of order are overstated slightly."""
+
+    def __init__(self):
+        self.__queue = Queue()
+        self.__thread = Thread(target=self.__run, name='bench-waiter')
+        self.latencies = []
+
+    def start(self):
+        self.__thread.start()
+
+    def add(self, started, update):
+        self.__queue.put((started, update))
+
+    def finish(self):
+        """Returns once all added updates have completed"""
+        self.__queue.put(None)
+        self.__thread.join()
+
+    def __run(self):
+        latencies = self.latencies
+        while True:
+            item = self.__queue.get()
+            if item is None:
+                break
+            started, update = item
+            update.wait()
+            latencies.append(monotonic() - started)
+
+
+def update_things(stash, things, feeds, values, provision, round_num):
+    """Returns submission time & completion latencies for one update of each thing"""
+    waiter = CompletionWaiter()
+    waiter.start()
+    started = monotonic()
+    for i in range(things):
+        submitted = monotonic()
+        with stash.create_thing('thing%d' % i) as thing:
+            if provision:
+                thing.set_label('Thing %d' % i, lang='en')
+                thing.set_description('Benchmark thing %d' % i, lang='en')
+                thing.create_tag(['bench'])
+                thing.set_location(52.2, 0.12)
+                thing.set_public(True)
+            for j in range(feeds):
+                feed = thing.create_feed('feed%d' % j)
+                if provision:
+                    feed.set_label('Feed %d' % j, lang='en')
+                    feed.set_recent_config(max_samples=1)
+                for k in range(values):
+                    if provision:
+                        feed.create_value('value%d' % k, 'integer', 'en', 'Value %d' % k, data=round_num + k)
+                    else:
+                        feed.create_value('value%d' % k, data=round_num + k)
+                feed.share(time=SHARE_TIME)
+        waiter.add(submitted, thing.last_update)
+    submit_time = monotonic() - started
+    waiter.finish()
+    return submit_time, monotonic() - started, waiter.latencies
+
+
+def run(things, feeds, values, rounds, workers, latency, async_requests, processes):
+    """Returns dict of results for a single run"""
+    # pylint: disable=too-many-arguments
+    tmpdir = mkdtemp()
+    client = FakeClient(latency, async_requests)
+    results = []
+    try:
+        stash = Stash(join(tmpdir, NAME + '.json'), ClientPool([client]), workers, num_processes=processes,
+                      client_factory=FakeClientFactory(latency, async_requests))
+        stash.start()
+        try:
+            for round_num in range(rounds):
+                submit_time, elapsed, latencies = update_things(stash, things, feeds, values, round_num == 0,
+                                                                round_num)
+                results.append({'provision': round_num == 0,
+                                'submit_seconds': submit_time,
+                                'seconds': elapsed,
+                                'diffs_per_second': things / elapsed,
+                                'latency_seconds': percentiles(latencies)})
+        finally:
+            stash.stop()
+    finally:
+        rmtree(tmpdir)
+    return {'things': things,
+            'rounds': results,
+            # Not known if made in worker processes
+            'requests': None if processes else sum(client.requests.values()),
+            'save_seconds': metric_value('ioticiser_stash_save_seconds_sum'),
+            'save_bytes': metric_value('ioticiser_stash_save_bytes'),
+            # Kilobytes on Linux, bytes on OS X
+            'max_rss': getrusage(RUSAGE_SELF).ru_maxrss if getrusage else None}
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--things', type=int, nargs='+', default=[1000])
+    parser.add_argument('--feeds', type=int, default=2, help='feeds per thing')
+    parser.add_argument('--values', type=int, default=2, help='values per feed')
+    parser.add_argument('--rounds', type=int, default=3, help='updates per thing (first provisions)')
+    parser.add_argument('--workers', type=int, default=4, help='worker threads (per process if using processes)')
+    parser.add_argument('--processes', type=int, default=0, help='worker processes (0 = use threads in this process)')
+    parser.add_argument('--latency', type=float, default=0, help='simulated request round trip (seconds)')
+    parser.add_argument('--async', dest='async_requests', action='store_true',
+                        help='allow requests to be in flight at the same time (as with the real agent)')
+    parser.add_argument('--output', help='file to write results to instead of stdout')
+    parser.add_argument('--single', action='store_true', help=SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        logging.basicConfig(level=logging.WARNING)
+        print(json.dumps(run(args.things[0], args.feeds, args.values, args.rounds, args.workers, args.latency,
+                             args.async_requests, args.processes)))
+        return
+
+    options = ['--feeds', str(args.feeds), '--values', str(args.values), '--rounds', str(args.rounds),
+               '--workers', str(args.workers), '--processes', str(args.processes), '--latency', repr(args.latency)]
+    if args.async_requests:
+        options.append('--async')
+    runs = []
+    for things in args.things:
+        print('Running with %d things' % things, file=sys.stderr)
+        output = check_output([sys.executable, __file__, '--single', '--things', str(things)] + options)
+        runs.append(json.loads(output.decode('utf-8')))
+    results = {'parameters': {'feeds': args.feeds, 'values': args.values, 'rounds': args.rounds,
+                              'workers': args.workers, 'processes': args.processes, 'latency': args.latency,
+                              'async': args.async_requests},
+               'python': '%s %s' % (python_implementation(), python_version()),
+               'runs': runs}
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
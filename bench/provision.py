@@ -0,0 +1,80 @@
+# Copyright (c) 2017 Iotic Labs Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://github.com/Iotic-Labs/py-IoticBulkData/blob/master/LICENSE
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Agent requests needed to provision new things (by agent method), each with described feeds.
+
+Runs against an in-memory stand-in for the agent (no network required), e.g. from the repository root:
+
+    PYTHONPATH=src python bench/provision.py --things 100 --points 3 --latency 0.005
+"""
+
+from __future__ import unicode_literals, print_function
+
+from argparse import ArgumentParser
+from threading import Semaphore
+from time import time
+
+from IoticAgent.Core.Const import R_FEED
+
+from Ioticiser.Stash.ThreadPool import ThreadPool
+from Ioticiser.Stash.ClientPool import ClientPool
+from Ioticiser.Stash.Diff import ThingDiff, PointDiff, ValueDiff
+
+from fakeagent import FakeClient
+
+
+def make_diff(lid, points, new):
+    point_diffs = tuple(PointDiff('feed%d' % i, R_FEED, new, 0, ('bench',), (('en', 'Feed %d' % i),),
+                                  (('en', 'Benchmark feed %d' % i),),
+                                  (ValueDiff('v', 'integer', 'en', 'value', None, True, i),), False, None, None)
+                        for i in range(points))
+    return ThingDiff(lid, new, None, True, ('bench',), (52.2, 0.12), (('en', 'Thing %s' % lid),),
+                     (('en', 'Benchmark thing %s' % lid),), point_diffs)
+
+
+def run(things, points, latency):
+    """Returns tuple of Counter of requests by agent method name and time taken (seconds)"""
+    client = FakeClient(latency)
+    pool = ThreadPool('bench', num_workers=1, iotclient=ClientPool([client]))
+    completed = Semaphore(0)
+    start = time()
+    pool.start()
+    try:
+        for i in range(things):
+            lid = 'thing%d' % i
+            pool.submit(lid, i, make_diff(lid, points, True), lambda lid, idx: completed.release())
+        for _ in range(things):
+            completed.acquire()
+        elapsed = time() - start
+    finally:
+        pool.stop()
+    return client.requests, elapsed
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--things', type=int, default=100)
+    parser.add_argument('--points', type=int, default=3, help='feeds per thing')
+    parser.add_argument('--latency', type=float, default=0, help='simulated request round trip (seconds)')
+    args = parser.parse_args()
+
+    requests, elapsed = run(args.things, args.points, args.latency)
+    print('requests per thing')
+    for method in sorted(requests) + [None]:
+        count = sum(requests.values()) if method is None else requests[method]
+        print('%-20s %10.2f' % (method or 'total', count / float(args.things)))
+    print('%-20s %10.4f' % ('seconds per thing', elapsed / args.things))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+# Copyright (c) 2017 Iotic Labs Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://github.com/Iotic-Labs/py-IoticBulkData/blob/master/LICENSE
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Replays recorded diffs (see record_diffs) through a ThreadPool (see fakeagent for the agent stand-in).
+
+Diffs are submitted at the speed they were recorded at (scaled by --speed) or, with --speed 0, as fast as possible.
+Results are printed as JSON, e.g. from the repository root:
+
+    PYTHONPATH=src python bench/replay.py ../data/MySource_diffs.rec --speed 2 --workers 8 --latency 0.002
+"""
+
+from __future__ import unicode_literals, print_function
+
+from argparse import ArgumentParser
+from collections import Counter
+from threading import Semaphore
+from time import sleep
+import json
+import logging
+
+from IoticAgent.Core.compat import monotonic
+
+from Ioticiser.Stash.ThreadPool import ThreadPool
+from Ioticiser.Stash.ClientPool import ClientPool
+from Ioticiser.Stash.Recorder import read_recording
+
+from fakeagent import FakeClient
+from pipeline import percentiles
+
+
+HOT_LIDS = 5
+
+
+def replay(fname, speed, workers, max_workers, latency, async_requests):
+    """Returns dict of results"""
+    # pylint: disable=too-many-arguments,too-many-locals
+    client = FakeClient(latency, async_requests)
+    pool = ThreadPool('replay', num_workers=workers, iotclient=ClientPool([client]), max_workers=max_workers)
+    # Diff index to time submitted
+    submitted = {}
+    latencies = []
+    completed = Semaphore(0)
+
+    def complete_cb(lid, idx):  # pylint: disable=unused-argument
+        latencies.append(monotonic() - submitted.pop(idx))
+        completed.release()
+
+    lids = Counter()
+    first = last = None
+    count = 0
+    pool.start()
+    try:
+        started = monotonic()
+        for made, diff in read_recording(fname):
+            if first is None:
+                first = made
+            last = made
+            if speed:
+                delay = (made - first) / speed - (monotonic() - started)
+                if delay > 0:
+                    sleep(delay)
+            submitted[count] = monotonic()
+            pool.submit(diff.lid, count, diff, complete_cb)
+            lids[diff.lid] += 1
+            count += 1
+        for _ in range(count):
+            completed.acquire()
+        elapsed = monotonic() - started
+    finally:
+        pool.stop()
+    return {'diffs': count,
+            'things': len(lids),
+            'hot_lids': lids.most_common(HOT_LIDS),
+            'recorded_seconds': (last - first) if count else 0,
+            'seconds': elapsed,
+            'diffs_per_second': (count / elapsed) if elapsed else 0,
+            'latency_seconds': percentiles(latencies),
+            'requests': dict(client.requests)}
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('recording')
+    parser.add_argument('--speed', type=float, default=1, help='multiple of recorded speed, 0 = as fast as possible')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--max-workers', type=int, help='scale workers up to (see workers_max)')
+    parser.add_argument('--latency', type=float, default=0, help='simulated request round trip (seconds)')
+    parser.add_argument('--async', dest='async_requests', action='store_true',
+                        help='allow requests to be in flight at the same time (as with the real agent)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    results = replay(args.recording, args.speed, args.workers, args.max_workers, args.latency, args.async_requests)
+    results['parameters'] = {'speed': args.speed, 'workers': args.workers, 'max_workers': args.max_workers,
+                             'latency': args.latency, 'async': args.async_requests}
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -25,7 +25,6 @@ logging.getLogger('IoticAgent.Core.Client').setLevel(logging.INFO)
 # Iotic imports ---------------------------
 
 from IoticAgent import Datatypes, Units
-from IoticAgent.Core.compat import monotonic
 
 from Ioticiser import SourceBase  # pylint: disable=import-error
 
@@ -172,6 +171,11 @@ class GatewayPublisher(SourceBase):
             feed.set_recent_config(max_samples=0)  # don't store recent data as it updates every 15 seconds
             # feed.share()
 
+    def __get_hvac_readings(self):
+        # hit the api for the readings for each hvac in list
+        for hvac in self.__hvac_list:
+            self.__get_hvac_reading_from_API(hvac[KEY_ID])
+
     # RUN public method  ----------------------------------------------------------------------------------------------
 
     def run(self):
@@ -179,14 +183,7 @@ class GatewayPublisher(SourceBase):
         self.__hvac_list = self.__get_hvac_list_from_API()
         # if len(self.__hvac_list) > 0:
         if self.__hvac_list:
-            lasttime = 0
-            while not self._stop.is_set():
-                nowtime = monotonic()
-                if nowtime - lasttime > self.__refresh_time:
-                    lasttime = nowtime
-                    # hit the api for the readings for each hvac in list
-                    for hvac in self.__hvac_list:
-                        self.__get_hvac_reading_from_API(hvac[KEY_ID])
-                self._stop.wait(timeout=5)
+            self.every(self.__refresh_time, self.__get_hvac_readings, name='hvac_readings')
+            self._stop.wait()
         else:
             logger.critical("no HVACs found - is the REST API running?")
@@ -0,0 +1,194 @@
+# Copyright (c) 2017 Iotic Labs Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://github.com/Iotic-Labs/py-IoticBulkData/blob/master/LICENSE
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Synthetic load generator, example source for Ioticiser (e.g. for capacity planning)
+"""
+
+from __future__ import unicode_literals
+
+from datetime import datetime
+from heapq import heappush, heappop
+from itertools import cycle
+import logging
+import random
+
+logging.basicConfig(format='%(asctime)s,%(msecs)03d %(levelname)s [%(name)s] {%(threadName)s} %(message)s',
+                    level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+from IoticAgent import Datatypes
+from IoticAgent.Core.compat import monotonic
+
+from Ioticiser import SourceBase
+
+
+LANG = 'en'
+
+# Size of precomputed pools of share intervals, values & churn decisions (cycled through)
+POOL_SIZE = 4096
+# Seconds between throughput log messages
+LOG_INTERVAL = 60
+# Longest time to wait between checking for shares due / new things / stop
+MAX_WAIT = 1
+
+DIST_FIXED = 'fixed'
+DIST_UNIFORM = 'uniform'
+DIST_EXPONENTIAL = 'exponential'
+
+
+class LoadGen(SourceBase):  # pylint: disable=too-many-instance-attributes
+    """Shares synthetic data for a configurable number of things (see README). All randomness is precomputed at start
+    so that generating updates costs little more than making them."""
+
+    def __init__(self, stash, config, stop):
+        super(LoadGen, self).__init__(stash, config, stop)
+        self.__things = 100
+        self.__feeds = 2
+        self.__values = 2
+        self.__share_interval = 10.0
+        self.__share_distribution = DIST_EXPONENTIAL
+        self.__churn = 0.0
+        self.__arrival_rate = 0.0
+        self.__prefix = 'loadgen'
+        self.__seed = 0
+        self.__validate_config()
+        rnd = random.Random(self.__seed)
+        self.__intervals = cycle(self.__make_intervals(rnd))
+        self.__data = cycle([rnd.randint(0, 1000) for _ in range(POOL_SIZE)])
+        self.__churns = cycle([rnd.random() < self.__churn for _ in range(POOL_SIZE)])
+        # Things provisioned so far (by index) & their number. These are kept (rather than obtained from the stash for
+        # each share) since shares can be due before a thing has been provisioned, when the stash would return a new
+        # (empty) thing again.
+        self.__thing_objs = []
+        self.__created = 0
+        # Heap of (time next share due, thing index)
+        self.__due = []
+        self.__shared = 0
+
+    def __validate_config(self):
+        self.__things = self.__positive_int('things', self.__things)
+        self.__feeds = self.__positive_int('feeds', self.__feeds)
+        self.__values = self.__positive_int('values', self.__values)
+        if 'share_interval' in self._config:
+            self.__share_interval = float(self._config['share_interval'])
+            if self.__share_interval <= 0:
+                raise ValueError("share_interval must be > 0")
+        if 'share_distribution' in self._config:
+            self.__share_distribution = self._config['share_distribution'].lower()
+            if self.__share_distribution not in (DIST_FIXED, DIST_UNIFORM, DIST_EXPONENTIAL):
+                raise ValueError("share_distribution must be one of %s, %s, %s" % (DIST_FIXED, DIST_UNIFORM,
+                                                                                   DIST_EXPONENTIAL))
+        if 'churn' in self._config:
+            self.__churn = float(self._config['churn'])
+            if not 0 <= self.__churn <= 1:
+                raise ValueError("churn must be between 0 and 1")
+        if 'arrival_rate' in self._config:
+            self.__arrival_rate = float(self._config['arrival_rate'])
+            if self.__arrival_rate < 0:
+                raise ValueError("arrival_rate must be >= 0")
+        if 'prefix' in self._config:
+            self.__prefix = self._config['prefix']
+        if 'seed' in self._config:
+            self.__seed = int(self._config['seed'])
+
+    def __positive_int(self, key, default):
+        if key not in self._config:
+            return default
+        value = int(self._config[key])
+        if value < 1:
+            raise ValueError("%s must be >= 1" % key)
+        return value
+
+    def __make_intervals(self, rnd):
+        mean = self.__share_interval
+        if self.__share_distribution == DIST_FIXED:
+            return [mean]
+        elif self.__share_distribution == DIST_UNIFORM:
+            return [rnd.uniform(0, 2 * mean) for _ in range(POOL_SIZE)]
+        return [rnd.expovariate(1 / mean) for _ in range(POOL_SIZE)]
+
+    def run(self):
+        logger.info("Generating %d things with %d feeds of %d values, sharing every %.1fs (%s)", self.__things,
+                    self.__feeds, self.__values, self.__share_interval, self.__share_distribution)
+        started = log_last = monotonic()
+        shared_last = 0
+
+        while not self._stop.is_set():
+            now = monotonic()
+            self.__arrive(now - started, now)
+            self.__share_due(now)
+
+            if now - log_last >= LOG_INTERVAL:
+                logger.info("Things=%d, Shares=%d (%.1f/s)", self.__created, self.__shared,
+                            (self.__shared - shared_last) / (now - log_last))
+                log_last, shared_last = now, self.__shared
+
+            wait = MAX_WAIT
+            if self.__due:
+                wait = min(wait, self.__due[0][0] - monotonic())
+            if self.__created < self.__things and self.__arrival_rate:
+                wait = min(wait, 1 / self.__arrival_rate)
+            if wait > 0:
+                self._stop.wait(timeout=wait)
+
+        logger.info("Finished")
+
+    def __arrive(self, elapsed, now):
+        if self.__arrival_rate:
+            target = min(self.__things, int(elapsed * self.__arrival_rate) + 1)
+        else:
+            target = self.__things
+        while self.__created < target and not self._stop.is_set():
+            self.__create_thing(self.__created)
+            # Spread first shares over one interval so that things provisioned together don't share together
+            offset = self.__share_interval * (self.__created % POOL_SIZE) / POOL_SIZE
+            heappush(self.__due, (now + offset, self.__created))
+            self.__created += 1
+
+    def __share_due(self, now):
+        due = self.__due
+        sharetime = datetime.utcnow()
+        while due and due[0][0] <= now and not self._stop.is_set():
+            when, idx = heappop(due)
+            self.__share(idx, sharetime)
+            heappush(due, (when + next(self.__intervals), idx))
+
+    def __lid(self, idx):
+        return '%s_%d' % (self.__prefix, idx)
+
+    def __create_thing(self, idx):
+        thing = self._stash.create_thing(self.__lid(idx))
+        self.__thing_objs.append(thing)
+        with thing:
+            thing.set_label("Load generator thing %d" % idx, lang=LANG)
+            thing.set_description("Synthetic load generated by Ioticiser LoadGen example", lang=LANG)
+            thing.create_tag(["test", "loadgen"])
+            for i in range(self.__feeds):
+                feed = thing.create_feed('feed%d' % i)
+                feed.set_recent_config(max_samples=1)
+                feed.set_label("Load generator feed %d" % i, lang=LANG)
+                for j in range(self.__values):
+                    feed.create_value('value%d' % j, Datatypes.INTEGER, LANG, "synthetic value %d" % j)
+
+    def __share(self, idx, sharetime):
+        data = self.__data
+        with self.__thing_objs[idx] as thing:
+            if next(self.__churns):
+                thing.set_description("Synthetic load generated by Ioticiser LoadGen example (%d)" % next(data),
+                                      lang=LANG)
+            for i in range(self.__feeds):
+                feed = thing.create_feed('feed%d' % i)
+                for j in range(self.__values):
+                    feed.create_value('value%d' % j, data=next(data))
+                feed.share(time=sharetime)
+        self.__shared += 1
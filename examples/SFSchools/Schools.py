@@ -25,7 +25,6 @@ logging.basicConfig(format='%(asctime)s,%(msecs)03d %(levelname)s [%(name)s] {%(
 # Iotic imports ---------------------------
 
 from IoticAgent import Datatypes
-from IoticAgent.Core.compat import monotonic
 from IoticAgent.Core.Const import R_FEED
 from IoticAgent.Core.Validation import VALIDATION_META_LABEL, VALIDATION_META_COMMENT
 
@@ -224,10 +223,6 @@ class SchoolsPublisher(SourceBase):
     # RUN ---------------------------------------------------------------------------------------------------
 
     def run(self):
-        lasttime = 0
-        while not self._stop.is_set():
-            nowtime = monotonic()
-            if nowtime - lasttime > self.__refresh_time:
-                lasttime = nowtime
-                self.get_schools_from_API()
-            self._stop.wait(timeout=5)
+        # Jitter so that polls of multiple instances of this source are spread out
+        self.every(self.__refresh_time, self.get_schools_from_API, jitter=self.__refresh_time / 10)
+        self._stop.wait()
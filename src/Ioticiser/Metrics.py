@@ -0,0 +1,317 @@
+# Copyright (c) 2017 Iotic Labs Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://github.com/Iotic-Labs/py-IoticBulkData/blob/master/LICENSE
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Process-wide metrics (counters, gauges & histograms) in Prometheus text format, exposed via a localhost HTTP
+endpoint and/or written periodically to a file (e.g. for the node exporter textfile collector)
+"""
+
+from __future__ import unicode_literals
+
+import logging
+logger = logging.getLogger(__name__)
+
+from bisect import bisect_left
+from os import rename, getpid
+from threading import Thread
+
+from IoticAgent.Core.compat import PY3, Lock, Event
+
+if PY3:
+    from http.server import HTTPServer, BaseHTTPRequestHandler  # pylint: disable=import-error
+else:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler  # pylint: disable=import-error
+
+
+# Seconds
+DEFAULT_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return '%s' % value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = ['%s="%s"' % (name, _escape('%s' % value)) for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append('%s="%s"' % extra)
+    return '{%s}' % ','.join(pairs) if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else '%d' % value
+
+
+class _Metric(object):
+
+    kind = None
+
+    def __init__(self, name, doc, labelnames=()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._lock = Lock()
+        # Label values (tuple) to value
+        self._values = {}
+
+    def _check(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError('%s requires labels %s' % (self.name, self.labelnames))
+
+    def samples(self):
+        """Returns list of sample lines (without HELP & TYPE)"""
+        lines = []
+        for labels, value in sorted(self._collect()):
+            lines.extend(self._render_value(labels, value))
+        return lines
+
+    def _collect(self):
+        with self._lock:
+            return list(self._values.items())
+
+    def _render_value(self, labels, value):
+        return ['%s%s %s' % (self.name, _format_labels(self.labelnames, labels), _format_value(value))]
+
+
+class Counter(_Metric):
+    """Monotonically increasing count (e.g. of events)"""
+
+    kind = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        self._check(labels)
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    """Value which can go up and down. Either set explicitly or obtained via a function when collected."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, doc, labelnames=()):
+        super(Gauge, self).__init__(name, doc, labelnames=labelnames)
+        self.__functions = {}
+
+    def set(self, value, labels=()):
+        self._check(labels)
+        with self._lock:
+            self._values[labels] = value
+
+    def set_function(self, func, labels=()):
+        """func is called (without arguments) on collection to obtain the value"""
+        self._check(labels)
+        with self._lock:
+            self.__functions[labels] = func
+
+    def remove(self, labels=()):
+        with self._lock:
+            self._values.pop(labels, None)
+            self.__functions.pop(labels, None)
+
+    def _collect(self):
+        with self._lock:
+            values = dict(self._values)
+            functions = list(self.__functions.items())
+        for labels, func in functions:
+            try:
+                values[labels] = func()
+            except:
+                logger.warning("Failed to collect %s%s", self.name, labels, exc_info=True)
+        return list(values.items())
+
+
+class Histogram(_Metric):
+    """Distribution of observed values (e.g. durations in seconds)"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, doc, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, doc, labelnames=labelnames)
+        self.__buckets = tuple(sorted(buckets))
+
+    def observe(self, value, labels=()):
+        self._check(labels)
+        idx = bisect_left(self.__buckets, value)
+        with self._lock:
+            try:
+                counts = self._values[labels]
+            except KeyError:
+                # Count per bucket (non-cumulative, last is +Inf), sum
+                counts = self._values[labels] = [0] * (len(self.__buckets) + 1) + [0]
+            counts[idx] += 1
+            counts[-1] += value
+
+    def _collect(self):
+        with self._lock:
+            return [(labels, list(counts)) for labels, counts in self._values.items()]
+
+    def _render_value(self, labels, value):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.__buckets + (float('inf'),), value[:-1]):
+            cumulative += count
+            bucket_labels = _format_labels(self.labelnames, labels, ('le', _format_value(float(bound))))
+            lines.append('%s_bucket%s %d' % (self.name, bucket_labels, cumulative))
+        label_str = _format_labels(self.labelnames, labels)
+        lines.append('%s_sum%s %s' % (self.name, label_str, repr(float(value[-1]))))
+        lines.append('%s_count%s %d' % (self.name, label_str, cumulative))
+        return lines
+
+
+class Registry(object):
+    """Collection of metrics. Metrics are created via (and registered with) the registry, creating the same metric
+    twice returns the existing one."""
+
+    def __init__(self):
+        self.__lock = Lock()
+        self.__metrics = {}
+        # Key to snapshot (see snapshot) of metrics from elsewhere, e.g. another process
+        self.__remote = {}
+
+    def __get(self, cls, name, doc, labelnames, **kwargs):
+        with self.__lock:
+            try:
+                metric = self.__metrics[name]
+            except KeyError:
+                metric = self.__metrics[name] = cls(name, doc, labelnames=labelnames, **kwargs)
+            else:
+                if not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                    raise ValueError('Metric %s already registered differently' % name)
+            return metric
+
+    def counter(self, name, doc, labelnames=()):
+        return self.__get(Counter, name, doc, labelnames)
+
+    def gauge(self, name, doc, labelnames=()):
+        return self.__get(Gauge, name, doc, labelnames)
+
+    def histogram(self, name, doc, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.__get(Histogram, name, doc, labelnames, buckets=buckets)
+
+    def snapshot(self):
+        """Returns current state of all metrics as (picklable) list of (name, kind, doc, sample lines)"""
+        with self.__lock:
+            metrics = sorted(self.__metrics.items())
+        return [(name, metric.kind, metric.doc, metric.samples()) for name, metric in metrics]
+
+    def set_remote(self, key, snapshot):
+        """Includes the given snapshot (from another registry) in render() until replaced/removed. Samples of remote
+        metrics must not clash with local ones (e.g. by having a different source label)."""
+        with self.__lock:
+            self.__remote[key] = snapshot
+
+    def remove_remote(self, key):
+        with self.__lock:
+            self.__remote.pop(key, None)
+
+    def render(self):
+        """Returns all metrics (including remote ones) in Prometheus text exposition format"""
+        snapshots = [self.snapshot()]
+        with self.__lock:
+            snapshots.extend(self.__remote[key] for key in sorted(self.__remote))
+        # Each metric must only appear once, so merge samples by name
+        families = {}
+        for snapshot in snapshots:
+            for name, kind, doc, samples in snapshot:
+                try:
+                    families[name][2].extend(samples)
+                except KeyError:
+                    families[name] = (kind, doc, list(samples))
+        lines = []
+        for name, (kind, doc, samples) in sorted(families.items()):
+            lines.append('# HELP %s %s' % (name, doc))
+            lines.append('# TYPE %s %s' % (name, kind))
+            lines.extend(samples)
+        lines.append('')
+        return '\n'.join(lines)
+
+
+# Default (process-wide) registry
+REGISTRY = Registry()
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    registry = REGISTRY
+
+    def do_GET(self):  # noqa pylint: disable=invalid-name
+        if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        logger.debug(format, *args)
+
+
+class MetricsExporter(object):
+    """Serves metrics via HTTP on localhost (if port is set) and/or writes them to textfile every interval seconds"""
+
+    def __init__(self, port=None, textfile=None, interval=15, registry=REGISTRY, host='127.0.0.1'):
+        self.__registry = registry
+        self.__textfile = textfile
+        self.__interval = interval
+        self.__stop = Event()
+        self.__server = None
+        self.__threads = []
+        if port is not None:
+            handler = type(str('Handler'), (_Handler,), {'registry': registry})
+            self.__server = HTTPServer((host, port), handler)
+            self.__threads.append(Thread(target=self.__server.serve_forever, name='metrics-http'))
+        if textfile is not None:
+            self.__threads.append(Thread(target=self.__write_textfile, name='metrics-textfile'))
+        for thread in self.__threads:
+            thread.daemon = True
+
+    @property
+    def interval(self):
+        return self.__interval
+
+    def start(self):
+        if self.__server is not None:
+            logger.info("Serving metrics on http://%s:%d/metrics", *self.__server.server_address[:2])
+        for thread in self.__threads:
+            thread.start()
+
+    def stop(self):
+        self.__stop.set()
+        if self.__server is not None:
+            self.__server.shutdown()
+            self.__server.server_close()
+        for thread in self.__threads:
+            thread.join()
+
+    def __write_textfile(self):
+        while True:
+            self.write_textfile()
+            if self.__stop.wait(timeout=self.__interval):
+                break
+
+    def write_textfile(self):
+        tmp = '%s.%d.tmp' % (self.__textfile, getpid())
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(self.__registry.render().encode('utf8'))
+            # Atomic so that collectors never see a partial file
+            rename(tmp, self.__textfile)
+        except:
+            logger.warning("Failed to write metrics to %s", self.__textfile, exc_info=True)
@@ -0,0 +1,117 @@
+# Copyright (c) 2017 Iotic Labs Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://github.com/Iotic-Labs/py-IoticBulkData/blob/master/LICENSE
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Sampling profiler which can be started & stopped at any time in a running process
+"""
+
+from __future__ import unicode_literals
+
+import logging
+logger = logging.getLogger(__name__)
+
+from sys import _current_frames
+from os.path import join, basename
+from collections import Counter
+from threading import Thread, enumerate as enumerate_threads, current_thread
+from datetime import datetime
+from io import open as io_open
+
+from IoticAgent.Core.compat import Event, Lock
+
+
+# Seconds between samples
+SAMPLE_INTERVAL = 0.005
+
+
+class SamplingProfiler(object):
+    """Periodically samples the stacks of all threads (including ones started before profiling), so that e.g. the warm
+    worker caches of a long running process are not lost by having to restart it for profiling. Samples are written in
+    collapsed stack format (one line of 'thread;outermost;...;innermost count' per unique stack), as understood by
+    flamegraph.pl & speedscope."""
+
+    def __init__(self, path, interval=SAMPLE_INTERVAL):
+        """path - directory to write profiles to"""
+        self.__path = path
+        self.__interval = interval
+        self.__lock = Lock()
+        self.__thread = None
+        self.__stop = Event()
+        # Collapsed stack to number of samples
+        self.__samples = Counter()
+        self.__sample_count = 0
+
+    @property
+    def running(self):
+        return self.__thread is not None
+
+    def toggle(self):
+        """Starts profiling if not running, otherwise stops it. Returns the file written (if stopped)."""
+        with self.__lock:
+            if self.__thread is None:
+                self.__start()
+                return None
+            return self.__finish()
+
+    def stop(self):
+        """Stops profiling (if running), returns the file written"""
+        with self.__lock:
+            if self.__thread is not None:
+                return self.__finish()
+        return None
+
+    def __start(self):
+        self.__samples = Counter()
+        self.__sample_count = 0
+        self.__stop.clear()
+        self.__thread = Thread(target=self.__run, name='profiler')
+        self.__thread.daemon = True
+        self.__thread.start()
+        logger.info("Profiling started (every %.3fs)", self.__interval)
+
+    def __finish(self):
+        self.__stop.set()
+        self.__thread.join()
+        self.__thread = None
+        fname = join(self.__path, 'profile_%s.collapsed' % datetime.now().strftime('%Y%m%d_%H%M%S'))
+        try:
+            with io_open(fname, 'w', encoding='utf-8') as f:
+                for stack, count in self.__samples.most_common():
+                    f.write('%s %d\n' % (stack, count))
+        except:
+            logger.error("Failed to write profile to %s", fname, exc_info=True)
+            return None
+        logger.info("Profiling stopped, %d samples written to %s", self.__sample_count, fname)
+        return fname
+
+    def __run(self):
+        own_ident = current_thread().ident
+        samples = self.__samples
+        while not self.__stop.wait(timeout=self.__interval):
+            names = {thread.ident: thread.name for thread in enumerate_threads()}
+            for ident, frame in _current_frames().items():
+                if ident == own_ident:
+                    continue
+                samples[self.__collapse(names.get(ident, ident), frame)] += 1
+            self.__sample_count += 1
+
+    @classmethod
+    def __collapse(cls, thread_name, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('%s:%s:%d' % (code.co_name, basename(code.co_filename), frame.f_lineno))
+            frame = frame.f_back
+        stack.append('%s' % thread_name)
+        stack.reverse()
+        # Separators must not appear within frames
+        return ';'.join(entry.replace(';', ',').replace(' ', '_') for entry in stack)
@@ -16,19 +16,28 @@ from __future__ import unicode_literals
 
 from os import getpid, kill, path
 from threading import Thread
-from time import sleep
 import logging
 logger = logging.getLogger(__name__)
 
-from IoticAgent import IOT
 from IoticAgent.Core.Const import P_LID, P_ENTITY_LID, R_CONTROL
+from IoticAgent.Core.compat import Event, Lock, monotonic
 
 from .compat import SIGUSR1
 from .import_helper import getItemFromModule
 from .Stash import Stash
+from .Stash.ClientPool import ClientPool
+from .Stash.Governor import OP_ALL, OP_CREATE, OP_META, OP_SHARE
 from .SourceBase import SourceBase
 
 
+# Options applied to the stash, workers & agent (rather than the source), so changes to these require a restart
+_RUNNER_OPTIONS = frozenset(('agent', 'workers', 'workers_max', 'processes', 'agents', 'pending_max',
+                             'pending_max_bytes', 'pending_wait', 'rate', 'rate_' + OP_CREATE, 'rate_' + OP_META,
+                             'rate_' + OP_SHARE, 'outage_failures', 'outage_drain_rate', 'recover_rate',
+                             'recover_share_max_age', 'lock_stats', 'trace_operations', 'record_diffs',
+                             'share_latency_by_lid'))
+
+
 class Runner(object):  # pylint: disable=too-many-instance-attributes
 
     def __init__(self, name, config, stop, datapath):
@@ -37,18 +46,50 @@ class Runner(object):  # pylint: disable=too-many-instance-attributes
         self.__name = name
         self.__config = config
         self.__stop = stop
+        # Set when stop is set or the source is being reloaded
+        self.__source_stop = Event()
+        # Source class & config to run once the current source has stopped
+        self.__reload = None
+        self.__reload_lock = Lock()
         self.__datapath = datapath
         #
         self.__agentfile = None
         self.__workers = 1
+        self.__workers_max = None
+        self.__processes = 0
+        self.__agents = 1
+        self.__pending = {}
+        self.__rates = {}
+        self.__outage = {}
+        self.__recover = {}
+        self.__lock_stats = False
+        self.__trace_operations = False
+        self.__record_diffs = False
+        self.__share_latency_by_lid = False
+        # Startup phase to duration (seconds)
+        self.__timings = {}
         #
         self.__validate_config()
         #
-        self.__agent = IOT.Client(config=self.__agentfile)
+        started = monotonic()
+        self.__agent = ClientPool.from_config(self.__agentfile, self.__agents)
+        self.__timings['client'] = monotonic() - started
+        started = monotonic()
         fname = path.join(datapath, name + '.json')
-        self.__stash = Stash(fname, self.__agent, self.__workers)
+        options = dict(self.__pending)
+        options.update(self.__outage)
+        options.update(self.__recover)
+        self.__stash = Stash(fname, self.__agent, self.__workers, num_processes=self.__processes,
+                             agentfile=self.__agentfile, max_workers=self.__workers_max,
+                             rates=self.__rates, lock_stats=self.__lock_stats,
+                             trace_operations=self.__trace_operations, record_diffs=self.__record_diffs,
+                             share_latency_by_lid=self.__share_latency_by_lid, **options)
+        self.__timings['stash'] = monotonic() - started
+        started = monotonic()
         self.__modinst = self.__load_configure_module_instance()
+        self.__timings['source'] = monotonic() - started
         self.__thread = None
+        self.__stop_thread = None
 
     def __validate_config(self):
         if 'import' not in self.__config:
@@ -66,14 +107,105 @@ class Runner(object):  # pylint: disable=too-many-instance-attributes
         self.__agentfile = self.__config['agent']
         if 'workers' in self.__config:
             self.__workers = int(self.__config['workers'])
+        if 'workers_max' in self.__config:
+            self.__workers_max = int(self.__config['workers_max'])
+            if self.__workers_max < self.__workers:
+                msg = "[%s] workers_max must be >= workers" % self.__name
+                logger.error(msg)
+                raise ValueError(msg)
+        if 'processes' in self.__config:
+            self.__processes = int(self.__config['processes'])
+            if self.__processes < 0:
+                msg = "[%s] processes must be >= 0" % self.__name
+                logger.error(msg)
+                raise ValueError(msg)
+        if 'agents' in self.__config:
+            self.__agents = int(self.__config['agents'])
+            if self.__agents < 1:
+                msg = "[%s] agents must be >= 1" % self.__name
+                logger.error(msg)
+                raise ValueError(msg)
+            if self.__agents > 1 and self.__processes:
+                msg = "[%s] agents cannot be used with processes (each process has its own agent)" % self.__name
+                logger.error(msg)
+                raise ValueError(msg)
+        self.__validate_limits()
+        self.__validate_recovery()
+        self.__validate_diagnostics()
 
-    # To be called AFTER __validate_config
-    def __load_configure_module_instance(self):
-        module = getItemFromModule(self.__config['import'])
-        if not issubclass(module, SourceBase):
+    def __validate_limits(self):
+        """Pending update & rate limits"""
+        for key, conv, minimum in (('pending_max', int, 1), ('pending_max_bytes', int, 1), ('pending_wait', float, 0)):
+            if key in self.__config:
+                self.__pending[key] = conv(self.__config[key])
+                if self.__pending[key] < minimum:
+                    msg = "[%s] %s must be >= %s" % (self.__name, key, minimum)
+                    logger.error(msg)
+                    raise ValueError(msg)
+
+        for op in (OP_ALL, OP_CREATE, OP_META, OP_SHARE):
+            key = 'rate' if op == OP_ALL else 'rate_' + op
+            if key in self.__config:
+                self.__rates[op] = float(self.__config[key])
+                if self.__rates[op] <= 0:
+                    msg = "[%s] %s must be > 0" % (self.__name, key)
+                    logger.error(msg)
+                    raise ValueError(msg)
+
+    def __validate_recovery(self):
+        """Outage & startup recovery options"""
+        for key, minimum in (('outage_failures', 0), ('outage_drain_rate', 1)):
+            if key in self.__config:
+                self.__outage[key] = int(self.__config[key])
+                if self.__outage[key] < minimum:
+                    msg = "[%s] %s must be >= %d" % (self.__name, key, minimum)
+                    logger.error(msg)
+                    raise ValueError(msg)
+
+        if 'recover_rate' in self.__config:
+            self.__recover['recover_rate'] = int(self.__config['recover_rate'])
+            if self.__recover['recover_rate'] < 0:
+                msg = "[%s] recover_rate must be >= 0" % self.__name
+                logger.error(msg)
+                raise ValueError(msg)
+        if 'recover_share_max_age' in self.__config:
+            self.__recover['recover_share_max_age'] = float(self.__config['recover_share_max_age'])
+            if self.__recover['recover_share_max_age'] <= 0:
+                msg = "[%s] recover_share_max_age must be > 0" % self.__name
+                logger.error(msg)
+                raise ValueError(msg)
+
+    def __validate_diagnostics(self):
+        self.__lock_stats = self.__bool_option('lock_stats', self.__lock_stats)
+        self.__trace_operations = self.__bool_option('trace_operations', self.__trace_operations)
+        if self.__trace_operations and self.__processes:
+            msg = "[%s] trace_operations cannot be used with processes" % self.__name
+            logger.error(msg)
+            raise ValueError(msg)
+        self.__record_diffs = self.__bool_option('record_diffs', self.__record_diffs)
+        self.__share_latency_by_lid = self.__bool_option('share_latency_by_lid', self.__share_latency_by_lid)
+
+    def __bool_option(self, key, default):
+        if key not in self.__config:
+            return default
+        value = self.__config[key].lower()
+        if value not in ('true', 'false', 'yes', 'no', 'on', 'off', '1', '0'):
+            msg = "[%s] %s must be true or false" % (self.__name, key)
+            logger.error(msg)
+            raise ValueError(msg)
+        return value in ('true', 'yes', 'on', '1')
+
+    @classmethod
+    def __load_module(cls, name, reimport=False):
+        module = getItemFromModule(name, reload=reimport)
+        if not (isinstance(module, type) and issubclass(module, SourceBase)):
             raise TypeError("Expecting subclass of SourceBase, got %s" % type(module))
+        return module
 
-        modinst = module(self.__stash, self.__config, self.__stop)
+    # To be called AFTER __validate_config
+    def __load_configure_module_instance(self):
+        module = self.__load_module(self.__config['import'])
+        modinst = module(self.__stash, self.__config, self.__source_stop)
         self.__agent.register_catchall_controlreq(self.__cb_control, callback_parsed=self.__cb_control_parsed)
         return modinst
 
@@ -90,25 +222,95 @@ class Runner(object):  # pylint: disable=too-many-instance-attributes
     def __cb_control_parsed(self, msg):
         self.__cb_control(msg, parsed=True)
 
+    @property
+    def timings(self):
+        """Startup phase (client, stash, source and - once connected - connect) to duration in seconds"""
+        return dict(self.__timings)
+
     def start(self):
-        self.__agent.start()
+        """Starts the runner. The agent connects in the background (so that multiple runners connect at the same time),
+        the source is only run once connected."""
         self.__thread = Thread(target=self.__run, name=('runner-%s' % self.__name))
         self.__thread.start()
+        self.__stop_thread = Thread(target=self.__propagate_stop, name=('runner-%s-stop' % self.__name))
+        self.__stop_thread.daemon = True
+        self.__stop_thread.start()
 
     def stop(self):
         self.__stop.set()
 
+    def reload(self, config=None):
+        """Stops the source and starts it again (re-importing its module) with the given config section (or the
+        current one), using the same stash, workers & agent. Changes to options other than those used by the source
+        only take effect on restart. Raises ValueError, TypeError or ImportError if the (new) source cannot be loaded
+        or initialised, in which case the current one keeps running."""
+        if config is None:
+            config = self.__config
+        if 'import' not in config:
+            msg = "[%s] Config requires import = module.name" % self.__name
+            logger.error(msg)
+            raise ValueError(msg)
+        ignored = sorted(key for key in _RUNNER_OPTIONS if config.get(key) != self.__config.get(key))
+        if ignored:
+            logger.warning("[%s] Changes to %s require restart", self.__name, ', '.join(ignored))
+        module = self.__load_module(config['import'], reimport=True)
+        # Initialised before stopping the current source so that it can keep running if this fails
+        try:
+            modinst = module(self.__stash, config, self.__source_stop)
+        except:
+            logger.error("[%s] Failed to initialise reloaded source", self.__name, exc_info=True)
+            raise ValueError("[%s] Failed to initialise reloaded source" % self.__name)
+        with self.__reload_lock:
+            self.__reload = (modinst, config)
+        logger.info("[%s] Reloading source", self.__name)
+        self.__source_stop.set()
+
+    def __propagate_stop(self):
+        self.__stop.wait()
+        self.__source_stop.set()
+
+    def __next_source(self):
+        """Returns whether a new (reloaded) source is to be run"""
+        with self.__reload_lock:
+            pending, self.__reload = self.__reload, None
+        if pending is None:
+            return False
+        self.__source_stop.clear()
+        # Stop might have been propagated just before clearing
+        if self.__stop.is_set():
+            return False
+        self.__modinst, self.__config = pending
+        logger.info("[%s] Source reloaded", self.__name)
+        return True
+
+    def __run_source(self):
+        try:
+            self.__modinst.run()
+        finally:
+            self.__modinst.cancel_jobs()
+
     def __run(self):
+        started = monotonic()
+        try:
+            self.__agent.start()
+        except:
+            logger.critical("Runner [%s] failed to connect!  Aborting.", self.__name, exc_info=True)
+            kill(getpid(), SIGUSR1)
+            return
+        self.__timings['connect'] = monotonic() - started
+        logger.info("Runner [%s] startup: Client=%.3fs, Stash=%.3fs, Source=%.3fs, Connect=%.3fs", self.__name,
+                    *(self.__timings[phase] for phase in ('client', 'stash', 'source', 'connect')))
         with self.__stash:
             try:
-                self.__modinst.run()
+                self.__run_source()
+                while self.__next_source():
+                    self.__run_source()
             except:
                 logger.critical("Runner died!  Aborting.", exc_info=True)
                 kill(getpid(), SIGUSR1)
             if not self.__stop.is_set():
-                while not self.__stash.queue_empty:
+                while not self.__stash.flush(timeout=5):
                     logger.info("Runner finished but stop not set!  Draining work queue.")
-                    sleep(5)
         self.__agent.stop()
 
     def is_alive(self):
@@ -0,0 +1,159 @@
+# Copyright (c) 2017 Iotic Labs Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://github.com/Iotic-Labs/py-IoticBulkData/blob/master/LICENSE
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Periodic jobs (e.g. polling of an external API) for all sources in a process, see SourceBase.every
+"""
+
+from __future__ import unicode_literals
+
+from os import getpid, kill
+from heapq import heappush, heappop
+from itertools import count
+from random import uniform
+from threading import Thread, Condition
+import logging
+logger = logging.getLogger(__name__)
+
+from IoticAgent.Core.compat import Event, Lock, monotonic
+
+from .compat import SIGUSR1
+from .Metrics import REGISTRY
+
+
+_RUN_TIME = REGISTRY.histogram('ioticiser_job_run_seconds', 'Time taken by scheduled job runs', ('source', 'job'),
+                               buckets=(.01, .05, .1, .5, 1, 5, 10, 30, 60, 300, 600))
+_OVERRUNS = REGISTRY.counter('ioticiser_job_overruns_total',
+                             'Scheduled job runs skipped since the previous run was still in progress',
+                             ('source', 'job'))
+_INTERVAL = REGISTRY.gauge('ioticiser_job_interval_seconds', 'Interval of scheduled job', ('source', 'job'))
+
+
+class Job(object):  # pylint: disable=too-many-instance-attributes
+    """Periodic job, see Scheduler.every"""
+
+    def __init__(self, fn, interval, jitter, stop, labels):
+        # pylint: disable=too-many-arguments
+        self.fn = fn
+        self.interval = interval
+        self.jitter = jitter
+        self.stop = stop
+        # (source, job) name
+        self.labels = labels
+        self.running = False
+        self.cancelled = False
+        # Whether labels are still reserved for this job (see Scheduler.every)
+        self.registered = True
+        # Set whilst not running
+        self.idle = Event()
+        self.idle.set()
+
+    @property
+    def name(self):
+        return '%s/%s' % self.labels
+
+
+class Scheduler(object):
+    """Runs jobs at fixed intervals, each run in its own thread so that a slow job (e.g. a poll of an unresponsive API)
+    does not delay others. Due runs are held in a single heap, serviced by one thread (started when the first job is
+    added)."""
+
+    def __init__(self):
+        self.__cond = Condition(Lock())
+        # Heap of (due time, sequence, slot time, Job). Slot time excludes jitter (so that it does not accumulate).
+        self.__due = []
+        self.__seq = count()
+        self.__thread = None
+        # Labels of jobs which have not been cancelled or stopped yet
+        self.__labels = set()
+
+    def every(self, interval, fn, jitter=0, stop=None, labels=('', '')):
+        """Runs fn (without arguments) every interval seconds, the first run being due immediately, until the job is
+        cancelled or stop (Event, if set) is set. Each run is delayed by a random amount of up to jitter seconds so that
+        jobs with the same interval (e.g. after a restart) do not all run at the same time. If a run is due whilst the
+        previous one is still in progress, it is skipped (and counted as overrun). If fn raises, the Ioticiser is
+        aborted (as if the source's run had raised). labels - (source, job) name for metrics & logging, which must not
+        be used by another job which is still scheduled (raises ValueError). Returns Job."""
+        # pylint: disable=too-many-arguments
+        if interval <= 0:
+            raise ValueError('interval must be > 0')
+        if not 0 <= jitter <= interval:
+            raise ValueError('jitter must be between 0 and interval')
+        job = Job(fn, interval, jitter, stop, labels)
+        now = monotonic()
+        with self.__cond:
+            if labels in self.__labels:
+                raise ValueError('job %s already scheduled' % job.name)
+            self.__labels.add(labels)
+            _INTERVAL.set(interval, labels)
+            heappush(self.__due, (now + uniform(0, jitter), next(self.__seq), now, job))
+            if self.__thread is None:
+                self.__thread = Thread(target=self.__run, name='scheduler')
+                self.__thread.daemon = True
+                self.__thread.start()
+            self.__cond.notify()
+        return job
+
+    def cancel(self, job, wait=True):
+        """Stops further runs of job and (if wait is set) waits for the current one (if any) to finish"""
+        with self.__cond:
+            job.cancelled = True
+            self.__unregister(job)
+        if wait:
+            job.idle.wait()
+
+    def __run(self):
+        cond = self.__cond
+        due = self.__due
+        while True:
+            with cond:
+                while not due or due[0][0] > monotonic():
+                    cond.wait((due[0][0] - monotonic()) if due else None)
+                _, _, slot, job = heappop(due)
+                if job.cancelled or (job.stop is not None and job.stop.is_set()):
+                    self.__unregister(job)
+                    continue
+                if job.running:
+                    _OVERRUNS.inc(job.labels)
+                    logger.debug("Job %s still running, skipping run", job.name)
+                else:
+                    job.running = True
+                    job.idle.clear()
+                    thread = Thread(target=self.__run_job, name=('job-%s' % job.name), args=(job,))
+                    thread.daemon = True
+                    thread.start()
+                slot += job.interval
+                heappush(due, (slot + uniform(0, job.jitter), next(self.__seq), slot, job))
+
+    def __unregister(self, job):
+        """Frees job's labels (for use by a new job). Must be called with cond held."""
+        if job.registered:
+            job.registered = False
+            self.__labels.discard(job.labels)
+            _INTERVAL.remove(job.labels)
+
+    def __run_job(self, job):
+        started = monotonic()
+        try:
+            job.fn()
+        except:
+            logger.critical("Job %s died!  Aborting.", job.name, exc_info=True)
+            kill(getpid(), SIGUSR1)
+        finally:
+            _RUN_TIME.observe(monotonic() - started, job.labels)
+            with self.__cond:
+                job.running = False
+                job.idle.set()
+
+
+# Shared by all sources in the process
+SCHEDULER = Scheduler()
@@ -14,6 +14,8 @@
 
 from __future__ import unicode_literals
 
+from .Scheduler import SCHEDULER
+
 
 class SourceBase(object):
     """Source base class
@@ -23,12 +25,42 @@ class SourceBase(object):
         self._stash = stash
         self._config = config
         self._stop = stop
+        self.__jobs = []
 
     def run(self):
         """Entry point for the Source
         """
         raise NotImplementedError
 
+    def _pressure(self):
+        """How close the stash is to its limit of pending updates (see pending_max & pending_max_bytes config). 0 if no
+        limits are configured, 1 or above if updates are being throttled. Polling sources can use this to slow down
+        rather than generate updates faster than they can be handled.
+        """
+        return self._stash.pressure
+
+    def every(self, interval, fn, jitter=0, name=None):
+        """Runs fn (without arguments) every interval seconds, in its own thread, until the source is stopped. Runs are
+        delayed by a random amount of up to jitter seconds, so that e.g. polls do not all happen at the same time. A run
+        is skipped if the previous one has not yet finished (see ioticiser_job_overruns_total metric). name identifies
+        the job in logs & metrics (default: name of fn) and must be unique within the source (raises ValueError).
+        Returns Job (see Scheduler), e.g. to cancel it. Sources only using jobs can then just wait in run:
+
+            def run(self):
+                self.every(60, self.poll, jitter=5)
+                self._stop.wait()
+        """
+        job = SCHEDULER.every(interval, fn, jitter=jitter, stop=self._stop,
+                              labels=(self._stash.name, name or fn.__name__.lstrip('_')))
+        self.__jobs.append(job)
+        return job
+
+    def cancel_jobs(self):
+        """Cancels all jobs (see every) and waits for running ones to finish. Called once run has returned."""
+        jobs, self.__jobs = self.__jobs, []
+        for job in jobs:
+            SCHEDULER.cancel(job)
+
     def control_callback(self, thing, control, msg):
         """Override to handle control request callbacks. `thing` & `control` are Stash object instances associated with
         the control. `msg` has the same format as IoticAgent.IOT's control callback. Note that this callback will not be
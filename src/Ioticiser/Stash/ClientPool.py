@@ -0,0 +1,140 @@
+# Copyright (c) 2017 Iotic Labs Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://github.com/Iotic-Labs/py-IoticBulkData/blob/master/LICENSE
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Pool of agent connections (using the same credentials) with per-connection request statistics
+"""
+
+from __future__ import unicode_literals
+
+import logging
+logger = logging.getLogger(__name__)
+
+from IoticAgent.Core.compat import Lock, monotonic
+from IoticAgent.Core.Const import P_ENTITY_LID
+
+from .ThreadPool import lid_shard
+
+
+STATS_IN_FLIGHT = 'in_flight'
+STATS_REQUESTS = 'requests'
+STATS_LATENCY_AVG = 'latency_avg'
+STATS_LATENCY_MAX = 'latency_max'
+
+
+def create_iot_client(agentfile):
+    """Default client factory"""
+    # Only imported when needed since IoticAgent.IOT (and so rdflib) is slow to import
+    from IoticAgent import IOT
+    return IOT.Client(config=agentfile)
+
+
+class ConnectionStats(object):
+    """Request statistics for a single agent connection. Latency is measured from a request being issued until it
+    has been waited for."""
+
+    def __init__(self):
+        self.__lock = Lock()
+        self.__in_flight = 0
+        self.__requests = 0
+        self.__latency_total = 0
+        self.__latency_max = 0
+        # Never reset (unlike above)
+        self.__requests_cumulative = 0
+        self.__latency_cumulative = 0
+
+    def started(self):
+        """Returns the start time to pass to finished()"""
+        with self.__lock:
+            self.__in_flight += 1
+        return monotonic()
+
+    def finished(self, started):
+        latency = monotonic() - started
+        with self.__lock:
+            self.__in_flight -= 1
+            self.__requests += 1
+            self.__latency_total += latency
+            self.__requests_cumulative += 1
+            self.__latency_cumulative += latency
+            if latency > self.__latency_max:
+                self.__latency_max = latency
+
+    def collect(self):
+        """Returns dict of statistics since the previous call (apart from the current number of requests in flight)"""
+        with self.__lock:
+            ret = {STATS_IN_FLIGHT: self.__in_flight,
+                   STATS_REQUESTS: self.__requests,
+                   STATS_LATENCY_AVG: (self.__latency_total / self.__requests) if self.__requests else 0,
+                   STATS_LATENCY_MAX: self.__latency_max}
+            self.__requests = 0
+            self.__latency_total = self.__latency_max = 0
+            return ret
+
+    def totals(self):
+        """Returns tuple of total number of requests and their total latency since creation"""
+        with self.__lock:
+            return self.__requests_cumulative, self.__latency_cumulative
+
+
+class ClientPool(object):
+    """Set of agent connections. Each LID is consistently mapped to the same connection so that ownership of the
+    entities (and their points) created on its behalf remains stable."""
+
+    def __init__(self, clients):
+        if not clients:
+            raise ValueError("At least one client required")
+        self.__clients = tuple(clients)
+        self.__stats = tuple(ConnectionStats() for _ in self.__clients)
+
+    @classmethod
+    def from_config(cls, agentfile, count=1, client_factory=create_iot_client):
+        return cls([client_factory(agentfile) for _ in range(count)])
+
+    def __len__(self):
+        return len(self.__clients)
+
+    def start(self):
+        for client in self.__clients:
+            client.start()
+
+    def stop(self):
+        for client in self.__clients:
+            try:
+                client.stop()
+            except:
+                logger.warning("Failed to stop client", exc_info=True)
+
+    def for_lid(self, lid):
+        """Returns tuple of client & its ConnectionStats instance for the given LID"""
+        idx = lid_shard(lid, len(self.__clients)) if len(self.__clients) > 1 else 0
+        return self.__clients[idx], self.__stats[idx]
+
+    def collect_stats(self):
+        """Returns list of ConnectionStats.collect() results, one per connection"""
+        return [stats.collect() for stats in self.__stats]
+
+    def totals(self):
+        """Returns tuple of total number of requests and their total latency across all connections"""
+        requests = latency = 0
+        for stats in self.__stats:
+            stats_requests, stats_latency = stats.totals()
+            requests += stats_requests
+            latency += stats_latency
+        return requests, latency
+
+    def register_catchall_controlreq(self, callback, callback_parsed=None):
+        for client in self.__clients:
+            client.register_catchall_controlreq(callback, callback_parsed=callback_parsed)
+
+    def confirm_tell(self, data, success):
+        self.for_lid(data[P_ENTITY_LID])[0].confirm_tell(data, success)
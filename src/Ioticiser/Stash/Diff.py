@@ -0,0 +1,209 @@
+# Copyright (c) 2017 Iotic Labs Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://github.com/Iotic-Labs/py-IoticBulkData/blob/master/LICENSE
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Diffs (changes to a thing and its points not yet made in Iotic Space) and helpers for them
+
+Diffs are immutable records which do not share any (mutable) state with the Thing instances they were produced from
+(share data is deep-copied into them). Since they are tuples, diffs can be serialised (e.g. with ubjson) as they are,
+see from_wire() for the reverse. Fields must only ever be appended to keep this encoding stable.
+"""
+
+from __future__ import unicode_literals
+
+from collections import namedtuple, OrderedDict
+from calendar import timegm
+from datetime import datetime
+
+from IoticAgent.Core.compat import string_types
+
+from .const import LID, FOC, PUBLIC, TAGS, LOCATION, POINTS, VALUES, LABELS, DESCRIPTIONS, RECENT
+from .const import VTYPE, LANG, DESCRIPTION, UNIT, SHAREDATA, SHARETIME, CREATED, NEW
+
+
+SHARE_TIME_FMT = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+
+class ValueDiff(namedtuple('ValueDiff', 'label vtype lang description unit shared sharedata')):
+    """Value (re)definition (unless vtype is None) and/or data to share for value (if shared)"""
+    __slots__ = ()
+
+
+class PointDiff(namedtuple('PointDiff', 'pid foc new recent tags labels descriptions values shared sharedata '
+                                        'sharetime')):
+    """Changes to a point. Fields which are None have not changed. labels & descriptions are tuples of (lang, text)
+    pairs for the changed languages only, values a tuple of ValueDiff. sharetime is a string (see SHARE_TIME_FMT)."""
+    __slots__ = ()
+
+
+class ThingDiff(namedtuple('ThingDiff', 'lid new created public tags location labels descriptions points')):
+    """Changes to a thing (see PointDiff for field conventions). created is the (unix) time the diff was made. points
+    is a tuple of PointDiff."""
+    __slots__ = ()
+
+
+def format_share_time(sharetime):
+    """Returns (UTC) string representation of the given datetime (or None)"""
+    if sharetime is None:
+        return None
+    offset = sharetime.utcoffset()
+    if offset is not None:
+        sharetime = (sharetime - offset).replace(tzinfo=None)
+    return sharetime.strftime(SHARE_TIME_FMT)
+
+
+def _pairs(items):
+    return tuple((key, val) for key, val in items)
+
+
+def _optional_tuple(seq):
+    return None if seq is None else tuple(seq)
+
+
+def from_wire(data):
+    """Returns ThingDiff from its deserialised form (where tuples will have become lists)"""
+    points = []
+    for pid, foc, new, recent, tags, labels, descriptions, values, shared, sharedata, sharetime in data[8]:
+        points.append(PointDiff(pid, foc, new, recent, _optional_tuple(tags), _pairs(labels), _pairs(descriptions),
+                                tuple(ValueDiff(*value) for value in values), shared, sharedata, sharetime))
+    return ThingDiff(data[0], data[1], data[2], data[3], _optional_tuple(data[4]), _optional_tuple(data[5]),
+                     _pairs(data[6]), _pairs(data[7]), tuple(points))
+
+
+def from_dict(diff):
+    """Returns ThingDiff from dict based diff (as stored by previous versions)"""
+    points = []
+    for pid, pdiff in diff.get(POINTS, {}).items():
+        values = tuple(ValueDiff(label, vdiff.get(VTYPE), vdiff.get(LANG), vdiff.get(DESCRIPTION), vdiff.get(UNIT),
+                                 SHAREDATA in vdiff, vdiff.get(SHAREDATA))
+                       for label, vdiff in pdiff.get(VALUES, {}).items())
+        points.append(PointDiff(pid, pdiff[FOC], pdiff.get(NEW, False), pdiff.get(RECENT),
+                                _optional_tuple(pdiff.get(TAGS)),
+                                _pairs(pdiff.get(LABELS, {}).items()), _pairs(pdiff.get(DESCRIPTIONS, {}).items()),
+                                values, SHAREDATA in pdiff, pdiff.get(SHAREDATA), pdiff.get(SHARETIME)))
+    return ThingDiff(diff[LID], diff.get(NEW, False), diff.get(CREATED), diff.get(PUBLIC),
+                     _optional_tuple(diff.get(TAGS)), _optional_tuple(diff.get(LOCATION)),
+                     _pairs(diff.get(LABELS, {}).items()), _pairs(diff.get(DESCRIPTIONS, {}).items()),
+                     tuple(points))
+
+
+def load(data):
+    """Returns ThingDiff from either deserialised form (see from_wire & from_dict)"""
+    return from_dict(data) if isinstance(data, dict) else from_wire(data)
+
+
+def _has_share(pdiff):
+    return pdiff.shared or pdiff.sharetime is not None or any(vdiff.shared for vdiff in pdiff.values)
+
+
+def _drop_share(pdiff):
+    values = tuple(vdiff._replace(shared=False, sharedata=None) for vdiff in pdiff.values if vdiff.vtype is not None)
+    return pdiff._replace(shared=False, sharedata=None, sharetime=None, values=values)
+
+
+def _merge_pairs(old, new):
+    # Only affect subset of all labels/descriptions, rest replace previous
+    if not new:
+        return old
+    merged = OrderedDict(old)
+    merged.update(new)
+    return tuple(merged.items())
+
+
+def _newer(old, new):
+    return old if new is None else new
+
+
+def _merge_value(old, new):
+    if new.vtype is not None:
+        old = old._replace(vtype=new.vtype, lang=new.lang, description=new.description, unit=new.unit)
+    if new.shared:
+        old = old._replace(shared=True, sharedata=new.sharedata)
+    return old
+
+
+def _merge_point(old, new):
+    # Share data & time belong together, so a newer share replaces the previous one completely
+    if _has_share(new):
+        old = _drop_share(old)
+    values = OrderedDict((vdiff.label, vdiff) for vdiff in old.values)
+    for vdiff in new.values:
+        try:
+            values[vdiff.label] = _merge_value(values[vdiff.label], vdiff)
+        except KeyError:
+            values[vdiff.label] = vdiff
+    return PointDiff(new.pid, new.foc, old.new or new.new, _newer(old.recent, new.recent), _newer(old.tags, new.tags),
+                     _merge_pairs(old.labels, new.labels), _merge_pairs(old.descriptions, new.descriptions),
+                     tuple(values.values()),
+                     old.shared or new.shared, new.sharedata if new.shared else old.sharedata,
+                     _newer(old.sharetime, new.sharetime))
+
+
+def merge_diff(old, new):
+    """Returns diff equivalent to applying the older diff old and then new (for the same LID), except that only the
+    most recent share of each point is kept."""
+    points = OrderedDict((pdiff.pid, pdiff) for pdiff in old.points)
+    for pdiff in new.points:
+        try:
+            points[pdiff.pid] = _merge_point(points[pdiff.pid], pdiff)
+        except KeyError:
+            points[pdiff.pid] = pdiff
+    return ThingDiff(new.lid, old.new or new.new, new.created, _newer(old.public, new.public),
+                     _newer(old.tags, new.tags), _newer(old.location, new.location),
+                     _merge_pairs(old.labels, new.labels), _merge_pairs(old.descriptions, new.descriptions),
+                     tuple(points.values()))
+
+
+def has_share(diff):
+    """Whether the diff shares data for any of its points"""
+    return any(_has_share(pdiff) for pdiff in diff.points)
+
+
+def _share_time(pdiff, default):
+    """Returns share time of point diff as unix time or default if it has no (valid) share time"""
+    sharetime = pdiff.sharetime
+    if isinstance(sharetime, string_types):
+        try:
+            sharetime = datetime.strptime(sharetime, SHARE_TIME_FMT)
+        except ValueError:
+            return default
+    if isinstance(sharetime, datetime):
+        return timegm(sharetime.utctimetuple()) + sharetime.microsecond / 1e6
+    return default
+
+
+def drop_old_shares(diff, before):
+    """Returns diff without share data for points which was shared before the given unix time. The share time of a
+    point is its explicit share time or otherwise the time the diff was created (if known)."""
+    points = []
+    for pdiff in diff.points:
+        if _has_share(pdiff):
+            sharetime = _share_time(pdiff, diff.created)
+            if sharetime is not None and sharetime < before:
+                pdiff = _drop_share(pdiff)
+        points.append(pdiff)
+    return diff._replace(points=tuple(points))
+
+
+def _is_empty_point(pdiff):
+    if pdiff.recent is not None or pdiff.tags is not None or pdiff.sharetime is not None:
+        return False
+    return not (pdiff.labels or pdiff.descriptions or pdiff.values or pdiff.shared)
+
+
+def is_empty(diff):
+    """Whether applying the diff would have no effect"""
+    if diff.public is not None or diff.tags is not None or diff.location is not None:
+        return False
+    if diff.labels or diff.descriptions:
+        return False
+    return all(_is_empty_point(pdiff) for pdiff in diff.points)
@@ -0,0 +1,188 @@
+# Copyright (c) 2017 Iotic Labs Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://github.com/Iotic-Labs/py-IoticBulkData/blob/master/LICENSE
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Memory footprint of stash state, either of a running Stash (see Stash.footprint) or of a stash file:
+
+    python -m Ioticiser.Stash.Footprint ../data/MySource.ubjz --top 20
+"""
+
+from __future__ import unicode_literals, print_function
+
+from argparse import ArgumentParser
+from sys import getsizeof
+from heapq import nlargest
+from gzip import open as gzip_open
+import json
+import ubjson
+
+from IoticAgent.Core.compat import string_types
+
+from .Diff import load as load_diff
+from .const import THINGS, DIFF, POINTS, THING, LABELS, DESCRIPTIONS, TAGS, VALUES
+
+
+CAT_LABELS = 'labels'
+CAT_DESCRIPTIONS = 'descriptions'
+CAT_TAGS = 'tags'
+CAT_VALUES = 'values'
+# Containers, LIDs/PIDs and remaining (small) fields
+CAT_OTHER = 'other'
+CAT_DIFFS = 'pending_diffs'
+# Agent thing & point objects held by workers (see ThreadPool.cache_snapshot)
+CAT_CACHE = 'worker_cache'
+
+_CATEGORIES = {LABELS: CAT_LABELS,
+               DESCRIPTIONS: CAT_DESCRIPTIONS,
+               TAGS: CAT_TAGS,
+               VALUES: CAT_VALUES}
+
+# Longest (duplicated) string to include in report
+_MAX_STRING = 60
+
+
+class _Walker(object):
+    """Sums sizes of objects, counting each object only once (so shared objects are attributed to the first referrer)
+    and recording how often equal strings are held as separate objects."""
+
+    def __init__(self):
+        self.__seen = set()
+        # String value to list of number of separate objects, size of each
+        self.strings = {}
+
+    def shallow(self, obj):
+        if id(obj) in self.__seen:
+            return 0
+        self.__seen.add(id(obj))
+        return getsizeof(obj)
+
+    def deep(self, obj):
+        size = self.shallow(obj)
+        if not size:
+            return 0
+        if isinstance(obj, (string_types, bytes)):
+            try:
+                self.strings[obj][0] += 1
+            except KeyError:
+                self.strings[obj] = [1, size]
+        elif isinstance(obj, dict):
+            for key, value in obj.items():
+                size += self.deep(key) + self.deep(value)
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            for item in obj:
+                size += self.deep(item)
+        return size
+
+    def instance(self, obj):
+        """Size of object and its attributes, not following references to other (non-builtin) objects such as the
+        agent client"""
+        size = self.shallow(obj)
+        if not size:
+            return 0
+        attrs = getattr(obj, '__dict__', None)
+        if attrs is not None:
+            size += self.shallow(attrs)
+            for key, value in attrs.items():
+                size += self.deep(key)
+                if isinstance(value, (string_types, bytes, int, float, dict, list, tuple, set, frozenset)):
+                    size += self.deep(value)
+        return size
+
+
+def _analyse_cache(walker, cache):
+    """Returns number of things, points & bytes used by the given worker cache"""
+    size = walker.shallow(cache)
+    points = 0
+    for lid, entry in cache.items():
+        size += walker.deep(lid) + walker.shallow(entry) + walker.instance(entry[THING])
+        size += walker.shallow(entry[POINTS])
+        for pid, point in entry[POINTS].items():
+            points += 1
+            size += walker.deep(pid) + walker.instance(point)
+    return len(cache), points, size
+
+
+def analyse(state, top=10, cache=None):
+    """Returns dict describing the memory used by the given stash state (as held by Stash) and, if given, worker cache
+    (see ThreadPool.cache_snapshot): bytes by category, the top heaviest LIDs and duplicate string statistics. Objects
+    shared between things (or between the state and the cache) are only counted once."""
+    # pylint: disable=too-many-locals
+    walker = _Walker()
+    categories = dict.fromkeys(list(_CATEGORIES.values()) + [CAT_OTHER, CAT_DIFFS], 0)
+    lids = {}
+    points = 0
+
+    walker.shallow(state)
+    things = state[THINGS]
+    categories[CAT_OTHER] += walker.shallow(things)
+    for lid, thing in things.items():
+        size = walker.shallow(thing) + walker.deep(lid)
+        categories[CAT_OTHER] += size
+        for key, value in thing.items():
+            if key == POINTS:
+                other = walker.shallow(value) + walker.deep(key)
+                for pid, point in value.items():
+                    points += 1
+                    other += walker.shallow(point) + walker.deep(pid)
+                    for pkey, pvalue in point.items():
+                        pdsize = walker.deep(pkey) + walker.deep(pvalue)
+                        categories[_CATEGORIES.get(pkey, CAT_OTHER)] += pdsize
+                        size += pdsize
+                categories[CAT_OTHER] += other
+                size += other
+            else:
+                tdsize = walker.deep(key) + walker.deep(value)
+                categories[_CATEGORIES.get(key, CAT_OTHER)] += tdsize
+                size += tdsize
+        lids[lid] = size
+    categories[CAT_DIFFS] = walker.deep(state[DIFF])
+    cache_counts = None
+    if cache is not None:
+        cache_things, cache_points, categories[CAT_CACHE] = _analyse_cache(walker, cache)
+        cache_counts = {'things': cache_things, 'points': cache_points}
+
+    strings = walker.strings
+    duplicates = [(value, copies, (copies - 1) * size) for value, (copies, size) in strings.items() if copies > 1]
+    return {'things': len(things),
+            'points': points,
+            'pending_diffs': len(state[DIFF]),
+            'worker_cache': cache_counts,
+            'bytes': categories,
+            'total_bytes': sum(categories.values()),
+            'heaviest_lids': nlargest(top, lids.items(), key=lambda item: item[1]),
+            'strings': {'objects': sum(copies for copies, _ in strings.values()),
+                        'unique': len(strings),
+                        'duplicate_bytes': sum(wasted for _, _, wasted in duplicates),
+                        'top_duplicates': [(value[:_MAX_STRING], copies, wasted) for value, copies, wasted
+                                           in nlargest(top, duplicates, key=lambda item: item[2])]}}
+
+
+def load(fname):
+    """Returns stash state from the given (.ubjz) file, in the same form as held by Stash"""
+    with gzip_open(fname, 'rb') as f:
+        state = ubjson.load(f, intern_object_keys=True)
+    diffs = state[DIFF]
+    for idx in diffs:
+        diffs[idx] = load_diff(diffs[idx])
+    return state
+
+
+def main():
+    parser = ArgumentParser(description='Memory footprint of stash state in file')
+    parser.add_argument('fname', help='stash file (.ubjz)')
+    parser.add_argument('--top', type=int, default=10, help='number of heaviest LIDs & duplicate strings to list')
+    args = parser.parse_args()
+    print(json.dumps(analyse(load(args.fname), top=args.top), indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+# Copyright (c) 2017 Iotic Labs Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://github.com/Iotic-Labs/py-IoticBulkData/blob/master/LICENSE
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Client-side agent request rate limiting
+"""
+
+from __future__ import unicode_literals
+
+from time import sleep
+
+from IoticAgent.Core.compat import Lock, monotonic
+
+
+# Operation classes (and rate for all requests)
+OP_CREATE = 'create'
+OP_META = 'meta'
+OP_SHARE = 'share'
+OP_ALL = 'all'
+
+# Agent (IOT object) method name to operation class. Unlisted methods are classed as OP_META.
+_OPERATIONS = {
+    'create_thing': OP_CREATE,
+    'create_feed': OP_CREATE,
+    'create_control': OP_CREATE,
+    'create_value': OP_CREATE,
+    'share': OP_SHARE
+}
+
+STATS_REQUESTS = 'requests'
+STATS_WAITED = 'waited'
+STATS_WAIT_AVG = 'wait_avg'
+STATS_WAIT_MAX = 'wait_max'
+
+
+class GovernorStopped(Exception):
+    """Raised when stopping whilst waiting for a token"""
+
+
+class TokenBucket(object):
+    """Allows for rate (per second) tokens to be acquired on average, with up to burst tokens at once."""
+
+    def __init__(self, rate, burst=None):
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        self.__rate = float(rate)
+        self.__burst = max(1.0, float(rate if burst is None else burst))
+        self.__tokens = self.__burst
+        self.__last = monotonic()
+        self.__lock = Lock()
+
+    def acquire(self, stop=None):
+        """Blocks until a token is available. Returns time waited in seconds. If stop (Event) is set whilst waiting,
+        the reserved token is released and GovernorStopped raised."""
+        with self.__lock:
+            now = monotonic()
+            tokens = min(self.__burst, self.__tokens + (now - self.__last) * self.__rate) - 1
+            self.__last = now
+            self.__tokens = tokens
+        # Token has been reserved, so callers are served in order
+        if tokens < 0:
+            wait = -tokens / self.__rate
+            if stop is None:
+                sleep(wait)
+            elif stop.wait(wait):
+                self.release()
+                raise GovernorStopped()
+            return wait
+        return 0
+
+    def release(self):
+        """Returns a token which was acquired but not used"""
+        with self.__lock:
+            self.__tokens += 1
+
+
+class RateGovernor(object):
+    """Limits rate of agent requests by operation class (OP_CREATE, OP_META, OP_SHARE) and/or overall (OP_ALL)."""
+
+    def __init__(self, rates, stop=None):
+        """rates - dict of operation class to maximum requests per second
+        stop - If set (Event), waiting for requests to be allowed is aborted once it is set (see acquire)"""
+        self.__buckets = {op: TokenBucket(rate) for op, rate in rates.items() if op != OP_ALL}
+        self.__all = TokenBucket(rates[OP_ALL]) if OP_ALL in rates else None
+        self.__stop = stop
+        self.__lock = Lock()
+        # Operation class to list of: number of requests, number which had to wait, total & maximum wait
+        self.__stats = {op: [0, 0, 0, 0] for op in (OP_CREATE, OP_META, OP_SHARE)}
+
+    def acquire(self, method):
+        """To be called before issuing a request via the given agent method name. Blocks if the rate of either the
+        method's operation class or of all requests has been exceeded. Raises GovernorStopped if stop is set whilst
+        blocked (in which case the request must not be issued)."""
+        op = _OPERATIONS.get(method, OP_META)
+        wait = 0
+        bucket = self.__buckets.get(op)
+        if bucket is not None:
+            wait += bucket.acquire(self.__stop)
+        if self.__all is not None:
+            try:
+                wait += self.__all.acquire(self.__stop)
+            except GovernorStopped:
+                if bucket is not None:
+                    bucket.release()
+                raise
+        with self.__lock:
+            stats = self.__stats[op]
+            stats[0] += 1
+            if wait:
+                stats[1] += 1
+                stats[2] += wait
+                if wait > stats[3]:
+                    stats[3] = wait
+
+    def collect_stats(self):
+        """Returns dict by operation class of dicts with number of requests, how many had to wait and their average &
+        maximum wait time since the previous call."""
+        with self.__lock:
+            ret = {}
+            for op, stats in self.__stats.items():
+                ret[op] = {STATS_REQUESTS: stats[0],
+                           STATS_WAITED: stats[1],
+                           STATS_WAIT_AVG: (stats[2] / stats[1]) if stats[1] else 0,
+                           STATS_WAIT_MAX: stats[3]}
+                stats[:] = [0, 0, 0, 0]
+            return ret
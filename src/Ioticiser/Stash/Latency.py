@@ -0,0 +1,88 @@
+# Copyright (c) 2017 Iotic Labs Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://github.com/Iotic-Labs/py-IoticBulkData/blob/master/LICENSE
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Rolling latency percentiles
+"""
+
+from __future__ import unicode_literals
+
+from heapq import nlargest
+from random import randrange
+
+from IoticAgent.Core.compat import Lock
+
+
+STATS_COUNT = 'count'
+STATS_P50 = 'p50'
+STATS_P95 = 'p95'
+STATS_P99 = 'p99'
+STATS_MAX = 'max'
+STATS_LIDS = 'lids'
+
+_PERCENTILES = ((STATS_P50, 50), (STATS_P95, 95), (STATS_P99, 99))
+
+
+class LatencyStats(object):  # pylint: disable=too-many-instance-attributes
+    """Latency percentiles since the previous collection. Percentiles are estimated from a uniform random sample (of
+    at most sample_size latencies) so that memory use does not depend on the rate, maximum & count are exact."""
+
+    def __init__(self, sample_size=10000, by_lid=False, top=5):
+        """by_lid - whether to also track the (count &) maximum latency per LID, to report the top worst LIDs"""
+        self.__sample_size = sample_size
+        self.__by_lid = by_lid
+        self.__top = top
+        self.__lock = Lock()
+        self.__reset()
+
+    def __reset(self):
+        self.__sample = []
+        self.__count = 0
+        self.__max = 0
+        # LID to list of count, max latency
+        self.__lids = {}
+
+    def observe(self, lid, latency):
+        with self.__lock:
+            self.__count += 1
+            if latency > self.__max:
+                self.__max = latency
+            # Reservoir sampling
+            if len(self.__sample) < self.__sample_size:
+                self.__sample.append(latency)
+            else:
+                idx = randrange(self.__count)
+                if idx < self.__sample_size:
+                    self.__sample[idx] = latency
+            if self.__by_lid:
+                try:
+                    stats = self.__lids[lid]
+                except KeyError:
+                    stats = self.__lids[lid] = [0, 0]
+                stats[0] += 1
+                if latency > stats[1]:
+                    stats[1] = latency
+
+    def collect(self):
+        """Returns dict of count, percentiles (None if nothing was observed) & max since the previous call and, if
+        tracking by LID, list of (lid, count, max) for the LIDs with the highest maximum latency."""
+        with self.__lock:
+            sample, count, max_latency, lids = self.__sample, self.__count, self.__max, self.__lids
+            self.__reset()
+        sample.sort()
+        stats = {STATS_COUNT: count, STATS_MAX: max_latency}
+        for name, pct in _PERCENTILES:
+            stats[name] = sample[min(len(sample) - 1, len(sample) * pct // 100)] if sample else None
+        if self.__by_lid:
+            stats[STATS_LIDS] = [(lid, lid_count, lid_max) for lid, (lid_count, lid_max)
+                                 in nlargest(self.__top, lids.items(), key=lambda item: item[1][1])]
+        return stats
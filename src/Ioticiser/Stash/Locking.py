@@ -0,0 +1,132 @@
+# Copyright (c) 2017 Iotic Labs Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://github.com/Iotic-Labs/py-IoticBulkData/blob/master/LICENSE
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Locks with optional contention statistics and lock-free counters
+"""
+
+from __future__ import unicode_literals
+
+from itertools import count
+
+from IoticAgent.Core.compat import monotonic
+
+
+STATS_ACQUIRED = 'acquired'
+STATS_CONTENDED = 'contended'
+STATS_WAIT_AVG = 'wait_avg'
+STATS_WAIT_MAX = 'wait_max'
+STATS_HOLD_AVG = 'hold_avg'
+STATS_HOLD_MAX = 'hold_max'
+
+
+class InstrumentedLock(object):
+    """Wraps a Lock or RLock, recording how often it had to be waited for, for how long and for how long it was held
+    (for RLock: from outermost acquire to outermost release). Statistics are updated whilst holding the lock and
+    collected without it, so are approximate."""
+
+    __slots__ = ('__lock', '__depth', '__acquired_at', '__stats')
+
+    def __init__(self, lock):
+        self.__lock = lock
+        self.__depth = 0
+        self.__acquired_at = None
+        # acquired, contended, total wait, max wait, total hold, max hold
+        self.__stats = [0, 0, 0, 0, 0, 0]
+
+    def acquire(self, blocking=True):
+        if self.__lock.acquire(False):
+            wait = None
+        elif not blocking:
+            return False
+        else:
+            started = monotonic()
+            self.__lock.acquire()
+            wait = monotonic() - started
+        self.__depth += 1
+        if self.__depth == 1:
+            stats = self.__stats
+            stats[0] += 1
+            if wait is not None:
+                stats[1] += 1
+                stats[2] += wait
+                if wait > stats[3]:
+                    stats[3] = wait
+            self.__acquired_at = monotonic()
+        return True
+
+    def release(self):
+        self.__depth -= 1
+        if not self.__depth:
+            hold = monotonic() - self.__acquired_at
+            stats = self.__stats
+            stats[4] += hold
+            if hold > stats[5]:
+                stats[5] = hold
+        self.__lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, typ, value, traceback):
+        self.release()
+
+    def collect(self):
+        """Returns list of statistics (see collect_lock_stats) since previous call and resets them"""
+        stats = self.__stats
+        self.__stats = [0, 0, 0, 0, 0, 0]
+        return stats
+
+
+def collect_lock_stats(locks):
+    """Returns dict of statistics aggregated over the given locks since the previous call, or None if they are not
+    instrumented."""
+    total = [0, 0, 0, 0, 0, 0]
+    for lock in locks:
+        if not isinstance(lock, InstrumentedLock):
+            return None
+        stats = lock.collect()
+        for i in (0, 1, 2, 4):
+            total[i] += stats[i]
+        for i in (3, 5):
+            total[i] = max(total[i], stats[i])
+    return {STATS_ACQUIRED: total[0],
+            STATS_CONTENDED: total[1],
+            STATS_WAIT_AVG: (total[2] / total[1]) if total[1] else 0,
+            STATS_WAIT_MAX: total[3],
+            STATS_HOLD_AVG: (total[4] / total[0]) if total[0] else 0,
+            STATS_HOLD_MAX: total[5]}
+
+
+class EventCounter(object):
+    """Counter which can be incremented from any thread without locking (relies on next() of itertools.count being
+    atomic, as is the case in CPython). Only one thread at a time should call collect()."""
+
+    __slots__ = ('__count', '__reads', '__last')
+
+    def __init__(self):
+        self.__count = count()
+        # Number of times __count has been advanced by collect() itself
+        self.__reads = 0
+        self.__last = 0
+
+    def increment(self):
+        next(self.__count)
+
+    def collect(self):
+        """Returns number of increments since previous call"""
+        total = next(self.__count) - self.__reads
+        self.__reads += 1
+        diff = total - self.__last
+        self.__last = total
+        return diff
@@ -0,0 +1,231 @@
+# Copyright (c) 2017 Iotic Labs Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://github.com/Iotic-Labs/py-IoticBulkData/blob/master/LICENSE
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Worker pool which handles diffs in separate processes, each with its own agent connection
+"""
+
+from __future__ import unicode_literals
+
+from os import getpid, kill
+from signal import signal, SIGINT, SIG_IGN
+from threading import Thread
+import multiprocessing
+import logging
+logger = logging.getLogger(__name__)
+
+from IoticAgent.Core.compat import Empty, Event, Lock
+
+from ..compat import SIGUSR1
+from .ThreadPool import ThreadPool, lid_shard
+from .ClientPool import ClientPool, create_iot_client
+
+
+# Messages sent from worker processes to parent
+_COMPLETE = 'c'
+_ABORT = 'a'
+_LINK_FAILURES = 'l'
+
+
+def _log_config():
+    root = logging.getLogger()
+    fmt = None
+    for handler in root.handlers:
+        if handler.formatter is not None:
+            fmt = handler.formatter._fmt  # pylint: disable=protected-access
+            break
+    return root.level, fmt
+
+
+def _process_main(name, num_workers, max_workers, rates, client_factory, agentfile, log_config, in_queue, out_queue):
+    # pylint: disable=too-many-arguments,too-many-locals
+    level, fmt = log_config
+    logging.basicConfig(level=level, format=fmt)
+    logging.getLogger('rdflib').setLevel(logging.WARNING)
+    logging.getLogger('IoticAgent').setLevel(logging.WARNING)
+
+    stop = Event()
+
+    def receive_abort_signal(signum, stack):  # pylint: disable=unused-argument
+        out_queue.put((_ABORT, None, None))
+        stop.set()
+
+    def complete_cb(lid, idx):
+        out_queue.put((_COMPLETE, lid, idx))
+
+    # Parent is responsible for shutdown, workers trigger abort via SIGUSR1 (as in single process mode)
+    signal(SIGINT, SIG_IGN)
+    signal(SIGUSR1, receive_abort_signal)
+
+    client = ClientPool([client_factory(agentfile)])
+    client.start()
+    pool = ThreadPool(name, num_workers=num_workers, iotclient=client, max_workers=max_workers, rates=rates)
+    pool.start()
+    link_failures = 0
+    try:
+        while not stop.is_set():
+            if pool.link_failures != link_failures:
+                link_failures = pool.link_failures
+                out_queue.put((_LINK_FAILURES, name, link_failures))
+            try:
+                item = in_queue.get(timeout=.25)
+            except Empty:
+                continue
+            if item is None:
+                break
+            pool.submit(item[0], item[1], item[2], complete_cb)
+    finally:
+        pool.stop()
+        client.stop()
+
+
+class ProcessPool(object):  # pylint: disable=too-many-instance-attributes
+    """Same interface as ThreadPool but distributes diffs across num_processes processes, each running its own
+    ThreadPool and agent connection. Diffs are routed by LID so that all diffs for a given LID are always handled by
+    the same process (and hence in order). Completion callbacks are called in the parent process.
+    """
+
+    def __init__(self, name, num_processes, num_workers=1, agentfile=None, client_factory=create_iot_client,
+                 max_workers=None, rates=None):
+        # pylint: disable=too-many-arguments
+        self.__name = name
+        self.__num_processes = num_processes
+        self.__num_workers = num_workers
+        self.__max_workers = max_workers
+        # Each process gets an equal share of the rate limit
+        self.__rates = None if rates is None else {op: float(rate) / num_processes for op, rate in rates.items()}
+        self.__agentfile = agentfile
+        self.__client_factory = client_factory
+        # Processes must not inherit threads (and their held locks) from the parent
+        try:
+            self.__mp = multiprocessing.get_context('spawn')
+        except AttributeError:
+            self.__mp = multiprocessing
+        #
+        self.__stop = Event()
+        self.__stop.set()
+        self.__processes = []
+        self.__in_queues = []
+        self.__out_queue = None
+        self.__thread = None
+        # Completions are still collected whilst processes are stopping
+        self.__collect_stop = Event()
+        # (lid, idx) -> complete_cb for diffs which have not completed yet
+        self.__pending = {}
+        self.__pending_lock = Lock()
+        # Consecutive link failures as last reported by each process (by name)
+        self.__link_failures = {}
+
+    def start(self):
+        if self.__stop.is_set():
+            self.__stop.clear()
+            self.__collect_stop.clear()
+            self.__out_queue = self.__mp.Queue()
+            log_config = _log_config()
+            for i in range(self.__num_processes):
+                in_queue = self.__mp.Queue()
+                proc = self.__mp.Process(target=_process_main, name=('pp-%s-%d' % (self.__name, i)),
+                                         args=('%s-%d' % (self.__name, i), self.__num_workers, self.__max_workers,
+                                               self.__rates, self.__client_factory, self.__agentfile, log_config,
+                                               in_queue, self.__out_queue))
+                proc.daemon = True
+                self.__in_queues.append(in_queue)
+                self.__processes.append(proc)
+            for proc in self.__processes:
+                proc.start()
+            self.__thread = Thread(target=self.__collect, name=('pp-%s-collect' % self.__name))
+            self.__thread.start()
+
+    def qsize(self):
+        with self.__pending_lock:
+            return len(self.__pending)
+
+    def submit(self, lid, idx, diff, complete_cb=None):
+        with self.__pending_lock:
+            self.__pending[(lid, str(idx))] = complete_cb
+        self.__in_queues[lid_shard(lid, self.__num_processes)].put((lid, idx, diff))
+
+    def stop(self):
+        if not self.__stop.is_set():
+            self.__stop.set()
+            for in_queue in self.__in_queues:
+                in_queue.put(None)
+            for proc in self.__processes:
+                proc.join()
+            self.__collect_stop.set()
+            self.__thread.join()
+            del self.__processes[:]
+            del self.__in_queues[:]
+            # Unfinished diffs remain in the stash and are resubmitted on next start
+            with self.__pending_lock:
+                self.__pending.clear()
+
+    @property
+    def link_failures(self):
+        """See ThreadPool.link_failures (highest of all processes)"""
+        return max(self.__link_failures.values()) if self.__link_failures else 0
+
+    @classmethod
+    def collect_stats(cls):
+        """Not available across processes (scaling decisions are logged by each worker process)"""
+        return None
+
+    @classmethod
+    def cache_snapshot(cls):
+        """Not available across processes"""
+        return None
+
+    @property
+    def queue_empty(self):
+        with self.__pending_lock:
+            return not self.__pending
+
+    def __collect(self):
+        logger.debug("Starting")
+        out_queue = self.__out_queue
+        stop_is_set = self.__stop.is_set
+        aborted = False
+
+        # Keeps collecting until all processes have finished, so they are never blocked on a full queue
+        while True:
+            try:
+                kind, lid, idx = out_queue.get(timeout=.25)
+            except Empty:
+                if self.__collect_stop.is_set():
+                    break
+                if not (aborted or stop_is_set() or all(proc.is_alive() for proc in self.__processes)):
+                    logger.critical("Worker process died - Aborting")
+                    aborted = True
+                    kill(getpid(), SIGUSR1)
+                continue
+
+            if kind == _LINK_FAILURES:
+                # lid = process name, idx = failure count
+                self.__link_failures[lid] = idx
+                continue
+
+            if kind == _ABORT:
+                if not aborted:
+                    logger.critical("Worker process aborted - Aborting")
+                    aborted = True
+                    kill(getpid(), SIGUSR1)
+                continue
+
+            with self.__pending_lock:
+                complete_cb = self.__pending.pop((lid, str(idx)), None)
+            if complete_cb and not aborted:
+                try:
+                    complete_cb(lid, idx)
+                except:
+                    logger.error("complete_cb failed for %s", lid, exc_info=True)
+                    aborted = True
+                    kill(getpid(), SIGUSR1)
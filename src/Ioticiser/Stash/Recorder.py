@@ -0,0 +1,82 @@
+# Copyright (c) 2017 Iotic Labs Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://github.com/Iotic-Labs/py-IoticBulkData/blob/master/LICENSE
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Recording of diffs as they are made (e.g. to replay a production workload offline, see bench/replay.py)
+"""
+
+from __future__ import unicode_literals
+
+import logging
+logger = logging.getLogger(__name__)
+
+from gzip import open as gzip_open
+from struct import Struct
+from time import time
+import ubjson
+
+from IoticAgent.Core.compat import Lock
+
+from .Diff import load
+
+
+# Each record is prefixed with its length
+_LENGTH = Struct(str('>I'))
+
+
+class DiffRecorder(object):
+    """Appends diffs, with the (unix) time they were made, to a gzip compressed file. Each run appends a new gzip
+    member, so a recording can span multiple runs."""
+
+    def __init__(self, fname):
+        self.__lock = Lock()
+        self.__file = gzip_open(fname, 'ab')
+        self.__count = 0
+
+    def __len__(self):
+        """Number of diffs recorded (by this instance)"""
+        return self.__count
+
+    def record(self, diff):
+        data = ubjson.dumpb((time(), diff))
+        with self.__lock:
+            self.__file.write(_LENGTH.pack(len(data)))
+            self.__file.write(data)
+            self.__count += 1
+
+    def flush(self):
+        with self.__lock:
+            self.__file.flush()
+
+    def close(self):
+        with self.__lock:
+            self.__file.close()
+
+
+def read_recording(fname):
+    """Yields (time, ThingDiff) for each diff in the given recording, in the order they were made. A recording which
+    was not closed cleanly is read up to the last complete diff."""
+    with gzip_open(fname, 'rb') as f:
+        while True:
+            try:
+                header = f.read(_LENGTH.size)
+                if len(header) < _LENGTH.size:
+                    break
+                length = _LENGTH.unpack(header)[0]
+                data = f.read(length)
+                if len(data) < length:
+                    break
+            except (EOFError, IOError):
+                logger.warning("Recording %s truncated", fname)
+                break
+            made, diff = ubjson.loadb(data)
+            yield made, load(diff)
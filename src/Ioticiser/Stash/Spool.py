@@ -0,0 +1,79 @@
+# Copyright (c) 2017 Iotic Labs Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://github.com/Iotic-Labs/py-IoticBulkData/blob/master/LICENSE
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""On-disk store of diffs which cannot currently be sent to Iotic Space
+"""
+
+from __future__ import unicode_literals
+
+import sqlite3
+import ubjson
+
+from IoticAgent.Core.compat import Lock
+
+from .Diff import merge_diff, load
+
+
+class Spool(object):
+    """Persistent (sqlite) store of at most one diff per LID. Diffs stored for a LID which already has one are merged
+    into it (see merge_diff). Diffs are removed in the order in which their LID was first stored."""
+
+    def __init__(self, fname):
+        self.__lock = Lock()
+        self.__conn = sqlite3.connect(fname, check_same_thread=False)
+        self.__conn.execute('PRAGMA journal_mode=WAL')
+        self.__conn.execute('PRAGMA synchronous=NORMAL')
+        self.__conn.execute('CREATE TABLE IF NOT EXISTS spool (seq INTEGER PRIMARY KEY AUTOINCREMENT, '
+                            'lid TEXT UNIQUE NOT NULL, diff BLOB NOT NULL)')
+        self.__conn.commit()
+        self.__len = self.__conn.execute('SELECT COUNT(*) FROM spool').fetchone()[0]
+
+    def __len__(self):
+        return self.__len
+
+    def __contains__(self, lid):
+        if not self.__len:
+            return False
+        with self.__lock:
+            return self.__conn.execute('SELECT 1 FROM spool WHERE lid = ?', (lid,)).fetchone() is not None
+
+    def lids(self):
+        """Returns list of LIDs with a diff in the spool"""
+        with self.__lock:
+            return [row[0] for row in self.__conn.execute('SELECT lid FROM spool ORDER BY seq')]
+
+    def put(self, lid, diff):
+        with self.__lock:
+            row = self.__conn.execute('SELECT diff FROM spool WHERE lid = ?', (lid,)).fetchone()
+            if row is None:
+                self.__conn.execute('INSERT INTO spool (lid, diff) VALUES (?, ?)', (lid, ubjson.dumpb(diff)))
+                self.__len += 1
+            else:
+                diff = merge_diff(load(ubjson.loadb(bytes(row[0]))), diff)
+                self.__conn.execute('UPDATE spool SET diff = ? WHERE lid = ?', (ubjson.dumpb(diff), lid))
+            self.__conn.commit()
+
+    def pop(self):
+        """Removes & returns the oldest diff or None if the spool is empty"""
+        with self.__lock:
+            row = self.__conn.execute('SELECT seq, diff FROM spool ORDER BY seq LIMIT 1').fetchone()
+            if row is None:
+                return None
+            self.__conn.execute('DELETE FROM spool WHERE seq = ?', (row[0],))
+            self.__conn.commit()
+            self.__len -= 1
+            return load(ubjson.loadb(bytes(row[1])))
+
+    def close(self):
+        with self.__lock:
+            self.__conn.close()
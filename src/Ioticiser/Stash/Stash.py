@@ -19,18 +19,37 @@ logger = logging.getLogger(__name__)
 
 from os import rename
 from os.path import split as path_split, splitext, exists
-from threading import Thread
+from copy import deepcopy
+from threading import Thread, Condition
+from collections import OrderedDict
+from time import time
 from hashlib import md5
 from gzip import open as gzip_open
 import json
 import ubjson
 
-from IoticAgent.Core.compat import RLock, Event, number_types, string_types
+from IoticAgent.Core.compat import RLock, Lock, Event, number_types, string_types, monotonic
 
+from ..Metrics import REGISTRY
 from .Thing import Thing
-from .ThreadPool import ThreadPool
+from .Update import Update
+from .Spool import Spool
+from .Recorder import DiffRecorder
+from .Diff import ThingDiff, PointDiff, ValueDiff, merge_diff, drop_old_shares, is_empty, load as load_diff
+from .Diff import format_share_time, has_share
+from .Locking import InstrumentedLock, EventCounter, collect_lock_stats
+from .Locking import STATS_ACQUIRED, STATS_CONTENDED, STATS_WAIT_AVG as STATS_LOCK_WAIT_AVG
+from .Locking import STATS_WAIT_MAX as STATS_LOCK_WAIT_MAX, STATS_HOLD_AVG, STATS_HOLD_MAX
+from .ThreadPool import ThreadPool, lid_shard, STATS_WORKERS, STATS_SCALED_UP, STATS_SCALED_DOWN, STATS_RETRIES
+from .ThreadPool import STATS_RETRY_QUEUED, STATS_GOVERNOR
+from .Tracing import OperationStats, STATS_OPERATIONS, STATS_LIDS
+from .Latency import LatencyStats, STATS_COUNT, STATS_P50, STATS_P95, STATS_P99, STATS_MAX
+from .Latency import STATS_LIDS as STATS_LATENCY_LIDS
+from .Governor import STATS_REQUESTS as STATS_GOV_REQUESTS, STATS_WAITED, STATS_WAIT_AVG, STATS_WAIT_MAX
+from .ProcessPool import ProcessPool
+from .ClientPool import create_iot_client, STATS_IN_FLIGHT, STATS_REQUESTS, STATS_LATENCY_AVG, STATS_LATENCY_MAX
 from .const import THINGS, DIFF, DIFFCOUNT
-from .const import LID, PID, FOC, PUBLIC, TAGS, LOCATION, POINTS, VALUES
+from .const import PID, FOC, PUBLIC, TAGS, LOCATION, POINTS, VALUES
 from .const import LABEL, LABELS, DESCRIPTION, DESCRIPTIONS, RECENT
 from .const import VALUE, VALUESHARE, VTYPE, LANG, UNIT, SHAREDATA, SHARETIME
 
@@ -38,8 +57,23 @@ from .const import VALUE, VALUESHARE, VTYPE, LANG, UNIT, SHAREDATA, SHARETIME
 STATS_IN = 'sin'
 STATS_OUT = 'sout'
 
+# Number of locks thing state is split across (by LID)
+THING_LOCK_SHARDS = 16
+
 SAVETIME = 120
 
+_SUBMITTED = REGISTRY.counter('ioticiser_diffs_submitted_total', 'Diffs submitted to workers', ('source',))
+_COMPLETED = REGISTRY.counter('ioticiser_diffs_completed_total', 'Diffs updated in Iotic Space', ('source',))
+_PENDING = REGISTRY.gauge('ioticiser_pending_diffs', 'Diffs not yet updated in Iotic Space', ('source',))
+_QUEUED = REGISTRY.gauge('ioticiser_queued_diffs', 'Diffs waiting for a worker', ('source',))
+_SPOOLED = REGISTRY.gauge('ioticiser_spooled_diffs', 'Diffs spooled to disk during outage', ('source',))
+_SAVE_TIME = REGISTRY.histogram('ioticiser_stash_save_seconds', 'Time taken to snapshot and write stash',
+                                ('source',))
+_SHARE_LATENCY = REGISTRY.histogram('ioticiser_share_latency_seconds',
+                                    'Time from update with share being made to it completing', ('source',),
+                                    buckets=(.01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600))
+_SAVE_BYTES = REGISTRY.gauge('ioticiser_stash_save_bytes', 'Size of last written stash (uncompressed)', ('source',))
+
 
 class Stash(object):  # pylint: disable=too-many-instance-attributes
 
@@ -47,42 +81,144 @@ class Stash(object):  # pylint: disable=too-many-instance-attributes
     def __fname_to_name(cls, fname):
         return splitext(path_split(fname)[-1])[0]
 
-    def __init__(self, fname, iotclient, num_workers):
+    def __init__(self, fname, iotclient, num_workers, num_processes=0, agentfile=None, max_workers=None,
+                 pending_max=None, pending_max_bytes=None, pending_wait=30, rates=None, outage_failures=0,
+                 outage_drain_rate=10, recover_rate=0, recover_share_max_age=None, lock_stats=False,
+                 trace_operations=False, operation_hooks=None, record_diffs=False, share_latency_by_lid=False,
+                 client_factory=create_iot_client):
+        """iotclient - ClientPool instance
+        num_processes - If non-zero, diffs are handled by this many worker processes (each with num_workers
+                        threads and their own agent connection, using agentfile) instead of threads in this process.
+        client_factory - Creates the agent connection (from agentfile) of each worker process. Must be picklable.
+        max_workers - If larger than num_workers, the number of worker threads is scaled between the two based on load
+        pending_max - Maximum number of diffs not yet updated in Iotic Space (None = unlimited)
+        pending_max_bytes - Maximum (approximate) size in bytes of diffs not yet updated in Iotic Space
+                            (None = unlimited)
+        pending_wait - How long (seconds) to wait in _finalise_thing for either of the above limits to no longer be
+                       exceeded before throttling the update
+        rates - If set, dict of operation class to maximum agent requests per second (see Governor)
+        outage_failures - If non-zero, after this many consecutive diffs failing due to network errors, new diffs are
+                          written to an on-disk spool (merged by thing) instead of being held in memory
+        outage_drain_rate - Maximum number of spooled diffs per second to submit once the network has recovered
+        recover_rate - If non-zero, diffs left over from a previous run are resubmitted (merged by thing) at this many
+                       per second initially, doubling every second, instead of all at once
+        recover_share_max_age - If set, share data older than this many seconds is dropped from diffs left over from a
+                                previous run
+        lock_stats - If set, contention of the stash locks is measured and logged with the heartbeat
+        trace_operations - If set, the slowest agent operations & things are logged with the heartbeat
+        operation_hooks - If set, list of callables to pass each agent request made by workers to (see Tracing)
+        Tracing (trace_operations & operation_hooks) is not available with num_processes.
+        record_diffs - If set, all diffs made are appended to <stash name>_diffs.rec (see Recorder)
+        share_latency_by_lid - If set, things with the highest share latency are logged with the heartbeat (in
+                               addition to overall share latency percentiles)
+        """
+        # pylint: disable=too-many-arguments,too-many-locals,too-many-statements
         self.__fname = fname
         self.__name = self.__fname_to_name(fname)
-        self.__workers = ThreadPool(self.__name, num_workers=num_workers, iotclient=iotclient)
+        self.__operation_stats = OperationStats() if trace_operations else None
+        hooks = list(operation_hooks or ())
+        if self.__operation_stats is not None:
+            hooks.append(self.__operation_stats)
+        if num_processes:
+            if hooks:
+                raise ValueError('Operation tracing cannot be used with num_processes')
+            self.__workers = ProcessPool(self.__name, num_processes, num_workers=num_workers, agentfile=agentfile,
+                                         client_factory=client_factory, max_workers=max_workers, rates=rates)
+        else:
+            self.__workers = ThreadPool(self.__name, num_workers=num_workers, iotclient=iotclient,
+                                        max_workers=max_workers, rates=rates, hooks=hooks)
         # For immediate actions only (e.g. control confirm)
         self.__client = iotclient
         self.__thread = Thread(target=self.__run, name=('stash-%s' % self.__name))
         self.__stop = Event()
 
         self.__stash = None
-        self.__stash_lock = RLock()
         self.__stash_hash = None
+        # Thing state (THINGS) by LID shard
+        self.__thing_locks = tuple(self.__new_lock(RLock, lock_stats) for _ in range(THING_LOCK_SHARDS))
+        # Pending diffs (DIFF, DIFFCOUNT) and their Update handles
+        self.__diff_lock = self.__new_lock(Lock, lock_stats)
+        self.__properties_lock = self.__new_lock(RLock, lock_stats)
 
         # Count stats in memory between SAVETIME ticks for heartbeat logging
         self.__stats = {
-            STATS_IN: 0,
-            STATS_OUT: 0
+            STATS_IN: EventCounter(),
+            STATS_OUT: EventCounter()
         }
+        # Time from diffs with shares being made to their completion
+        self.__share_latency = LatencyStats(by_lid=share_latency_by_lid)
 
         self.__pname = splitext(self.__fname)[0] + '_props.json'
         self.__properties = None
         self.__properties_changed = False
 
+        # Backpressure (number & approximate size of pending diffs)
+        self.__pending_max = pending_max
+        self.__pending_max_bytes = pending_max_bytes
+        self.__pending_wait = pending_wait
+        self.__pending_bytes = 0
+        # Diff index to size (only if limiting by size)
+        self.__pending_sizes = {}
+        self.__capacity = Condition(Lock())
+
+        # Diff index to list of Update handles (more than one if merged in spool), for diffs not yet completed
+        self.__updates = {}
+
+        # Outage mode
+        self.__outage_failures = outage_failures
+        self.__outage_drain_rate = outage_drain_rate
+        self.__outage_logged = False
+        self.__spool = None
+        self.__spool_lock = Lock()
+        # LID to list of Update handles of diffs in the spool (protected by spool lock)
+        self.__spooled = {}
+        self.__drain_thread = None
+        if outage_failures:
+            self.__spool = Spool(splitext(self.__fname)[0] + '_spool.db')
+            # Spooled during previous run, so that flush() waits for these too
+            self.__spooled = {lid: [Update(lid, spooled=True)] for lid in self.__spool.lids()}
+            self.__drain_thread = Thread(target=self.__drain_spool, name=('stash-%s-spool' % self.__name))
+
+        # Recovery of diffs left over from previous run
+        self.__recover_rate = recover_rate
+        self.__recover_share_max_age = recover_share_max_age
+        # LID to tuple of diff index & diff, for diffs not yet resubmitted
+        self.__recovering = OrderedDict()
+        self.__recover_lock = Lock()
+        self.__recover_thread = None
+
+        self.__recorder = DiffRecorder(splitext(self.__fname)[0] + '_diffs.rec') if record_diffs else None
+
         self.__load()
 
     def start(self):
+        labels = (self.__name,)
+        _PENDING.set_function(lambda: len(self.__stash[DIFF]), labels)
+        _QUEUED.set_function(self.__workers.qsize, labels)
+        if self.__spool is not None:
+            _SPOOLED.set_function(lambda: len(self.__spool), labels)
         self.__workers.start()
         self.__submit_diffs()
         self.__thread.start()
+        if self.__drain_thread is not None:
+            self.__drain_thread.start()
 
     def stop(self):
         if not self.__stop.is_set():
             self.__stop.set()
             self.__thread.join()
+            if self.__recover_thread is not None:
+                self.__recover_thread.join()
+            if self.__drain_thread is not None:
+                self.__drain_thread.join()
             self.__workers.stop()
             self.__save()
+            if self.__spool is not None:
+                self.__spool.close()
+            if self.__recorder is not None:
+                self.__recorder.close()
+            for gauge in (_PENDING, _QUEUED, _SPOOLED):
+                gauge.remove((self.__name,))
 
     def __enter__(self):
         self.start()
@@ -94,67 +230,140 @@ class Stash(object):  # pylint: disable=too-many-instance-attributes
     def is_alive(self):
         return self.__thread.is_alive()
 
+    @classmethod
+    def __new_lock(cls, factory, instrumented):
+        return InstrumentedLock(factory()) if instrumented else factory()
+
+    def __thing_lock(self, lid):
+        return self.__thing_locks[lid_shard(lid, THING_LOCK_SHARDS)]
+
     def __load(self):  # pylint: disable=too-many-branches
         fsplit = splitext(self.__fname)
         if fsplit[1] == '.json':
             if exists(self.__fname):
                 # Migrate from json to ubjson
-                with self.__stash_lock:
-                    with open(self.__fname, 'r') as f:
-                        self.__stash = json.load(f)
-                    rename(self.__fname, self.__fname + '.old')
+                with open(self.__fname, 'r') as f:
+                    self.__stash = json.load(f)
+                rename(self.__fname, self.__fname + '.old')
 
         if fsplit[1] != '.ubjz':
             self.__fname = fsplit[0] + '.ubjz'
 
         if exists(self.__fname):
-            with self.__stash_lock:
-                with gzip_open(self.__fname, 'rb') as f:
-                    self.__stash = ubjson.load(f, intern_object_keys=True)
+            with gzip_open(self.__fname, 'rb') as f:
+                self.__stash = ubjson.load(f, intern_object_keys=True)
         elif self.__stash is None:
             self.__stash = {THINGS: {},    # Current/last state of Things
                             DIFF: {},      # Diffs not yet updated in Iotic Space
                             DIFFCOUNT: 0}  # Diff counter
+        # Diffs are tuples (see Diff) but deserialised as lists (or dicts if stored by previous versions)
+        diffs = self.__stash[DIFF]
+        for idx in diffs:
+            diffs[idx] = load_diff(diffs[idx])
 
         if not exists(self.__pname):
             self.__properties = {}
         else:
-            with self.__stash_lock:
-                with open(self.__pname, 'r') as f:
-                    self.__properties = json.load(f)
+            with open(self.__pname, 'r') as f:
+                self.__properties = json.load(f)
 
     def __calc_stashdump(self):
-        with self.__stash_lock:
-            stashdump = ubjson.dumpb(self.__stash)
-            m = md5()
-            m.update(stashdump)
-            stashhash = m.hexdigest()
-            if self.__stash_hash != stashhash:
-                self.__stash_hash = stashhash
-                return stashdump
-            return None
+        # Consistent snapshot requires all locks (always acquired in this order)
+        for lock in self.__thing_locks:
+            lock.acquire()
+        try:
+            with self.__diff_lock:
+                stashdump = ubjson.dumpb(self.__stash)
+        finally:
+            for lock in self.__thing_locks:
+                lock.release()
+        m = md5()
+        m.update(stashdump)
+        stashhash = m.hexdigest()
+        if self.__stash_hash != stashhash:
+            self.__stash_hash = stashhash
+            return stashdump
+        return None
+
+    def footprint(self, top=10):
+        """Returns dict describing the memory used by the stash state and worker cache (see Footprint.analyse - the
+        cache is not included if using worker processes). Note: Updates are blocked whilst the state is being analysed,
+        which can take a while for large stashes."""
+        # Imported here so that the module can also be run as a script without having been imported already
+        from .Footprint import analyse
+        cache = self.__workers.cache_snapshot()
+        for lock in self.__thing_locks:
+            lock.acquire()
+        try:
+            with self.__diff_lock:
+                return analyse(self.__stash, top=top, cache=cache)
+        finally:
+            for lock in self.__thing_locks:
+                lock.release()
 
     def __do_heartbeat(self):
-        with self.__stash_lock:
-            logger.info("heartbeat: Submitted=%i, Completed=%i, Queued=%i",
-                        self.__stats[STATS_IN], self.__stats[STATS_OUT], self.__workers.qsize())
-            self.__stats[STATS_IN] = self.__stats[STATS_OUT] = 0
+        logger.info("heartbeat: Submitted=%i, Completed=%i, Queued=%i",
+                    self.__stats[STATS_IN].collect(), self.__stats[STATS_OUT].collect(), self.__workers.qsize())
+        stats = self.__share_latency.collect()
+        if stats[STATS_COUNT]:
+            logger.info("heartbeat: ShareLatency: Count=%i, P50=%.3fs, P95=%.3fs, P99=%.3fs, Max=%.3fs",
+                        stats[STATS_COUNT], stats[STATS_P50], stats[STATS_P95], stats[STATS_P99], stats[STATS_MAX])
+            for lid, count, max_latency in stats.get(STATS_LATENCY_LIDS, ()):
+                logger.info("heartbeat: ShareLatency %s: Count=%i, Max=%.3fs", lid, count, max_latency)
+        for name, locks in (('things', self.__thing_locks), ('diffs', (self.__diff_lock,)),
+                            ('properties', (self.__properties_lock,))):
+            stats = collect_lock_stats(locks)
+            if stats is not None:
+                logger.info("heartbeat: Lock %s: Acquired=%i, Contended=%i, WaitAvg=%.6fs, WaitMax=%.6fs, "
+                            "HoldAvg=%.6fs, HoldMax=%.6fs", name, stats[STATS_ACQUIRED], stats[STATS_CONTENDED],
+                            stats[STATS_LOCK_WAIT_AVG], stats[STATS_LOCK_WAIT_MAX], stats[STATS_HOLD_AVG],
+                            stats[STATS_HOLD_MAX])
+        if self.__spool is not None:
+            logger.info("heartbeat: Outage=%s, Spooled=%i", self.outage, len(self.__spool))
+        self.__do_worker_heartbeat()
+
+    def __do_worker_heartbeat(self):
+        stats = self.__workers.collect_stats()
+        if stats is not None:
+            logger.info("heartbeat: Workers=%i, ScaledUp=%i, ScaledDown=%i, Retries=%i, RetryQueued=%i",
+                        stats[STATS_WORKERS], stats[STATS_SCALED_UP], stats[STATS_SCALED_DOWN],
+                        stats[STATS_RETRIES], stats[STATS_RETRY_QUEUED])
+            for op, gov_stats in sorted((stats[STATS_GOVERNOR] or {}).items()):
+                logger.info("heartbeat: Rate %s: Requests=%i, Waited=%i, WaitAvg=%.3fs, WaitMax=%.3fs", op,
+                            gov_stats[STATS_GOV_REQUESTS], gov_stats[STATS_WAITED], gov_stats[STATS_WAIT_AVG],
+                            gov_stats[STATS_WAIT_MAX])
+        if self.__operation_stats is not None:
+            stats = self.__operation_stats.collect()
+            for operation, requests, failures, total, avg, max_duration in stats[STATS_OPERATIONS]:
+                logger.info("heartbeat: Operation %s: Requests=%i, Failed=%i, Total=%.3fs, Avg=%.3fs, Max=%.3fs",
+                            operation, requests, failures, total, avg, max_duration)
+            for lid, requests, total in stats[STATS_LIDS]:
+                logger.info("heartbeat: Thing %s: Requests=%i, Total=%.3fs", lid, requests, total)
+        for i, stats in enumerate(self.__client.collect_stats()):
+            logger.info("heartbeat: Agent %i: InFlight=%i, Requests=%i, LatencyAvg=%.3fs, LatencyMax=%.3fs", i,
+                        stats[STATS_IN_FLIGHT], stats[STATS_REQUESTS], stats[STATS_LATENCY_AVG],
+                        stats[STATS_LATENCY_MAX])
 
     def __save(self):
+        started = monotonic()
         stashdump = self.__calc_stashdump()
         self.__do_heartbeat()
         if stashdump is not None:
             with gzip_open(self.__fname, 'wb') as f:
                 f.write(stashdump)
+            _SAVE_BYTES.set(len(stashdump), (self.__name,))
+        _SAVE_TIME.observe(monotonic() - started, (self.__name,))
+        if self.__recorder is not None:
+            self.__recorder.flush()
 
         # if len(self.__properties) and self.__properties_changed:
         if self.__properties and self.__properties_changed:
-            with self.__stash_lock:
+            with self.__properties_lock:
                 with open(self.__pname, 'w') as f:
                     json.dump(self.__properties, f)
 
     def get_property(self, key):
-        with self.__stash_lock:
+        with self.__properties_lock:
             if not isinstance(key, string_types):
                 raise ValueError("key must be string")
             if key in self.__properties:
@@ -162,7 +371,7 @@ class Stash(object):  # pylint: disable=too-many-instance-attributes
             return None
 
     def set_property(self, key, value=None):
-        with self.__stash_lock:
+        with self.__properties_lock:
             if not isinstance(key, string_types):
                 raise ValueError("key must be string")
             if value is None and key in self.__properties:
@@ -190,15 +399,18 @@ class Stash(object):  # pylint: disable=too-many-instance-attributes
 
     # raises KeyError if thing does not exist
     def __get_thing(self, lid):
-        return Thing(lid,
-                     stash=self,
-                     public=self.__stash[THINGS][lid][PUBLIC],
-                     labels=self.__stash[THINGS][lid][LABELS],
-                     descriptions=self.__stash[THINGS][lid][DESCRIPTIONS],
-                     tags=self.__stash[THINGS][lid][TAGS],
-                     points=self.__stash[THINGS][lid][POINTS],
-                     lat=self.__stash[THINGS][lid][LOCATION][0],
-                     long=self.__stash[THINGS][lid][LOCATION][1])
+        with self.__thing_lock(lid):
+            thing = self.__stash[THINGS][lid]
+            # Thing copies state so it can be modified without holding lock
+            return Thing(lid,
+                         stash=self,
+                         public=thing[PUBLIC],
+                         labels=thing[LABELS],
+                         descriptions=thing[DESCRIPTIONS],
+                         tags=thing[TAGS],
+                         points=thing[POINTS],
+                         lat=thing[LOCATION][0],
+                         long=thing[LOCATION][1])
 
     # For internal use only - returns tuple of thing & point instances, or None for both if either unknown
     def _get_thing_and_point(self, lid, foc, pid):
@@ -208,134 +420,339 @@ class Stash(object):  # pylint: disable=too-many-instance-attributes
         except KeyError:
             return None, None
 
-    def __calc_diff(self, thing):  # pylint: disable=too-many-branches
-        if not (len(thing.changes) or thing.new):
-            changes = 0
-            for pid, point in thing.points.items():
-                changes += len(point.changes)
-            if changes == 0:
-                return None, None
+    @classmethod
+    def __has_changes(cls, thing):
+        if thing.changes or thing.new:
+            return True
+        for point in thing.points.values():
+            if point.changes:
+                return True
+        return False
+
+    @classmethod
+    def __calc_diff(cls, thing):
+        if not cls.__has_changes(thing):
+            return None
 
-        ret = 0
-        diff = {}
         if thing.new:
             # Note: thing is new so no need to calculate diff.
-            #  This shows the diff dict full layout
-            diff = {LID: thing.lid,
-                    TAGS: thing.tags,
-                    LOCATION: thing.location,
-                    LABELS: thing.labels,
-                    DESCRIPTIONS: thing.descriptions,
-                    POINTS: {}}
-            # Prevent public setting to always be performed for new things
-            if PUBLIC in thing.changes:
-                diff[PUBLIC] = thing.public
-
-            for pid, point in thing.points.items():
-                diff[POINTS][pid] = self.__calc_diff_point(point)
-
+            labels = tuple(thing.labels.items())
+            descriptions = tuple(thing.descriptions.items())
+            tags = thing.tags
+            location = thing.location
         else:
-            diff[LID] = thing.lid
-            diff[POINTS] = {}
+            labels = []
+            descriptions = []
+            tags = location = None
             for change in thing.changes:
-                if change == PUBLIC:
-                    diff[PUBLIC] = thing.public
-                elif change == TAGS:
-                    diff[TAGS] = thing.tags
+                if change == TAGS:
+                    tags = thing.tags
                 elif change.startswith(LABEL):
-                    if LABELS not in diff:
-                        diff[LABELS] = {}
                     lang = change.replace(LABEL, '')
-                    diff[LABELS][lang] = thing.labels[lang]
+                    labels.append((lang, thing.labels[lang]))
                 elif change.startswith(DESCRIPTION):
-                    if DESCRIPTIONS not in diff:
-                        diff[DESCRIPTIONS] = {}
                     lang = change.replace(DESCRIPTION, '')
-                    diff[DESCRIPTIONS][lang] = thing.descriptions[lang]
+                    descriptions.append((lang, thing.descriptions[lang]))
                 elif change == LOCATION:
-                    diff[LOCATION] = thing.location
-            for pid, point in thing.points.items():
-                diff[POINTS][pid] = self.__calc_diff_point(point)
-
-        with self.__stash_lock:
-            self.__stash[DIFF][str(self.__stash[DIFFCOUNT])] = diff
-            ret = self.__stash[DIFFCOUNT]
+                    location = thing.location
+
+        return ThingDiff(thing.lid,
+                         thing.new,
+                         time(),
+                         # Prevent public setting to always be performed for new things
+                         thing.public if PUBLIC in thing.changes else None,
+                         tags,
+                         location,
+                         tuple(labels),
+                         tuple(descriptions),
+                         tuple(cls.__calc_diff_point(point) for point in thing.points.values()))
+
+    def __submit_diff(self, diff, spooled=()):
+        """Registers diff as pending & submits it to workers. Returns Update handle. spooled - Update handles of
+        (merged) diffs from the spool which diff represents, to be done once it is."""
+        if self.__recovering:
+            # Resubmit previous diff for same thing first so that it is not overtaken
+            with self.__recover_lock:
+                recovered = self.__recovering.pop(diff.lid, None)
+                if recovered is not None:
+                    self.__workers.submit(diff.lid, recovered[0], recovered[1], self.__complete_cb)
+        with self.__diff_lock:
+            idx = self.__stash[DIFFCOUNT]
+            self.__stash[DIFF][str(idx)] = diff
             self.__stash[DIFFCOUNT] += 1
-        return ret, diff
+            update = Update(diff.lid)
+            self.__updates[str(idx)] = [update] + list(spooled)
+        self.__stats[STATS_IN].increment()
+        _SUBMITTED.inc((self.__name,))
+        self.__add_pending_size(idx, diff)
+        self.__workers.submit(diff.lid, idx, diff, self.__complete_cb)
+        return update
 
-    def __calc_diff_point(self, point):  # pylint: disable=too-many-branches
-        ret = {PID: point.lid,
-               FOC: point.foc,
-               VALUES: {}}
+    @classmethod
+    def __calc_diff_point(cls, point):  # pylint: disable=too-many-branches
         if point.new:
-            ret.update({LABELS: {},
-                        DESCRIPTIONS: {},
-                        # currently only applies to feeds
-                        RECENT: 0,
-                        TAGS: []})
+            recent = 0  # currently only applies to feeds
+            tags = ()
+        else:
+            recent = tags = None
+        labels = []
+        descriptions = []
+        # Value label to tuple of definition (or None) & whether shared
+        values = OrderedDict()
+        shared = False
+        sharedata = sharetime = None
         for change in point.changes:
             if change == TAGS:
-                ret[TAGS] = point.tags
+                tags = point.tags
             elif change.startswith(LABEL):
-                if LABELS not in ret:
-                    ret[LABELS] = {}
                 lang = change.replace(LABEL, '')
-                ret[LABELS][lang] = point.labels[lang]
+                labels.append((lang, point.labels[lang]))
             elif change.startswith(DESCRIPTION):
-                if DESCRIPTIONS not in ret:
-                    ret[DESCRIPTIONS] = {}
                 lang = change.replace(DESCRIPTION, '')
-                ret[DESCRIPTIONS][lang] = point.descriptions[lang]
+                descriptions.append((lang, point.descriptions[lang]))
             elif change == RECENT:
-                ret[RECENT] = point.recent_config
+                recent = point.recent_config
             elif change == SHAREDATA:
-                ret[SHAREDATA] = point.sharedata
+                shared = True
+                # Copied since the source might modify the data it shared once the thing has been released
+                sharedata = deepcopy(point.sharedata)
             elif change == SHARETIME:
-                ret[SHARETIME] = point.sharetime
-            elif change.startswith(VALUE):
-                label = change.replace(VALUE, '')
-                ret[VALUES][label] = self.__calc_value(point.values[label])
-            # applicable only if no value attributes have changed (share only)
+                sharetime = format_share_time(point.sharetime)
             elif change.startswith(VALUESHARE):
                 label = change.replace(VALUESHARE, '')
-                if label not in ret[VALUES]:
-                    ret[VALUES][label] = {}
-                ret[VALUES][label].update({SHAREDATA: point.values[label].pop(SHAREDATA)})
-        return ret
+                values[label] = values.get(label, (None, False))[0], True
+            elif change.startswith(VALUE):
+                label = change.replace(VALUE, '')
+                values[label] = point.values[label], values.get(label, (None, False))[1]
+
+        return PointDiff(point.lid, point.foc, point.new, recent, tags, tuple(labels), tuple(descriptions),
+                         cls.__calc_value_diffs(point, values), shared, sharedata, sharetime)
 
     @classmethod
-    def __calc_value(cls, value):
-        ret = {}
-        if VTYPE in value:
-            ret = {VTYPE: value[VTYPE],
-                   LANG: value[LANG],
-                   DESCRIPTION: value[DESCRIPTION],
-                   UNIT: value[UNIT]}
-        if SHAREDATA in value:
-            ret[SHAREDATA] = value[SHAREDATA]
-        return ret
+    def __calc_value_diffs(cls, point, values):
+        """values - value label to tuple of definition (or None) & whether shared"""
+        value_diffs = []
+        for label, (value, value_shared) in values.items():
+            if value is None:
+                value_diff = ValueDiff(label, None, None, None, None, False, None)
+            else:
+                value_diff = ValueDiff(label, value[VTYPE], value[LANG], value[DESCRIPTION], value[UNIT], False, None)
+            if value_shared:
+                value_diff = value_diff._replace(shared=True, sharedata=deepcopy(point.values[label][SHAREDATA]))
+            value_diffs.append(value_diff)
+        return tuple(value_diffs)
+
+    def __recover_diffs(self):
+        """Returns diffs left over from previous run (as list of tuples of index & diff) in the order they were made,
+        with those for the same thing merged and (optionally) old share data removed. Diffs merged into others or
+        left with nothing to do are removed from the stash."""
+        with self.__diff_lock:
+            diffs = self.__stash[DIFF]
+            recovered = OrderedDict()
+            merged = 0
+            for idx in sorted(diffs, key=int):
+                diff = diffs[idx]
+                try:
+                    first_idx = recovered[diff.lid]
+                except KeyError:
+                    recovered[diff.lid] = idx
+                else:
+                    diffs[first_idx] = merge_diff(diffs[first_idx], diff)
+                    del diffs[idx]
+                    merged += 1
+            dropped = 0
+            if self.__recover_share_max_age is not None:
+                before = time() - self.__recover_share_max_age
+                for idx in recovered.values():
+                    diffs[idx] = drop_old_shares(diffs[idx], before)
+                    if is_empty(diffs[idx]):
+                        del diffs[idx]
+                        dropped += 1
+            if merged or dropped:
+                logger.info("Recovery: Merged %d and dropped %d (stale share only) diffs", merged, dropped)
+            return [(idx, diffs[idx]) for idx in recovered.values() if idx in diffs]
 
     def __submit_diffs(self):
         """On start resubmit any diffs in the stash
         """
-        with self.__stash_lock:
-            for idx, diff in self.__stash[DIFF].items():
-                logger.info("Resubmitting diff for thing %s", diff[LID])
-                self.__workers.submit(diff[LID], idx, diff, self.__complete_cb)
-                self.__stats[STATS_IN] += 1
+        recovered = self.__recover_diffs()
+        with self.__diff_lock:
+            for idx, diff in recovered:
+                self.__updates[idx] = [Update(diff.lid)]
+        for idx, diff in recovered:
+            self.__add_pending_size(idx, diff)
+            self.__stats[STATS_IN].increment()
+            _SUBMITTED.inc((self.__name,))
+        if self.__recover_rate and recovered:
+            logger.info("Resubmitting %d diffs from %d/s", len(recovered), self.__recover_rate)
+            with self.__recover_lock:
+                for idx, diff in recovered:
+                    self.__recovering[diff.lid] = (idx, diff)
+            self.__recover_thread = Thread(target=self.__recover, name=('stash-%s-recover' % self.__name))
+            self.__recover_thread.start()
+        else:
+            for idx, diff in recovered:
+                logger.info("Resubmitting diff for thing %s", diff.lid)
+                self.__workers.submit(diff.lid, idx, diff, self.__complete_cb)
+        if self.__spool:
+            logger.info("%d updates in spool", len(self.__spool))
+
+    def __recover(self):
+        """Resubmits recovered diffs, starting at recover_rate per second and doubling the rate every second"""
+        logger.debug("Starting")
+        rate = self.__recover_rate
+        while True:
+            with self.__recover_lock:
+                for _ in range(rate):
+                    if not self.__recovering:
+                        break
+                    lid, (idx, diff) = self.__recovering.popitem(last=False)
+                    self.__workers.submit(lid, idx, diff, self.__complete_cb)
+                remaining = len(self.__recovering)
+            if not remaining:
+                logger.info("Recovery: All diffs resubmitted")
+                break
+            logger.debug("Recovery: %d diffs remaining at %d/s", remaining, rate)
+            rate *= 2
+            if self.__stop.wait(timeout=1):
+                break
+
+    def __add_pending_size(self, idx, diff):
+        if self.__pending_max_bytes is not None:
+            size = len(ubjson.dumpb(diff))
+            with self.__capacity:
+                self.__pending_sizes[str(idx)] = size
+                self.__pending_bytes += size
+
+    def __remove_pending_size(self, idx):
+        with self.__capacity:
+            self.__pending_bytes -= self.__pending_sizes.pop(idx, 0)
+            self.__capacity.notify_all()
+
+    @property
+    def name(self):
+        """Name of the stash (i.e. of the source using it)"""
+        return self.__name
+
+    @property
+    def pressure(self):
+        """How close the number/size of pending diffs is to the configured limit. 0 if no limits are configured (or
+        nothing is pending), 1 or above if updates are being throttled."""
+        pressure = 0
+        if self.__pending_max is not None:
+            pressure = len(self.__stash[DIFF]) / float(self.__pending_max)
+        if self.__pending_max_bytes is not None:
+            pressure = max(pressure, self.__pending_bytes / float(self.__pending_max_bytes))
+        return pressure
+
+    def __wait_for_capacity(self):
+        """Returns False if limits are still exceeded after pending_wait seconds"""
+        if self.pressure < 1:
+            return True
+        timeout = monotonic() + self.__pending_wait
+        with self.__capacity:
+            while self.pressure >= 1:
+                remaining = timeout - monotonic()
+                if remaining <= 0 or self.__stop.is_set():
+                    return False
+                self.__capacity.wait(remaining)
+        return True
 
     def _finalise_thing(self, thing):
+        """Returns Update handle for the changes made to the thing. If the update was throttled since too many updates
+        are pending (see pressure), its changes are dropped: Since create_thing() returns a new instance based on the
+        state of the thing as last updated in Iotic Space, the source has to make them again (including provisioning
+        a new thing). Shares are lost."""
+        if not self.__has_changes(thing):
+            return Update(thing.lid, done=True)
+        update = self.__spool_thing(thing)
+        if update is not None:
+            return update
+        if not self.__wait_for_capacity():
+            logger.warning("Too many pending updates (pressure=%.2f), dropping %s thing %s", self.pressure,
+                           'changes to new' if thing.new else 'changes to', thing.lid)
+            return Update(thing.lid, throttled=True)
         with thing.lock:
-            idx, diff = self.__calc_diff(thing)
-            if idx is not None:
-                self.__workers.submit(diff[LID], idx, diff, self.__complete_cb)
+            diff = self.__calc_diff(thing)
+            if diff is None:
+                return Update(thing.lid, done=True)
+            if self.__recorder is not None:
+                self.__recorder.record(diff)
+            update = self.__submit_diff(diff)
+            thing.clear_changes()
+        return update
+
+    @property
+    def outage(self):
+        """Whether updates are currently being spooled to disk due to Iotic Space being unreachable"""
+        return self.__spool is not None and self.__workers.link_failures >= self.__outage_failures
+
+    def __spool_thing(self, thing):
+        """Writes thing changes to spool instead if in outage mode or if the spool already contains changes for the
+        thing (so that they are not overtaken). Returns Update handle if spooled, None otherwise."""
+        if self.__spool is None:
+            return None
+        with self.__spool_lock:
+            if not (self.outage or thing.lid in self.__spool):
+                return None
+            if not self.__outage_logged:
+                logger.warning("Iotic Space unreachable, spooling updates to disk")
+                self.__outage_logged = True
+            with thing.lock:
+                diff = self.__calc_diff(thing)
+                if diff is None:
+                    return Update(thing.lid, done=True)
+                if self.__recorder is not None:
+                    self.__recorder.record(diff)
+                self.__spool.put(thing.lid, diff)
                 thing.clear_changes()
-                self.__stats[STATS_IN] += 1
+            update = Update(thing.lid, spooled=True)
+            self.__spooled.setdefault(thing.lid, []).append(update)
+        return update
+
+    def __drain_spool(self):
+        """Submits up to outage_drain_rate diffs per second from spool once no longer in outage mode"""
+        logger.debug("Starting")
+        spool = self.__spool
+        while not self.__stop.wait(timeout=1):
+            if not spool or self.outage:
+                continue
+            if self.__outage_logged:
+                logger.info("Iotic Space reachable again, submitting %d spooled updates", len(spool))
+                self.__outage_logged = False
+            for _ in range(self.__outage_drain_rate):
+                if self.pressure >= 1 or self.outage:
+                    break
+                # Within lock so that any newer changes to the same thing are submitted after this diff
+                with self.__spool_lock:
+                    diff = spool.pop()
+                    if diff is None:
+                        break
+                    self.__submit_diff(diff, spooled=self.__spooled.pop(diff.lid, ()))
+
+    def flush(self, timeout=None):
+        """Waits for all updates pending (including spooled ones) at the time of the call to be made in Iotic Space.
+        Returns False if timeout (in seconds) occurred first, True otherwise."""
+        # Same order as when draining spool, so that no update is missed whilst moving from spool to pending
+        with self.__spool_lock:
+            with self.__diff_lock:
+                updates = [update for handles in self.__updates.values() for update in handles]
+            updates.extend(update for handles in self.__spooled.values() for update in handles)
+        end = None if timeout is None else monotonic() + timeout
+        for update in updates:
+            if not update.wait(None if end is None else max(0, end - monotonic())):
+                return False
+        return True
 
     def __complete_cb(self, lid, idx):
-        with self.__stash_lock:
-            idx = str(idx)
+        idx = str(idx)
+        with self.__diff_lock:
             diff = self.__stash[DIFF][idx]
+        if diff.created is not None and has_share(diff):
+            latency = time() - diff.created
+            self.__share_latency.observe(lid, latency)
+            _SHARE_LATENCY.observe(latency, (self.__name,))
+        with self.__thing_lock(lid):
             try:
                 thing = self.__stash[THINGS][lid]
             except KeyError:
@@ -346,48 +763,54 @@ class Stash(object):  # pylint: disable=too-many-instance-attributes
                                                      POINTS: {},
                                                      LOCATION: (None, None)}
 
-            empty = {}
-            # Updated later separately
-            points = diff.pop(POINTS, empty)
             # Have to be merged since update only affects subset of all labels/descriptions
-            for item in (LABELS, DESCRIPTIONS):
-                thing[item].update(diff.pop(item, empty))
+            thing[LABELS].update(diff.labels)
+            thing[DESCRIPTIONS].update(diff.descriptions)
             # Rest should be OK to replace (public, tags, location)
-            thing.update(diff)
+            if diff.public is not None:
+                thing[PUBLIC] = diff.public
+            if diff.tags is not None:
+                thing[TAGS] = list(diff.tags)
+            if diff.location is not None:
+                thing[LOCATION] = diff.location
 
             # Points
-            for pid, pdiff in points.items():
+            for pdiff in diff.points:
                 try:
-                    point = thing[POINTS][pid]
+                    point = thing[POINTS][pdiff.pid]
                 except KeyError:
-                    thing[POINTS][pid] = point = {PID: pid,
-                                                  VALUES: {},
-                                                  LABELS: {},
-                                                  DESCRIPTIONS: {},
-                                                  TAGS: []}
-                # Updated later separately
-                values = pdiff.pop(VALUES, empty)
-                # Remove sharedata, sharetime before applying to stash
-                for item in (SHAREDATA, SHARETIME):
-                    pdiff.pop(item, None)
-                # Have to be merged since update only affects subset of all labels/descriptions
-                for item in (LABELS, DESCRIPTIONS):
-                    point[item].update(pdiff.pop(item, empty))
-                # Rest should be OK to replace (tags, foc, recent, share time, data)
-                point.update(pdiff)
-
-                # Values
-                for label, value in values.items():
-                    # Don't remember value share data
-                    value.pop(SHAREDATA, None)
-                    try:
-                        # Might only have data set so must merge
-                        point[VALUES][label].update(value)
-                    except KeyError:
-                        point[VALUES][label] = value
-
-            del self.__stash[DIFF][idx]
-            self.__stats[STATS_OUT] += 1
+                    thing[POINTS][pdiff.pid] = point = {PID: pdiff.pid,
+                                                        VALUES: {},
+                                                        LABELS: {},
+                                                        DESCRIPTIONS: {},
+                                                        TAGS: []}
+                point[FOC] = pdiff.foc
+                point[LABELS].update(pdiff.labels)
+                point[DESCRIPTIONS].update(pdiff.descriptions)
+                if pdiff.tags is not None:
+                    point[TAGS] = list(pdiff.tags)
+                if pdiff.recent is not None:
+                    point[RECENT] = pdiff.recent
+
+                # Values (share data is not remembered)
+                for vdiff in pdiff.values:
+                    # Might only have data set so must merge
+                    value = point[VALUES].setdefault(vdiff.label, {})
+                    if vdiff.vtype is not None:
+                        value.update({VTYPE: vdiff.vtype,
+                                      LANG: vdiff.lang,
+                                      DESCRIPTION: vdiff.description,
+                                      UNIT: vdiff.unit})
+
+            # Within thing lock so that a snapshot never contains both the diff and its effect
+            with self.__diff_lock:
+                del self.__stash[DIFF][idx]
+                updates = self.__updates.pop(idx, ())
+        self.__stats[STATS_OUT].increment()
+        _COMPLETED.inc((self.__name,))
+        self.__remove_pending_size(idx)
+        for update in updates:
+            update._set_done()
 
     @property
     def queue_empty(self):
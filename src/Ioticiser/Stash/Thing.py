@@ -36,6 +36,7 @@ class Thing(ResourceBase):
         """
         super(Thing, self).__init__(lid, new=new, labels=labels, descriptions=descriptions, tags=tags)
         self.__stash = stash
+        self.__last_update = None
         self.__public = Validation.bool_check_convert('public', public)  # Note: bool(None) == False
         self.__lat = None
         self.__long = None
@@ -53,7 +54,7 @@ class Thing(ResourceBase):
                                            labels=pdata[LABELS],
                                            descriptions=pdata[DESCRIPTIONS],
                                            tags=point_tags,
-                                           values=pdata[VALUES],
+                                           values={label: dict(value) for label, value in pdata[VALUES].items()},
                                            max_samples=pdata[RECENT])
 
     def __enter__(self):
@@ -64,10 +65,15 @@ class Thing(ResourceBase):
         self.lock.release()
         if self.__stash is not None:
             try:
-                self.__stash._finalise_thing(self)
+                self.__last_update = self.__stash._finalise_thing(self)
             except:
                 logger.exception("BUG! Thing __exit__ crashed on finalise_thing attempt")
 
+    @property
+    def last_update(self):
+        """Update handle (see Stash.Update) of the changes made when the thing was last released (via with), if any"""
+        return self.__last_update
+
     def clear_changes(self):
         with self.lock:
             for pid in self.__points:
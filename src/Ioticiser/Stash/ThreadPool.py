@@ -15,35 +15,76 @@
 from __future__ import unicode_literals
 
 from os import getpid, kill
+from zlib import crc32
 from threading import Thread, local as thread_local
 from datetime import datetime
 from collections import namedtuple, deque
+from heapq import heappush, heappop
+from itertools import count
+from random import uniform
 import logging
 logger = logging.getLogger(__name__)
 
-from IoticAgent.Core.compat import Queue, Empty, Event, Lock, string_types
+from IoticAgent.Core.compat import Queue, Empty, Event, Lock, monotonic
 from IoticAgent.Core.Const import R_FEED, R_CONTROL
 from IoticAgent.Core.Exceptions import LinkException
-from IoticAgent.IOT.Exceptions import IOTAccessDenied, IOTSyncTimeout
 
 from ..compat import SIGUSR1
-from .const import FOC, PUBLIC, TAGS, LOCATION, POINTS, THING, RECENT
-from .const import LABELS, DESCRIPTIONS, VALUES
-from .const import DESCRIPTION, VTYPE, LANG, UNIT, SHAREDATA, SHARETIME
+from ..Metrics import REGISTRY
+from .Governor import RateGovernor, GovernorStopped
+from .Tracing import OUTCOME_OK, OUTCOME_FAILED, OUTCOME_ABANDONED
+from .const import POINTS, THING
 
 
 _NO_OP_FUNC = lambda *args, **kwargs: None  # noqa
 
 DEBUG_ENABLED = logger.isEnabledFor(logging.DEBUG)
 
+# Autoscaling (only applies if max_workers > num_workers). How often to evaluate scaling.
+SCALE_INTERVAL = 5
+# Queue wait time (seconds) above which (or queue length above number of workers) the pool is under pressure
+SCALE_UP_AGE = 2
+# Consecutive intervals of pressure before growing / of idleness before shrinking (by one)
+SCALE_UP_TICKS = 2
+SCALE_DOWN_TICKS = 6
+# Don't grow if average call latency has increased by this factor since previous growth (agent is saturated)
+SCALE_LATENCY_FACTOR = 1.5
 
-class Message(namedtuple('nt_Message', 'lid idx diff complete_cb')):
-    """Represent an individual queue message to handle"""
+# Initial retry delay (seconds) for failed messages by failure type. Doubled for each further consecutive failure for
+# the same LID (up to RETRY_MAX) and randomised by up to half (jitter).
+RETRY_BASE_LINK = 1
+RETRY_BASE_SYNC_TIMEOUT = 5
+RETRY_MAX = 60
+
+_QUEUE_WAIT = REGISTRY.histogram('ioticiser_queue_wait_seconds', 'Time diffs waited in worker queue (excl. retries)',
+                                 ('source',))
+_REQUEST_LATENCY = REGISTRY.histogram('ioticiser_agent_request_seconds', 'Agent request latency by method',
+                                      ('source', 'method'))
+_RETRIES = REGISTRY.counter('ioticiser_retries_total', 'Diffs scheduled for retry by reason', ('source', 'reason'))
+_CACHE = REGISTRY.counter('ioticiser_cache_requests_total', 'Worker thing & point cache lookups by result',
+                          ('source', 'cache', 'result'))
+
+STATS_WORKERS = 'workers'
+STATS_SCALED_UP = 'scaled_up'
+STATS_SCALED_DOWN = 'scaled_down'
+STATS_RETRIES = 'retries'
+STATS_RETRY_QUEUED = 'retry_queued'
+STATS_GOVERNOR = 'governor'
+
+
+def lid_shard(lid, num_shards):
+    """Returns the shard (0 <= shard < num_shards) which the given LID consistently maps to"""
+    return crc32(lid.encode('utf-8')) % num_shards
+
+
+class Message(namedtuple('nt_Message', 'lid idx diff complete_cb queued')):
+    """Represent an individual queue message to handle. queued is the (monotonic) time at which it was submitted."""
 
 
 class LidSerialisedQueue(object):
     """Thread-safe queue which ensures enqueued Messages for the same lid are not handled by multiple threads at the
-    same time."""
+    same time. Messages can also be deferred (for retry), during which time no other messages for the same lid are
+    returned."""
 
     def __init__(self):
         self.__queue = Queue()
@@ -52,6 +93,9 @@ class LidSerialisedQueue(object):
         self.__lid_mapping = {}
         self.__local = thread_local()
         self.__new_msg = Event()
+        # Heap of (due time, sequence, Message) for deferred messages. (Sequence ensures messages are never compared.)
+        self.__deferred = []
+        self.__deferred_seq = count()
 
     def thread_init(self):
         """Must be called in each thread which is to use this instance, before using get()!"""
@@ -65,12 +109,46 @@ class LidSerialisedQueue(object):
     def qsize(self):
         return self.__queue.qsize()
 
+    def deferred_size(self):
+        return len(self.__deferred)
+
     def put(self, qmsg):
         if not isinstance(qmsg, Message):
             raise ValueError
         self.__queue.put(qmsg)
         self.__new_msg.set()
 
+    def release(self):
+        """Gives up association with the LID previously handled by the calling thread. Returns False if there are still
+        messages pending for said LID (in which case the caller must continue to handle them via get()).
+        """
+        with self.__lock:
+            local = self.__local
+            if local.own_lid is None:
+                return True
+            if self.__lid_mapping[local.own_lid]:
+                return False
+            del self.__lid_mapping[local.own_lid]
+            local.own_lid = None
+            return True
+
+    def defer(self, qmsg, delay):
+        """Makes the message (last returned by get() in the calling thread) available from get() again after delay
+        seconds. Meanwhile messages for the same LID are held back and the calling thread can handle other LIDs."""
+        with self.__lock:
+            heappush(self.__deferred, (monotonic() + delay, next(self.__deferred_seq), qmsg))
+            # LID remains in mapping so that no other thread picks up further messages for it
+            self.__local.own_lid = None
+
+    def __get_deferred(self):
+        """Returns deferred message which is due, if available. None otherwise. MUST be called within lock!"""
+        deferred = self.__deferred
+        if deferred and deferred[0][0] <= monotonic():
+            msg = heappop(deferred)[2]
+            self.__local.own_lid = msg.lid
+            return msg
+        return None
+
     def __get_for_current_lid(self):
         """Returns next message for same LID as previous message, if available. None otherwise. MUST be called within
         lock!
@@ -91,22 +169,29 @@ class LidSerialisedQueue(object):
     def get(self, timeout=None):
         """Raises queue.Empty exception if no messages are available after timeout"""
         with self.__lock:
-            msg = self.__get_for_current_lid()
+            msg = self.__get_for_current_lid() or self.__get_deferred()
 
             if not msg:
                 queue = self.__queue
                 lid_mapping = self.__lid_mapping
+                deferred = self.__deferred
 
                 while True:
                     # Instead of blocking on get(), release lock so other threads have a chance to request existing lid
                     # messages (above, via __get_for_current_lid).
                     if not queue.qsize() and timeout:
                         self.__new_msg.clear()
+                        wait = timeout
+                        if deferred:
+                            wait = max(0, min(timeout, deferred[0][0] - monotonic()))
                         try:
                             self.__lock.release()
-                            self.__new_msg.wait(timeout)
+                            self.__new_msg.wait(wait)
                         finally:
                             self.__lock.acquire()
+                        msg = self.__get_deferred()
+                        if msg:
+                            break
                     msg = queue.get_nowait()
                     # Enqueue message with LID already being dealt with in LID-specific queue, otherwise can process
                     # oneself.
@@ -121,83 +206,305 @@ class LidSerialisedQueue(object):
         return msg
 
 
+class RequestBatch(object):
+    """Collects agent requests which do not depend on each other so that they can be in flight at the same time and
+    waited for together. Requests are issued via the agent's asynchronous (*_async) variant where one exists, otherwise
+    synchronously. All requests are recorded in the given ConnectionStats and, if a RateGovernor is given, only issued
+    once it allows. Each finished request is passed to the given hooks (see Tracing).
+
+    Note: The agent's public API only offers waiting on the RequestEvent of an asynchronous request, not the mapping of
+    its failure to the exceptions raised by the synchronous calls (which the worker's retry handling relies on). So
+    requests are waited for via IOT.Client._wait_and_except_if_failed, as the synchronous calls themselves do in
+    py-IoticAgent 0.6 (pinned in requirements.txt)."""
+
+    def __init__(self, iotclient, stats, governor=None, source='', lid=None, hooks=()):
+        # pylint: disable=too-many-arguments
+        self.__client = iotclient
+        self.__stats = stats
+        self.__governor = governor
+        self.__source = source
+        self.__lid = lid
+        self.__hooks = hooks
+        self.__events = deque()
+
+    def __finished(self, method, started, outcome=OUTCOME_OK):
+        self.__stats.finished(started)
+        duration = monotonic() - started
+        _REQUEST_LATENCY.observe(duration, (self.__source, method))
+        for hook in self.__hooks:
+            try:
+                hook(self.__source, method, self.__lid, duration, outcome)
+            except:
+                logger.error("Operation hook %r failed", hook, exc_info=DEBUG_ENABLED)
+
+    def call(self, obj, method, *args, **kwargs):
+        try:
+            func = getattr(obj, method + '_async')
+        except AttributeError:
+            self.call_sync(obj, method, *args, **kwargs)
+        else:
+            if self.__governor is not None:
+                self.__governor.acquire(method)
+            started = self.__stats.started()
+            try:
+                self.__events.append((func(*args, **kwargs), method, started))
+            except:
+                self.__finished(method, started, OUTCOME_FAILED)
+                raise
+
+    def call_sync(self, obj, method, *args, **kwargs):
+        if self.__governor is not None:
+            self.__governor.acquire(method)
+        started = self.__stats.started()
+        try:
+            result = getattr(obj, method)(*args, **kwargs)
+        except:
+            self.__finished(method, started, OUTCOME_FAILED)
+            raise
+        self.__finished(method, started)
+        return result
+
+    def wait(self):
+        """Waits for all outstanding requests. Raises the same exceptions as the synchronous calls would for the first
+        failed request."""
+        events = self.__events
+        self.__events = deque()
+        finished = self.__finished
+        try:
+            while events:
+                try:
+                    self.__client._wait_and_except_if_failed(events[0][0])
+                except:
+                    finished(*events.popleft()[1:], outcome=OUTCOME_FAILED)
+                    raise
+                finished(*events.popleft()[1:])
+        finally:
+            # Remaining requests are abandoned on failure (the whole diff will be retried)
+            for _, method, started in events:
+                finished(method, started, OUTCOME_ABANDONED)
+
+    def abandon(self):
+        """Finishes all outstanding requests as abandoned without waiting for them, e.g. if a request issued after them
+        failed (so that the diff will be retried)"""
+        events = self.__events
+        self.__events = deque()
+        for _, method, started in events:
+            self.__finished(method, started, OUTCOME_ABANDONED)
+
+
 class ThreadPool(object):  # pylint: disable=too-many-instance-attributes
 
     __share_time_fmt = '%Y-%m-%dT%H:%M:%S.%fZ'
 
-    def __init__(self, name, num_workers=1, iotclient=None, daemonic=False):
+    def __init__(self, name, num_workers=1, iotclient=None, daemonic=False, max_workers=None, rates=None, hooks=None):
+        """iotclient - ClientPool instance
+        max_workers - If larger than num_workers, the number of workers is scaled between the two based on load.
+        rates - If set, dict of operation class to maximum agent requests per second (see RateGovernor)
+        hooks - If set, list of callables to pass each finished agent request to (see Tracing)
+        """
+        # pylint: disable=too-many-arguments
         self.__name = name
         self.__num_workers = num_workers
+        self.__max_workers = num_workers if max_workers is None else max(num_workers, max_workers)
         self.__iotclient = iotclient
         self.__daemonic = daemonic
+        self.__hooks = tuple(hooks or ())
         #
         self.__queue = LidSerialisedQueue()
         self.__stop = Event()
         self.__stop.set()
+        # Workers waiting for the governor are released on stop
+        self.__governor = RateGovernor(rates, stop=self.__stop) if rates else None
         self.__threads = []
+        self.__thread_count = 0
+        self.__scaler = None
         self.__cache = {}
+        # Protects below
+        self.__load_lock = Lock()
+        # Number of workers which should exit (when scaling down)
+        self.__retire = 0
+        # Load since last scaling evaluation (longest queue wait time, number of messages handled)
+        self.__load_wait_max = 0
+        self.__load_handled = 0
+        # Scaling decisions & retries since last stats collection
+        self.__scaled_up = self.__scaled_down = 0
+        self.__retries = 0
+        # Number of consecutive failures by LID (only modified by thread currently handling said LID)
+        self.__failures = {}
+        # Number of consecutive link failures (across all LIDs)
+        self.__link_failures = 0
 
     def start(self):
         if self.__stop.is_set():
             self.__stop.clear()
-            for i in range(0, self.__num_workers):
-                thread = Thread(target=self.__worker, name=('tp-%s-%d' % (self.__name, i)))
-                thread.daemon = self.__daemonic
-                self.__threads.append(thread)
-            for thread in self.__threads:
-                thread.start()
+            self.__add_workers(self.__num_workers)
+            if self.__max_workers > self.__num_workers:
+                self.__scaler = Thread(target=self.__scale, name=('tp-%s-scale' % self.__name))
+                self.__scaler.daemon = self.__daemonic
+                self.__scaler.start()
+
+    def __add_workers(self, num):
+        # Remove threads of retired workers
+        self.__threads = [thread for thread in self.__threads if thread.is_alive()]
+        for _ in range(num):
+            thread = Thread(target=self.__worker, name=('tp-%s-%d' % (self.__name, self.__thread_count)))
+            thread.daemon = self.__daemonic
+            self.__thread_count += 1
+            self.__threads.append(thread)
+            thread.start()
 
     def qsize(self):
         return self.__queue.qsize()
 
     def submit(self, lid, idx, diff, complete_cb=None):
-        self.__queue.put(Message(lid, idx, diff, complete_cb))
+        self.__queue.put(Message(lid, idx, diff, complete_cb, monotonic()))
 
     def stop(self):
         if not self.__stop.is_set():
             self.__stop.set()
+            if self.__scaler is not None:
+                self.__scaler.join()
+                self.__scaler = None
             for thread in self.__threads:
                 thread.join()
             del self.__threads[:]
+            self.__retire = 0
 
     @property
     def queue_empty(self):
         return self.__queue.empty
 
-    def __worker(self):
+    def cache_snapshot(self):
+        """Returns copy of the worker cache (LID to dict of agent thing & points by PID) for Footprint.analyse,
+        approximate since workers update it concurrently"""
+        return {lid: {THING: entry[THING], POINTS: dict(entry[POINTS])} for lid, entry in list(self.__cache.items())}
+
+    @property
+    def link_failures(self):
+        """Number of consecutive diffs which failed due to network errors (i.e. reset once any diff succeeds)"""
+        return self.__link_failures
+
+    def collect_stats(self):
+        """Returns dict of current number of workers & deferred (for retry) messages and of scaling decisions, retries &
+        rate governor statistics since the previous call"""
+        with self.__load_lock:
+            ret = {STATS_WORKERS: self.__alive_workers(),
+                   STATS_SCALED_UP: self.__scaled_up,
+                   STATS_SCALED_DOWN: self.__scaled_down,
+                   STATS_RETRIES: self.__retries,
+                   STATS_RETRY_QUEUED: self.__queue.deferred_size(),
+                   STATS_GOVERNOR: None if self.__governor is None else self.__governor.collect_stats()}
+            self.__scaled_up = self.__scaled_down = self.__retries = 0
+        return ret
+
+    def __alive_workers(self):
+        """Number of workers, excluding ones about to retire. Must be called within load lock."""
+        return sum(1 for thread in self.__threads if thread.is_alive()) - self.__retire
+
+    def __scale(self):  # pylint: disable=too-many-branches
+        logger.debug("Starting")
+        up_ticks = down_ticks = 0
+        requests_last, latency_last = self.__iotclient.totals()
+        # Average call latency at the time of the last growth
+        latency_baseline = None
+
+        while not self.__stop.wait(timeout=SCALE_INTERVAL):
+            with self.__load_lock:
+                wait_max, handled = self.__load_wait_max, self.__load_handled
+                self.__load_wait_max = self.__load_handled = 0
+                workers = self.__alive_workers()
+            qsize = self.__queue.qsize()
+            # Nothing dequeued whilst messages waiting - all workers busy for the whole interval
+            if qsize and not handled:
+                wait_max = max(wait_max, SCALE_INTERVAL)
+            requests, latency = self.__iotclient.totals()
+            latency_avg = ((latency - latency_last) / (requests - requests_last)) if requests > requests_last else None
+            requests_last, latency_last = requests, latency
+
+            if qsize > workers or wait_max > SCALE_UP_AGE:
+                up_ticks += 1
+                down_ticks = 0
+            elif not qsize and wait_max < SCALE_UP_AGE / 2.0:
+                down_ticks += 1
+                up_ticks = 0
+            else:
+                up_ticks = down_ticks = 0
+
+            if up_ticks >= SCALE_UP_TICKS and workers < self.__max_workers:
+                up_ticks = 0
+                if (latency_avg is not None and latency_baseline is not None and
+                        latency_avg > latency_baseline * SCALE_LATENCY_FACTOR):
+                    logger.info("Not scaling up from %d workers: call latency %.3fs up from %.3fs (queued=%d)",
+                                workers, latency_avg, latency_baseline, qsize)
+                    continue
+                added = min(max(1, workers // 2), self.__max_workers - workers)
+                logger.info("Scaling up by %d to %d workers (queued=%d, wait=%.1fs)", added, workers + added, qsize,
+                            wait_max)
+                latency_baseline = latency_avg
+                with self.__load_lock:
+                    self.__scaled_up += 1
+                    self.__add_workers(added)
+            elif down_ticks >= SCALE_DOWN_TICKS and workers > self.__num_workers:
+                down_ticks = 0
+                logger.info("Scaling down to %d workers (idle)", workers - 1)
+                latency_baseline = None
+                with self.__load_lock:
+                    self.__scaled_down += 1
+                    self.__retire += 1
+
+    def __should_retire(self):
+        """Returns True if this worker should exit due to scaling down. Must not be called whilst handling a message."""
+        if self.__retire and self.__queue.release():
+            with self.__load_lock:
+                if self.__retire:
+                    self.__retire -= 1
+                    return True
+        return False
+
+    def __worker(self):  # pylint: disable=too-many-branches
+        # Not imported at module level since IoticAgent.IOT is slow to import (see create_iot_client)
+        from IoticAgent.IOT.Exceptions import IOTAccessDenied, IOTSyncTimeout
         logger.debug("Starting")
         self.__queue.thread_init()
         stop_is_set = self.__stop.is_set
         queue_get = self.__queue.get
         handle_thing_changes = self.__handle_thing_changes
+        load_lock = self.__load_lock
 
         while not stop_is_set():
+            if self.__should_retire():
+                logger.debug("Retiring")
+                return
             try:
                 qmsg = queue_get(timeout=.25)
             except Empty:
                 continue  # queue.get timeout ignore
 
-            while True:
-                try:
-                    handle_thing_changes(qmsg.lid, qmsg.diff)
-                except LinkException:
-                    logger.warning("Network error, will retry lid '%s'", qmsg.lid)
-                    self.__stop.wait(timeout=1)
-                    continue
-                except IOTSyncTimeout:
-                    logger.warning("Sync Timeout for lid '%s'", qmsg.lid)
-                    self.__stop.wait(timeout=5)
-                    continue
-                except IOTAccessDenied:
-                    logger.critical("IOTAccessDenied - Local limit exceeded - Aborting")
-                    kill(getpid(), SIGUSR1)
-                    return
-                except:
-                    logger.error("Failed to process thing changes (Uncaught exception)  - Aborting",
-                                 exc_info=True)
-                    kill(getpid(), SIGUSR1)
-                    return
-                break
+            self.__record_load(qmsg)
+            try:
+                handle_thing_changes(qmsg.lid, qmsg.diff)
+            except LinkException:
+                with load_lock:
+                    self.__link_failures += 1
+                self.__retry_later(qmsg, RETRY_BASE_LINK, 'link', "Network error")
+                continue
+            except IOTSyncTimeout:
+                self.__retry_later(qmsg, RETRY_BASE_SYNC_TIMEOUT, 'sync_timeout', "Sync Timeout")
+                continue
+            except GovernorStopped:
+                # Stopping - diff remains pending in the stash (so is resubmitted on next start)
+                logger.debug("Stopped whilst rate limited, not completing thing %s", qmsg.lid)
+                continue
+            except IOTAccessDenied:
+                logger.critical("IOTAccessDenied - Local limit exceeded - Aborting")
+                kill(getpid(), SIGUSR1)
+                return
+            except:
+                logger.error("Failed to process thing changes (Uncaught exception)  - Aborting",
+                             exc_info=True)
+                kill(getpid(), SIGUSR1)
+                return
+            self.__record_success(qmsg)
 
             logger.debug("completed thing %s", qmsg.lid)
             if qmsg.complete_cb:
@@ -208,114 +515,157 @@ class ThreadPool(object):  # pylint: disable=too-many-instance-attributes
                     kill(getpid(), SIGUSR1)
                     return
 
+    def __record_load(self, qmsg):
+        # Retries are not indicative of load (they were delayed on purpose)
+        if qmsg.lid not in self.__failures:
+            wait = monotonic() - qmsg.queued
+            _QUEUE_WAIT.observe(wait, (self.__name,))
+            with self.__load_lock:
+                self.__load_handled += 1
+                if wait > self.__load_wait_max:
+                    self.__load_wait_max = wait
+
+    def __record_success(self, qmsg):
+        self.__failures.pop(qmsg.lid, None)
+        if self.__link_failures:
+            with self.__load_lock:
+                self.__link_failures = 0
+
+    def __retry_later(self, qmsg, base, kind, reason):
+        failures = self.__failures.get(qmsg.lid, 0)
+        self.__failures[qmsg.lid] = failures + 1
+        delay = min(RETRY_MAX, base * 2 ** failures) * uniform(.5, 1)
+        logger.warning("%s for lid '%s', will retry in %.1fs", reason, qmsg.lid, delay)
+        with self.__load_lock:
+            self.__retries += 1
+        _RETRIES.inc((self.__name, kind))
+        self.__queue.defer(qmsg, delay)
+
     @classmethod
     def __lang_convert(cls, lang):
         if lang == '':
             return None
         return lang
 
-    def __handle_thing_changes(self, lid, diff):  # pylint: disable=too-many-branches
-        if lid not in self.__cache:
+    def __handle_thing_changes(self, lid, diff):
+        iotclient, stats = self.__iotclient.for_lid(lid)
+        batch = RequestBatch(iotclient, stats, self.__governor, source=self.__name, lid=lid, hooks=self.__hooks)
+        try:
+            self.__apply_thing_changes(batch, iotclient, lid, diff)
+        except:
+            # Synchronous requests (and rate limiting) can fail whilst earlier asynchronous ones are still outstanding
+            batch.abandon()
+            raise
+
+    def __apply_thing_changes(self, batch, iotclient, lid, diff):  # pylint: disable=too-many-branches
+        # Stage 1 - everything else depends on the thing existing
+        if lid in self.__cache:
+            _CACHE.inc((self.__name, 'thing', 'hit'))
+        else:
+            _CACHE.inc((self.__name, 'thing', 'miss'))
             self.__cache[lid] = {
-                THING: self.__iotclient.create_thing(lid),
+                THING: batch.call_sync(iotclient, 'create_thing', lid),
                 POINTS: {}
             }
         iotthing = self.__cache[lid][THING]
 
-        if PUBLIC in diff and diff[PUBLIC] is False:
-            iotthing.set_public(False)
-
-        thingmeta = None
-        for chg, val in diff.items():
-            # if chg == TAGS and len(val):
-            if chg == TAGS and val:
-                iotthing.create_tag(val)
-            elif chg == LABELS and val:
-                if thingmeta is None:
-                    thingmeta = iotthing.get_meta()
-                for lang, label in val.items():
-                    thingmeta.set_label(label, lang=self.__lang_convert(lang))
-            elif chg == DESCRIPTIONS and val:
-                if thingmeta is None:
-                    thingmeta = iotthing.get_meta()
-                for lang, description in val.items():
-                    thingmeta.set_description(description, lang=self.__lang_convert(lang))
-            elif chg == LOCATION and val[0] is not None:
-                if thingmeta is None:
-                    thingmeta = iotthing.get_meta()
-                thingmeta.set_location(val[0], val[1])
-        if thingmeta is not None:
-            thingmeta.set()
-
-        for pid, pdiff in diff[POINTS].items():
-            self.__handle_point_changes(iotthing, lid, pid, pdiff)
-
-        if PUBLIC in diff and diff[PUBLIC] is True:
-            iotthing.set_public(True)
-
-    def __handle_point_changes(self, iotthing, lid, pid, pdiff):  # pylint: disable=too-many-branches,too-many-locals
-        if pid not in self.__cache[lid][POINTS]:
-            if pdiff[FOC] == R_FEED:
-                iotpoint = iotthing.create_feed(pid)
-            elif pdiff[FOC] == R_CONTROL:
+        # Stage 2 - thing level changes and point creation only depend on the thing
+        if diff.public is False:
+            batch.call(iotthing, 'set_public', False)
+
+        if diff.tags:
+            batch.call(iotthing, 'create_tag', list(diff.tags))
+        location = diff.location
+        if location is not None and location[0] is None:
+            location = None
+        if diff.labels or diff.descriptions or location is not None:
+            thingmeta = batch.call_sync(iotthing, 'get_meta')
+            for lang, label in diff.labels:
+                thingmeta.set_label(label, lang=self.__lang_convert(lang))
+            for lang, description in diff.descriptions:
+                thingmeta.set_description(description, lang=self.__lang_convert(lang))
+            if location is not None:
+                thingmeta.set_location(location[0], location[1])
+            batch.call(thingmeta, 'set')
+
+        for pdiff in diff.points:
+            self.__create_point(batch, iotthing, lid, pdiff)
+        batch.wait()
+
+        # Stage 3 - point metadata and values only depend on their point
+        for pdiff in diff.points:
+            self.__handle_point_changes(batch, lid, pdiff)
+        batch.wait()
+
+        # Stage 4 - shares, once all values have been described
+        for pdiff in diff.points:
+            self.__handle_point_shares(batch, lid, pdiff)
+        batch.wait()
+
+        # Stage 5 - only make public once fully described
+        if diff.public is True:
+            batch.call_sync(iotthing, 'set_public', True)
+
+    def __create_point(self, batch, iotthing, lid, pdiff):
+        if pdiff.pid in self.__cache[lid][POINTS]:
+            _CACHE.inc((self.__name, 'point', 'hit'))
+        else:
+            _CACHE.inc((self.__name, 'point', 'miss'))
+            if pdiff.foc == R_FEED:
+                iotpoint = batch.call_sync(iotthing, 'create_feed', pdiff.pid)
+            elif pdiff.foc == R_CONTROL:
                 # Catch-all callbacks are used to propagate control requests rather than individual ones
-                iotpoint = iotthing.create_control(pid, _NO_OP_FUNC)
-            self.__cache[lid][POINTS][pid] = iotpoint
-        iotpoint = self.__cache[lid][POINTS][pid]
-        pointmeta = None
-
-        for chg, val in pdiff.items():
-            # if chg == TAGS and len(val):
-            if chg == TAGS and val:
-                iotpoint.create_tag(val)
-            elif chg == RECENT:
-                # Since all point types share the same class & stash space, manually check
-                if pdiff[FOC] == R_FEED:
-                    iotpoint.set_recent_config(max_samples=pdiff[RECENT])
-            elif chg == LABELS and val:
-                if pointmeta is None:
-                    pointmeta = iotpoint.get_meta()
-                for lang, label in val.items():
-                    pointmeta.set_label(label, lang=self.__lang_convert(lang))
-            elif chg == DESCRIPTIONS and val:
-                if pointmeta is None:
-                    pointmeta = iotpoint.get_meta()
-                for lang, description in val.items():
-                    pointmeta.set_description(description, lang=self.__lang_convert(lang))
-        if pointmeta is not None:
-            pointmeta.set()
-
-        sharedata = {}
-        for label, vdiff in pdiff[VALUES].items():
-            if SHAREDATA in vdiff:
-                sharedata[label] = vdiff[SHAREDATA]
-            self.__handle_value_changes(lid, pid, label, vdiff)
-
-        sharetime = None
-        if SHARETIME in pdiff:
-            sharetime = pdiff[SHARETIME]
-            if isinstance(sharetime, string_types):
-                try:
-                    sharetime = datetime.strptime(sharetime, self.__share_time_fmt)
-                except:
-                    logger.warning("Failed to make datetime from time string '%s' !Will use None!", sharetime)
-                    sharetime = None
+                iotpoint = batch.call_sync(iotthing, 'create_control', pdiff.pid, _NO_OP_FUNC)
+            self.__cache[lid][POINTS][pdiff.pid] = iotpoint
+
+    def __handle_point_changes(self, batch, lid, pdiff):
+        iotpoint = self.__cache[lid][POINTS][pdiff.pid]
+
+        if pdiff.tags:
+            batch.call(iotpoint, 'create_tag', list(pdiff.tags))
+        # Since all point types share the same class & stash space, manually check
+        if pdiff.recent is not None and pdiff.foc == R_FEED:
+            batch.call(iotpoint, 'set_recent_config', max_samples=pdiff.recent)
+        if pdiff.labels or pdiff.descriptions:
+            pointmeta = batch.call_sync(iotpoint, 'get_meta')
+            for lang, label in pdiff.labels:
+                pointmeta.set_label(label, lang=self.__lang_convert(lang))
+            for lang, description in pdiff.descriptions:
+                pointmeta.set_description(description, lang=self.__lang_convert(lang))
+            batch.call(pointmeta, 'set')
+
+        for vdiff in pdiff.values:
+            self.__handle_value_changes(batch, iotpoint, vdiff)
+
+    def __handle_point_shares(self, batch, lid, pdiff):
+        iotpoint = self.__cache[lid][POINTS][pdiff.pid]
+
+        sharedata = {vdiff.label: vdiff.sharedata for vdiff in pdiff.values if vdiff.shared}
+
+        sharetime = pdiff.sharetime
+        if sharetime is not None:
+            try:
+                sharetime = datetime.strptime(sharetime, self.__share_time_fmt)
+            except:
+                logger.warning("Failed to make datetime from time string '%s' !Will use None!", sharetime)
+                sharetime = None
 
         # if len(sharedata):
         if sharedata:
-            iotpoint.share(data=sharedata, time=sharetime)
+            batch.call(iotpoint, 'share', data=sharedata, time=sharetime)
 
-        if SHAREDATA in pdiff:
-            iotpoint.share(data=pdiff[SHAREDATA], time=sharetime)
+        if pdiff.shared:
+            batch.call(iotpoint, 'share', data=pdiff.sharedata, time=sharetime)
 
-    def __handle_value_changes(self, lid, pid, label, vdiff):
+    @classmethod
+    def __handle_value_changes(cls, batch, iotpoint, vdiff):
         """
         Note: remove & add values if changed, share data if data
         """
-        iotpoint = self.__cache[lid][POINTS][pid]
-        if VTYPE in vdiff and vdiff[VTYPE] is not None:
-            iotpoint.create_value(label,
-                                  vdiff[VTYPE],
-                                  lang=vdiff[LANG],
-                                  description=vdiff[DESCRIPTION],
-                                  unit=vdiff[UNIT])
+        if vdiff.vtype is not None:
+            batch.call(iotpoint, 'create_value',
+                       vdiff.label,
+                       vdiff.vtype,
+                       lang=vdiff.lang,
+                       description=vdiff.description,
+                       unit=vdiff.unit)
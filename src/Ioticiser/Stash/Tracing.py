@@ -0,0 +1,85 @@
+# Copyright (c) 2017 Iotic Labs Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://github.com/Iotic-Labs/py-IoticBulkData/blob/master/LICENSE
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tracing of individual agent requests made by workers
+
+A hook is a callable which is called (in the worker thread) once each agent request has finished, as:
+
+    hook(source, operation, lid, duration, outcome)
+
+where operation is the agent method name (e.g. create_thing, set, share), lid the thing the request was made for,
+duration the time in seconds from issuing the request to its completion being observed and outcome one of the
+OUTCOME_* constants. Hooks must be fast and should not raise. See OperationStats for a built-in hook.
+"""
+
+from __future__ import unicode_literals
+
+from heapq import nlargest
+
+from IoticAgent.Core.compat import Lock
+
+
+OUTCOME_OK = 'ok'
+OUTCOME_FAILED = 'failed'
+# Not waited for since an earlier request of the same diff failed
+OUTCOME_ABANDONED = 'abandoned'
+
+STATS_OPERATIONS = 'operations'
+STATS_LIDS = 'lids'
+
+
+class OperationStats(object):
+    """Hook which aggregates request durations by operation and by LID, see collect()"""
+
+    def __init__(self, top=5):
+        """top - Number of slowest operations & LIDs to return from collect()"""
+        self.__top = top
+        self.__lock = Lock()
+        # Operation to list of count, failures, total duration, max duration
+        self.__operations = {}
+        # LID to list of count, total duration
+        self.__lids = {}
+
+    def __call__(self, source, operation, lid, duration, outcome):  # pylint: disable=unused-argument
+        with self.__lock:
+            try:
+                stats = self.__operations[operation]
+            except KeyError:
+                stats = self.__operations[operation] = [0, 0, 0, 0]
+            stats[0] += 1
+            if outcome != OUTCOME_OK:
+                stats[1] += 1
+            stats[2] += duration
+            if duration > stats[3]:
+                stats[3] = duration
+            try:
+                stats = self.__lids[lid]
+            except KeyError:
+                stats = self.__lids[lid] = [0, 0]
+            stats[0] += 1
+            stats[1] += duration
+
+    def collect(self):
+        """Returns dict of the operations & LIDs which took the longest in total since the previous call:
+
+            STATS_OPERATIONS - list of (operation, count, failures, total, average, max), longest total first
+            STATS_LIDS - list of (lid, requests, total), longest total first
+        """
+        with self.__lock:
+            operations, self.__operations = self.__operations, {}
+            lids, self.__lids = self.__lids, {}
+        operations = nlargest(self.__top, operations.items(), key=lambda item: item[1][2])
+        lids = nlargest(self.__top, lids.items(), key=lambda item: item[1][1])
+        return {STATS_OPERATIONS: [(operation, count, failures, total, total / count, max_duration)
+                                   for operation, (count, failures, total, max_duration) in operations],
+                STATS_LIDS: [(lid, count, total) for lid, (count, total) in lids]}
@@ -0,0 +1,66 @@
+# Copyright (c) 2017 Iotic Labs Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://github.com/Iotic-Labs/py-IoticBulkData/blob/master/LICENSE
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Handle for tracking completion of a thing update
+"""
+
+from __future__ import unicode_literals
+
+from IoticAgent.Core.compat import Event
+
+
+class Update(object):
+    """Returned by Stash._finalise_thing (and available via Thing.last_update) to allow for waiting until the changes
+    to a thing have been made in Iotic Space.
+    """
+
+    __slots__ = ('__lid', '__throttled', '__spooled', '__event')
+
+    def __init__(self, lid, done=False, throttled=False, spooled=False):
+        self.__lid = lid
+        self.__throttled = throttled
+        self.__spooled = spooled
+        self.__event = Event()
+        if done:
+            self.__event.set()
+
+    @property
+    def lid(self):
+        return self.__lid
+
+    @property
+    def throttled(self):
+        """Whether the update was dropped (i.e. will never be made) since too many updates were pending (see
+        Stash.pressure)"""
+        return self.__throttled
+
+    @property
+    def spooled(self):
+        """Whether the update was written to disk since Iotic Space was unreachable. It will be made (and so be done)
+        once Iotic Space is reachable again."""
+        return self.__spooled
+
+    @property
+    def done(self):
+        """True once the update has been made (or there was nothing to do). Never True if the update was throttled."""
+        return self.__event.is_set()
+
+    def wait(self, timeout=None):
+        """Returns True if the update is done, False if timeout (in seconds) occurred first or (immediately) if the
+        update was throttled."""
+        if self.__throttled:
+            return False
+        return self.__event.wait(timeout)
+
+    def _set_done(self):
+        self.__event.set()
@@ -34,6 +34,8 @@ DESCRIPTIONS = 'ds'
 POINTS = 'ps'
 VALUES = 'vs'
 IDX = 'idx'
+CREATED = 'ct'
+NEW = 'nw'
 COMPLETE_CB = 'cb'
 
 VALUE = 'val.'
@@ -0,0 +1,270 @@
+# Copyright (c) 2017 Iotic Labs Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://github.com/Iotic-Labs/py-IoticBulkData/blob/master/LICENSE
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Runs each source in its own process (see [main] process_per_source), restarting it if it fails
+"""
+
+from __future__ import unicode_literals
+
+from os import kill
+from signal import signal, SIGINT, SIGTERM, SIG_IGN
+from threading import Thread
+from time import sleep
+import multiprocessing
+import logging
+import sys
+logger = logging.getLogger(__name__)
+
+from IoticAgent.Core.compat import Empty, Event, monotonic
+
+from .compat import SIGUSR1, SIGHUP
+from .Config import Config
+from .Metrics import REGISTRY
+from .Runner import Runner
+from .Stash.ProcessPool import _log_config
+
+
+# Exit codes of source processes
+EXIT_OK = 0
+EXIT_ABORTED = 1
+# Runner could not be created (e.g. invalid configuration), so restarting is pointless
+EXIT_INIT_FAILED = 2
+
+# Restart delay (seconds) after a source process fails, doubled for each further failure (up to RESTART_MAX) unless it
+# ran for at least RESTART_RESET seconds
+RESTART_BASE = 1
+RESTART_MAX = 60
+RESTART_RESET = 60
+# How often to log the state of source processes
+HEARTBEAT_INTERVAL = 120
+# How long to wait for a source process to stop before killing it
+STOP_TIMEOUT = 60
+
+_RESTARTS = REGISTRY.counter('ioticiser_source_restarts_total', 'Restarts of failed source processes', ('source',))
+_UP = REGISTRY.gauge('ioticiser_source_up', 'Whether source process is running', ('source',))
+
+
+def _source_main(cfg_file, name, datapath, log_config, metrics_interval, out_queue):
+    # pylint: disable=too-many-arguments,too-many-locals
+    level, fmt = log_config
+    # Tag output (e.g. heartbeat) with source since all sources log to the same stream
+    logging.basicConfig(level=level, format='%s: %s' % (name.replace('%', '%%'), fmt or logging.BASIC_FORMAT))
+    logging.getLogger('rdflib').setLevel(logging.WARNING)
+    logging.getLogger('IoticAgent').setLevel(logging.WARNING)
+
+    stop = Event()
+    aborted = Event()
+    reload = Event()  # pylint: disable=redefined-builtin
+
+    def receive_signal(signum, stack):  # pylint: disable=unused-argument
+        if signum == SIGHUP:
+            reload.set()
+            return
+        if signum == SIGUSR1:
+            logger.critical("Received Abort Signal (SIGUSR1).  Exiting.")
+            aborted.set()
+        stop.set()
+
+    # Supervisor is responsible for shutdown (SIGTERM), workers trigger abort via SIGUSR1 (as in single process mode)
+    signal(SIGINT, SIG_IGN)
+    signal(SIGTERM, receive_signal)
+    signal(SIGUSR1, receive_signal)
+    if SIGHUP is not None:
+        signal(SIGHUP, receive_signal)
+
+    try:
+        runner = Runner(name, Config(cfg_file).get(name), stop, datapath)
+    except Exception as e:  # pylint: disable=broad-except
+        logger.exception("Runner [%s] failed init. Reason [%s]", name, str(e))
+        sys.exit(EXIT_INIT_FAILED)
+
+    # Supervisor might no longer be reading metrics when stopping (so don't wait for them to be sent on exit)
+    out_queue.cancel_join_thread()
+    runner.start()
+    last_metrics = 0
+    # Not waiting on stop since the signal handler (which sets it) would deadlock if run during the wait
+    while not stop.is_set() and runner.is_alive():
+        if metrics_interval and monotonic() - last_metrics >= metrics_interval:
+            last_metrics = monotonic()
+            out_queue.put((name, REGISTRY.snapshot()))
+        if reload.is_set():
+            reload.clear()
+            try:
+                config = Config(cfg_file).get(name)
+                if config is None:
+                    raise ValueError('config section missing')
+                runner.reload(config)
+            except Exception as e:  # pylint: disable=broad-except
+                logger.error("Runner [%s] failed reload. Reason [%s]", name, str(e))
+        sleep(0.1)
+    stop.set()
+    while runner.is_alive():
+        sleep(0.1)
+    sys.exit(EXIT_ABORTED if aborted.is_set() else EXIT_OK)
+
+
+class SourceProcess(object):
+    """Source process state, as seen by the supervisor"""
+
+    def __init__(self, name):
+        self.name = name
+        self.process = None
+        self.started = None
+        self.restarts = 0
+        # Consecutive failures & when to restart after the last one (monotonic)
+        self.failures = 0
+        self.restart_at = None
+        self.finished = False
+
+    def is_alive(self):
+        """Whether the source is running or will be restarted"""
+        return not self.finished
+
+
+class Supervisor(object):  # pylint: disable=too-many-instance-attributes
+    """Starts a process for each source, stops them once stop is set (or any of them cannot be started) and restarts
+    those which fail (with backoff)."""
+
+    def __init__(self, cfg_file, names, stop, datapath, metrics_interval=None):
+        """metrics_interval - If set, source processes send their metrics (to be included in those of this process)
+                              this often (seconds)"""
+        # pylint: disable=too-many-arguments
+        self.__cfg_file = cfg_file
+        self.__stop = stop
+        self.__datapath = datapath
+        self.__metrics_interval = metrics_interval
+        self.sources = {name: SourceProcess(name) for name in names}
+        # Whether any source could not be started
+        self.failed = False
+        # Processes must not inherit threads (and their held locks) from the parent
+        try:
+            self.__mp = multiprocessing.get_context('spawn')
+        except AttributeError:
+            self.__mp = multiprocessing
+        self.__queue = self.__mp.Queue()
+        self.__log_config = _log_config()
+        self.__thread = Thread(target=self.__run, name='supervisor')
+
+    def start(self):
+        for source in self.sources.values():
+            self.__start_source(source)
+        self.__thread.start()
+
+    def join(self):
+        self.__thread.join()
+
+    def reload(self, name):
+        """Reloads the given source (see Runner.reload) with its configuration re-read, if it is running"""
+        source = self.sources[name]
+        if SIGHUP is None:
+            logger.error("Source processes cannot be reloaded on this platform")
+        elif source.process is not None and source.process.is_alive():
+            kill(source.process.pid, SIGHUP)
+        else:
+            logger.warning("Source [%s] not running, not reloading", name)
+
+    def __start_source(self, source):
+        # Not daemonic since sources might use worker processes themselves
+        source.process = self.__mp.Process(target=_source_main, name=('source-%s' % source.name),
+                                           args=(self.__cfg_file, source.name, self.__datapath, self.__log_config,
+                                                 self.__metrics_interval, self.__queue))
+        source.process.start()
+        source.started = monotonic()
+        source.restart_at = None
+        _UP.set(1, (source.name,))
+        logger.info("Source [%s] started (pid %d)", source.name, source.process.pid)
+
+    def __run(self):
+        heartbeat = monotonic()
+        while not self.__stop.is_set():
+            self.__collect_metrics(timeout=1)
+            for source in self.sources.values():
+                self.__check(source)
+            if all(source.finished for source in self.sources.values()):
+                break
+            if monotonic() - heartbeat >= HEARTBEAT_INTERVAL:
+                heartbeat = monotonic()
+                self.__do_heartbeat()
+        self.__stop_all()
+
+    def __collect_metrics(self, timeout):
+        try:
+            name, snapshot = self.__queue.get(timeout=timeout)
+        except Empty:
+            return
+        REGISTRY.set_remote(name, snapshot)
+        # Drain without blocking
+        while True:
+            try:
+                name, snapshot = self.__queue.get_nowait()
+            except Empty:
+                break
+            REGISTRY.set_remote(name, snapshot)
+
+    def __check(self, source):
+        if source.finished:
+            return
+        if source.restart_at is not None:
+            if monotonic() >= source.restart_at:
+                source.restarts += 1
+                _RESTARTS.inc((source.name,))
+                self.__start_source(source)
+            return
+        if source.process.is_alive():
+            return
+        _UP.set(0, (source.name,))
+        code = source.process.exitcode
+        if code == EXIT_OK:
+            logger.info("Source [%s] finished", source.name)
+            source.finished = True
+        elif code == EXIT_INIT_FAILED:
+            logger.critical("Source [%s] failed to start. Aborting.", source.name)
+            source.finished = True
+            self.failed = True
+            self.__stop.set()
+        else:
+            if monotonic() - source.started >= RESTART_RESET:
+                source.failures = 0
+            delay = min(RESTART_MAX, RESTART_BASE * 2 ** source.failures)
+            source.failures += 1
+            source.restart_at = monotonic() + delay
+            logger.error("Source [%s] failed (exit code %s), restarting in %ds", source.name, code, delay)
+
+    def __do_heartbeat(self):
+        now = monotonic()
+        for name, source in sorted(self.sources.items()):
+            alive = source.process is not None and source.process.is_alive()
+            logger.info("heartbeat: Source %s: Pid=%s, Alive=%s, Restarts=%i, Uptime=%.0fs", name,
+                        source.process.pid if alive else None, alive, source.restarts,
+                        (now - source.started) if alive else 0)
+
+    def __stop_all(self):
+        processes = [source.process for source in self.sources.values()
+                     if source.process is not None and source.process.is_alive()]
+        for process in processes:
+            # SIGTERM (graceful stop, see _source_main)
+            process.terminate()
+        deadline = monotonic() + STOP_TIMEOUT
+        for process in processes:
+            process.join(max(0, deadline - monotonic()))
+            if process.is_alive():
+                logger.error("Source process %s did not stop in time, killing", process.name)
+                if hasattr(process, 'kill'):
+                    process.kill()
+                else:
+                    process.terminate()
+                process.join()
+        for source in self.sources.values():
+            source.finished = True
+            _UP.set(0, (source.name,))
+            REGISTRY.remove_remote(source.name)
@@ -28,11 +28,17 @@ from signal import signal, SIGINT, SIGTERM
 from time import sleep
 from threading import Thread
 
-from IoticAgent.Core.compat import Event, Queue
+from IoticAgent.Core.compat import Event, Queue, monotonic
 
-from .compat import SIGUSR1
+from .compat import SIGUSR1, SIGUSR2, SIGHUP
 from .Config import Config
+from .Metrics import MetricsExporter
+from .Profiler import SamplingProfiler
 from .Runner import Runner
+from .Supervisor import Supervisor
+
+
+PROMPT = 'Enter "q" to exit, "p" to start/stop profiling, "r [source ...]" to reload (all) sources'
 
 
 def usage():
@@ -65,10 +71,88 @@ def add_input(input_queue):
         input_queue.put(stdin.read(1))
 
 
+def reload_sources(cfg_file, runners, names=None, supervisor=None):
+    """Reloads the given (or all) sources with their configuration re-read from cfg_file (see Runner.reload)"""
+    cfg = None
+    if supervisor is None:
+        try:
+            cfg = Config(cfg_file)
+        except:
+            logger.exception("Failed to load/parse Config file '%s'. Not reloading.", cfg_file)
+            return
+    for name in names or sorted(runners):
+        if name not in runners:
+            logger.error("Unknown source [%s]", name)
+        elif supervisor is not None:
+            supervisor.reload(name)
+        elif cfg.get(name) is None:
+            logger.error("Runner [%s] failed reload. Reason [config section missing]", name)
+        else:
+            try:
+                runners[name].reload(cfg.get(name))
+            except (ValueError, TypeError, ImportError) as e:
+                logger.error("Runner [%s] failed reload. Reason [%s]", name, str(e))
+
+
+def create_runners(cfg, source_names, stop_evt, datapath):
+    """Returns dict of source name to Runner or None if any of them could not be created. Runners are created
+    concurrently so that e.g. loading of their stashes overlaps."""
+    runners = {}
+    failed = []
+
+    def create(source_name):
+        try:
+            runners[source_name] = Runner(source_name, cfg.get(source_name), stop_evt, datapath)
+        except (ValueError, ImportError) as e:
+            logger.error("Runner [%s] failed init. Reason [%s]", source_name, str(e))
+            failed.append(source_name)
+        except Exception as e:  # pylint: disable=broad-except
+            logger.exception("Runner [%s] failed init. Reason [%s]", source_name, str(e))
+            failed.append(source_name)
+
+    threads = [Thread(target=create, name=('init-%s' % source_name), args=(source_name,))
+               for source_name in source_names]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return None if failed else runners
+
+
+def metrics_exporter(cfg):
+    """Returns MetricsExporter as configured in [main] or None if metrics are not to be exported. Raises ValueError
+    if the configuration is invalid."""
+    port = cfg.get('main', 'metrics_port')
+    textfile = cfg.get('main', 'metrics_textfile')
+    interval = cfg.get('main', 'metrics_interval')
+    if port is None and textfile is None:
+        return None
+    if port is not None:
+        try:
+            port = int(port)
+        except ValueError:
+            port = 0
+        if not 0 < port < 65536:
+            raise ValueError("[main] metrics_port must be a port number")
+    if textfile is not None:
+        textfile = abspath(textfile)
+    if interval is None:
+        interval = 15
+    else:
+        try:
+            interval = float(interval)
+        except ValueError:
+            interval = 0
+        if interval <= 0:
+            raise ValueError("[main] metrics_interval must be > 0")
+    return MetricsExporter(port=port, textfile=textfile, interval=interval)
+
+
 def main():  # pylint: disable=too-many-return-statements,too-many-branches,too-many-locals,too-many-statements
     if len(argv) < 2:
         if not exists(argv[1]):
             return usage()
+    started = monotonic()
     try:
         cfg = Config(argv[1])
     except:
@@ -91,20 +175,38 @@ def main():  # pylint: disable=too-many-return-statements,too-many-branches,too-
         logger.error("Config file must have [main] sources = \n\tSourceName\n\tSourceTwo")
         return 1
 
-    runners = {}
+    try:
+        exporter = metrics_exporter(cfg)
+    except ValueError as e:
+        logger.error(str(e))
+        return 1
+    except Exception as e:  # pylint: disable=broad-except
+        logger.exception("Failed to set up metrics. Reason [%s]", str(e))
+        return 1
+
+    process_per_source = (cfg.get('main', 'process_per_source') or 'false').lower()
+    if process_per_source not in ('true', 'false', 'yes', 'no', 'on', 'off', '1', '0'):
+        logger.error("[main] process_per_source must be true or false")
+        return 1
+    process_per_source = process_per_source in ('true', 'yes', 'on', '1')
+
+    source_names = source_list.strip().split("\n")
     stop_evt = Event()
-    for source_name in source_list.strip().split("\n"):
-        try:
-            runners[source_name] = Runner(source_name, cfg.get(source_name), stop_evt, datapath)
-        except ValueError as e:
-            logger.error("Runner [%s] failed init. Reason [%s]", source_name, str(e))
-            return 1
-        except ImportError as e:
-            logger.error("Runner [%s] failed init. Reason [%s]", source_name, str(e))
-            return 1
-        except Exception as e:  # pylint: disable=broad-except
-            logger.exception("Runner [%s] failed init. Reason [%s]", source_name, str(e))
+    timings = [('Config', monotonic() - started)]
+    supervisor = None
+    if process_per_source:
+        # Each runner is created (and so its configuration validated) in its own process
+        supervisor = Supervisor(abspath(argv[1]), source_names, stop_evt, datapath,
+                                metrics_interval=(None if exporter is None else exporter.interval))
+        runners = supervisor.sources
+    else:
+        started = monotonic()
+        runners = create_runners(cfg, source_names, stop_evt, datapath)
+        if runners is None:
             return 1
+        timings.append(('Init', monotonic() - started))
+    # Runners log their own startup timings once connected
+    logger.info("Startup: %s", ', '.join('%s=%.3fs' % timing for timing in timings))
 
     def receive_abort_signal(signum, stack):  # pylint: disable=unused-argument
         if signum == SIGUSR1:
@@ -117,9 +219,26 @@ def main():  # pylint: disable=too-many-return-statements,too-many-branches,too-
 
     signal(SIGUSR1, receive_abort_signal)
 
-    for name, runner in runners.items():
-        logger.info("Runner [%s] Started", name)
-        runner.start()
+    # Reload all sources (without restarting & so losing worker caches), handled by main loop
+    reload_evt = Event()
+    if SIGHUP is not None:
+        signal(SIGHUP, lambda signum, stack: reload_evt.set())
+
+    # Profile all threads on demand (without restarting & so losing worker caches), handled by main loop since toggling
+    # must not happen in a signal handler (it would deadlock if the main thread is toggling at the time)
+    profiler = SamplingProfiler(datapath)
+    profile_evt = Event()
+    if SIGUSR2 is not None:
+        signal(SIGUSR2, lambda signum, stack: profile_evt.set())
+
+    if supervisor is not None:
+        supervisor.start()
+    else:
+        for name, runner in runners.items():
+            logger.info("Runner [%s] Started", name)
+            runner.start()
+    if exporter is not None:
+        exporter.start()
 
     if 'IOTIC_BACKGROUND' in environ:
         logger.info("Started in non-interactive mode.")
@@ -127,8 +246,15 @@ def main():  # pylint: disable=too-many-return-statements,too-many-branches,too-
         signal(SIGINT, receive_abort_signal)
         signal(SIGTERM, receive_abort_signal)
 
+        # Not waiting on stop_evt since the signal handler (which sets it) would deadlock if run during the wait
         while not stop_evt.is_set() or not all_runners_finished(runners):
-            stop_evt.wait(timeout=5)
+            sleep(1)
+            if reload_evt.is_set() and not stop_evt.is_set():
+                reload_evt.clear()
+                reload_sources(argv[1], runners, supervisor=supervisor)
+            if profile_evt.is_set():
+                profile_evt.clear()
+                profiler.toggle()
         stop_evt.set()
 
     else:
@@ -138,18 +264,28 @@ def main():  # pylint: disable=too-many-return-statements,too-many-branches,too-
         input_thread.start()
 
         try:
-            print('Enter "q" to exit')
+            print(PROMPT)
             while not stop_evt.is_set():
                 try:
                     inp = input(input_queue)
                     if inp == 'q':
                         break
+                    elif inp == 'p':
+                        profiler.toggle()
+                    elif inp is not None and inp.split()[:1] == ['r']:
+                        reload_sources(argv[1], runners, names=inp.split()[1:], supervisor=supervisor)
                     elif inp is not None:
-                        print('Enter "q" to exit')
+                        print(PROMPT)
                     if all_runners_finished(runners):
                         logger.warning("All Runners have stopped.  Exit.")
                         break
-                    stop_evt.wait(timeout=1)
+                    sleep(1)
+                    if reload_evt.is_set():
+                        reload_evt.clear()
+                        reload_sources(argv[1], runners, supervisor=supervisor)
+                    if profile_evt.is_set():
+                        profile_evt.clear()
+                        profiler.toggle()
                 except EOFError:
                     logger.warning("Got EOF stopping...")
                     break
@@ -164,7 +300,12 @@ def main():  # pylint: disable=too-many-return-statements,too-many-branches,too-
         logger.info("Waiting for runner %s to die...", name)
         while runner.is_alive():
             sleep(0.1)
-    return 0
+    if supervisor is not None:
+        supervisor.join()
+    profiler.stop()
+    if exporter is not None:
+        exporter.stop()
+    return 1 if supervisor is not None and supervisor.failed else 0
 
 
 if __name__ == '__main__':
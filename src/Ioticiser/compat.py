@@ -18,5 +18,8 @@ from os import name
 if name == 'nt':
     # Use SIGTERM on Windows until proper IPC can be arranged
     from signal import SIGTERM as SIGUSR1  # noqa pylint: disable=unused-import
+    # Not available (profiler can only be toggled & sources reloaded via stdin)
+    SIGUSR2 = None
+    SIGHUP = None
 else:
-    from signal import SIGUSR1  # noqa pylint: disable=unused-import
+    from signal import SIGUSR1, SIGUSR2, SIGHUP  # noqa pylint: disable=unused-import
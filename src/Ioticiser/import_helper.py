@@ -2,23 +2,46 @@
 
 from importlib import import_module
 import logging
+import sys
+try:
+    from importlib import reload as reload_module
+except ImportError:
+    reload_module = reload  # noqa pylint: disable=undefined-variable
 #from iotic.logger import log
 #log = log.getLogger(__name__)
 log = logging.getLogger(__name__)
 
 
-def getItemFromModule(module, item=None):
+def getItemFromModule(module, item=None, reload=False):  # pylint: disable=redefined-builtin
     """Loads an item from a module.  E.g.: moduleName=a.b.c is equivalent to 'from a.b import c'. If additionally
-       itemName = d, this is equivalent to 'from a.b.c import d'. Returns None on failure"""
+       itemName = d, this is equivalent to 'from a.b.c import d'. If reload is set, the module, its submodules (if it
+       is a package) and the module defining the item are re-imported, e.g. to pick up changes to them. (Other modules
+       imported by these are not.) Returns None on failure"""
     try:
         if item is None:
             item = module.rsplit('.', maxsplit=1)[-1]
             module = module[:-(len(item) + 1)]
+        if reload:
+            return getattr(_reload_with_submodules(import_module(module), item), item)
         return getattr(import_module(module), item)
     except:
         log.exception('Failed to import %s.%s', module, item if item else '')
 
 
+def _reload_with_submodules(module, item):
+    """Reloads the given module after its submodules & the module defining item, since a package usually only
+    re-exports (e.g. 'from .a import item'), so reloading it alone would return the old item"""
+    defined_in = getattr(getattr(module, item, None), '__module__', None)
+    prefix = module.__name__ + '.'
+    # Modules are added to sys.modules as their import starts, so in reverse order dependencies come first
+    for name in reversed(list(sys.modules)):
+        if (name.startswith(prefix) or name == defined_in) and name != module.__name__:
+            submodule = sys.modules.get(name)
+            if submodule is not None:
+                reload_module(submodule)
+    return reload_module(module)
+
+
 def loadConfigurableComponent(config, basename, includeBaseConfig=True, key='impl', expectedClass=None):
     """Loads the given component from configuration, as defined (via 'impl') in the given basename config section.
     On failure returns None. includeBaseConfig indicates whether to supply base config section to component in
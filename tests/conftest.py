@@ -0,0 +1,23 @@
+# Copyright (c) 2017 Iotic Labs Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://github.com/Iotic-Labs/py-IoticBulkData/blob/master/LICENSE
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Makes the Ioticiser package (src) and the in-memory agent stand-in (bench/fakeagent) importable by tests"""
+
+from os.path import abspath, dirname, join
+import sys
+
+_ROOT = dirname(dirname(abspath(__file__)))
+
+for _path in (join(_ROOT, 'src'), join(_ROOT, 'bench')):
+    if _path not in sys.path:
+        sys.path.insert(0, _path)
@@ -0,0 +1,59 @@
+# Copyright (c) 2017 Iotic Labs Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://github.com/Iotic-Labs/py-IoticBulkData/blob/master/LICENSE
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Memory footprint of stash state & worker cache (see Stash.Footprint)"""
+
+from __future__ import unicode_literals
+
+from os import pathsep
+from sys import executable, path as sys_path
+from subprocess import check_output, STDOUT
+from threading import Semaphore
+
+from IoticAgent.Core.Const import R_FEED
+
+from Ioticiser.Stash.ClientPool import ClientPool
+from Ioticiser.Stash.Diff import ThingDiff, PointDiff
+from Ioticiser.Stash.Footprint import analyse, CAT_CACHE
+from Ioticiser.Stash.ThreadPool import ThreadPool
+from Ioticiser.Stash.const import THINGS, DIFF
+
+from fakeagent import FakeClient
+
+
+def test_worker_cache():
+    pool = ThreadPool('test', num_workers=1, iotclient=ClientPool([FakeClient()]))
+    completed = Semaphore(0)
+    pool.start()
+    try:
+        points = tuple(PointDiff('feed%d' % i, R_FEED, True, None, None, (), (), (), False, None, None)
+                       for i in range(3))
+        pool.submit('thing', 0, ThingDiff('thing', True, None, None, None, None, (), (), points),
+                    lambda lid, idx: completed.release())
+        assert completed.acquire(timeout=10)
+    finally:
+        pool.stop()
+
+    state = {THINGS: {}, DIFF: {}}
+    assert analyse(state)['worker_cache'] is None
+    assert CAT_CACHE not in analyse(state)['bytes']
+    footprint = analyse(state, cache=pool.cache_snapshot())
+    assert footprint['worker_cache'] == {'things': 1, 'points': 3}
+    assert footprint['bytes'][CAT_CACHE] > 0
+    assert footprint['total_bytes'] == sum(footprint['bytes'].values())
+
+
+def test_run_as_script():
+    output = check_output([executable, '-W', 'error', '-m', 'Ioticiser.Stash.Footprint', '--help'], stderr=STDOUT,
+                          env={'PYTHONPATH': pathsep.join(sys_path)})
+    assert b'Warning' not in output
@@ -0,0 +1,47 @@
+# Copyright (c) 2017 Iotic Labs Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://github.com/Iotic-Labs/py-IoticBulkData/blob/master/LICENSE
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Re-importing of sources (see Runner.reload)"""
+
+from __future__ import unicode_literals
+
+from importlib import invalidate_caches
+import sys
+
+from Ioticiser.import_helper import getItemFromModule
+
+
+def _write_source(pkg_dir, version):
+    # Size changes with version so that the (mtime & size based) bytecode cache is not reused
+    (pkg_dir / 'Mod.py').write_text('class Cls(object):\n    VERSION = %d%s\n' % (version, ' ' * version))
+
+
+def test_reload_package_reexport(tmp_path, monkeypatch):
+    pkg_dir = tmp_path / 'reloadpkg'
+    pkg_dir.mkdir()
+    (pkg_dir / '__init__.py').write_text('from .Mod import Cls  # noqa\n')
+    _write_source(pkg_dir, 1)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    try:
+        old = getItemFromModule('reloadpkg.Cls')
+        assert old.VERSION == 1
+
+        _write_source(pkg_dir, 2)
+        invalidate_caches()
+        assert getItemFromModule('reloadpkg.Cls') is old
+        new = getItemFromModule('reloadpkg.Cls', reload=True)
+        assert new is not old
+        assert new.VERSION == 2
+    finally:
+        for name in ('reloadpkg', 'reloadpkg.Mod'):
+            sys.modules.pop(name, None)
@@ -0,0 +1,113 @@
+# Copyright (c) 2017 Iotic Labs Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://github.com/Iotic-Labs/py-IoticBulkData/blob/master/LICENSE
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Sequential agent round trips needed by a worker to handle a diff (see ThreadPool.RequestBatch)"""
+
+from __future__ import unicode_literals
+
+from threading import Event, Semaphore
+
+from IoticAgent.Core.Const import R_FEED
+from IoticAgent.Core.Exceptions import LinkException
+
+from Ioticiser.Stash.ClientPool import ClientPool, STATS_IN_FLIGHT
+from Ioticiser.Stash.Diff import ThingDiff, PointDiff, ValueDiff
+from Ioticiser.Stash.ThreadPool import ThreadPool
+
+from fakeagent import FakeClient
+
+
+VALUES = 20
+
+
+def new_thing_diff(lid, values):
+    """Diff of a new (public) thing with a single described feed with the given number of values, all shared"""
+    value_diffs = tuple(ValueDiff('value%d' % i, 'integer', 'en', 'Value %d' % i, None, True, i) for i in range(values))
+    point_diff = PointDiff('feed', R_FEED, True, 0, ('test',), (('en', 'Feed'),), (('en', 'Test feed'),), value_diffs,
+                           False, None, None)
+    return ThingDiff(lid, True, None, True, ('test',), (52.2, 0.12), (('en', 'Thing'),), (('en', 'Test thing'),),
+                     (point_diff,))
+
+
+def handle(client, *diffs):
+    """Handles the given diffs (in order) with a single worker"""
+    pool = ThreadPool('test', num_workers=1, iotclient=ClientPool([client]))
+    completed = Semaphore(0)
+    pool.start()
+    try:
+        for idx, diff in enumerate(diffs):
+            pool.submit(diff.lid, idx, diff, lambda lid, idx: completed.release())
+        for _ in diffs:
+            assert completed.acquire(timeout=10)
+    finally:
+        pool.stop()
+
+
+def test_new_thing_round_trips():
+    client = FakeClient(async_requests=True)
+    handle(client, new_thing_diff('thing', VALUES))
+
+    # create_thing, thing metadata (fetch & set, thing tags in flight), create_feed, feed metadata (fetch & set, feed
+    # tags & recent config in flight), values, shares, set_public
+    assert client.round_trips == 9
+    assert client.requests['create_value'] == VALUES
+
+
+def test_round_trips_independent_of_values():
+    """Values are created & shared in flight together, so do not add round trips"""
+    client = FakeClient(async_requests=True)
+    handle(client, new_thing_diff('thing', 1))
+    single = client.round_trips
+
+    client = FakeClient(async_requests=True)
+    handle(client, new_thing_diff('thing', VALUES))
+    assert client.round_trips == single
+
+
+def test_round_trips_without_async():
+    """Without asynchronous requests every request is a round trip"""
+    client = FakeClient()
+    handle(client, new_thing_diff('thing', VALUES))
+
+    assert client.round_trips == sum(client.requests.values())
+    assert client.round_trips > VALUES
+
+
+class FailingClient(FakeClient):
+    """Fails the first metadata fetch (a synchronous request) with a network error"""
+
+    def __init__(self):
+        super(FailingClient, self).__init__(async_requests=True)
+        self.failed = Event()
+
+    def request(self, name):
+        if name == 'get_meta' and not self.failed.is_set():
+            self.failed.set()
+            raise LinkException('test')
+        super(FailingClient, self).request(name)
+
+
+def test_failed_request_abandons_in_flight():
+    """Asynchronous requests issued before a failed synchronous one are not left in flight"""
+    client = FailingClient()
+    clients = ClientPool([client])
+    pool = ThreadPool('test', num_workers=1, iotclient=clients)
+    pool.start()
+    try:
+        pool.submit('thing', 0, new_thing_diff('thing', VALUES))
+        assert client.failed.wait(10)
+    finally:
+        pool.stop()
+    # (thing tags were in flight when fetching thing metadata failed)
+    assert client.requests['create_tag'] == 1
+    assert clients.collect_stats()[0][STATS_IN_FLIGHT] == 0
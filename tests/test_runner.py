@@ -0,0 +1,84 @@
+# Copyright (c) 2017 Iotic Labs Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://github.com/Iotic-Labs/py-IoticBulkData/blob/master/LICENSE
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Reloading of sources (see Runner.reload)"""
+
+from __future__ import unicode_literals
+
+from threading import Event
+from time import sleep
+import sys
+
+import pytest
+
+from Ioticiser import Runner as runner_module
+from Ioticiser.Stash.ClientPool import ClientPool
+
+from fakeagent import FakeClient
+
+
+SOURCE = '''
+from Ioticiser import SourceBase
+
+
+class Good(SourceBase):
+
+    def run(self):
+        self._config['events'].append('start')
+        self._stop.wait()
+        self._config['events'].append('stop')
+
+
+class Bad(Good):
+
+    def __init__(self, stash, config, stop):
+        super(Bad, self).__init__(stash, config, stop)
+        raise ValueError('bad config')
+'''
+
+
+def _wait_for(predicate):
+    for _ in range(100):
+        if predicate():
+            return True
+        sleep(.05)
+    return False
+
+
+def test_failed_reload_keeps_source(tmp_path, monkeypatch):
+    (tmp_path / 'reloadsrc.py').write_text(SOURCE)
+    agentfile = tmp_path / 'agent.ini'
+    agentfile.write_text('')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr(runner_module.ClientPool, 'from_config',
+                        classmethod(lambda cls, agentfile, count=1: ClientPool([FakeClient()])))
+
+    events = []
+    config = {'import': 'reloadsrc.Good', 'agent': str(agentfile), 'events': events}
+    stop = Event()
+    runner = runner_module.Runner('test', config, stop, str(tmp_path))
+    runner.start()
+    try:
+        assert _wait_for(lambda: events == ['start'])
+        with pytest.raises(ValueError):
+            runner.reload(dict(config, **{'import': 'reloadsrc.Bad'}))
+        sleep(.2)
+        assert events == ['start']
+        assert runner.is_alive()
+
+        runner.reload(config)
+        assert _wait_for(lambda: events == ['start', 'stop', 'start'])
+    finally:
+        stop.set()
+        assert _wait_for(lambda: not runner.is_alive())
+        sys.modules.pop('reloadsrc', None)
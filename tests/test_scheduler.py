@@ -0,0 +1,59 @@
+# Copyright (c) 2017 Iotic Labs Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://github.com/Iotic-Labs/py-IoticBulkData/blob/master/LICENSE
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Periodic jobs (see Scheduler)"""
+
+from __future__ import unicode_literals
+
+from threading import Event
+from time import sleep
+
+import pytest
+
+from Ioticiser.Scheduler import Scheduler, _INTERVAL
+
+LABELS = ('test', 'job')
+
+
+def _interval():
+    return dict(_INTERVAL._collect()).get(LABELS)  # pylint: disable=protected-access
+
+
+def test_duplicate_name_rejected():
+    scheduler = Scheduler()
+    job = scheduler.every(60, lambda: None, labels=LABELS)
+    with pytest.raises(ValueError):
+        scheduler.every(30, lambda: None, labels=LABELS)
+    # The rejected job must not have replaced (or, once cancelled, removed) the live job's interval
+    assert _interval() == 60
+
+    scheduler.cancel(job)
+    assert _interval() is None
+    job = scheduler.every(30, lambda: None, labels=LABELS)
+    assert _interval() == 30
+    scheduler.cancel(job)
+
+
+def test_name_freed_once_stopped():
+    scheduler = Scheduler()
+    stop = Event()
+    ran = Event()
+    scheduler.every(.05, ran.set, stop=stop, labels=LABELS)
+    assert ran.wait(5)
+    stop.set()
+    for _ in range(100):
+        if _interval() is None:
+            break
+        sleep(.05)
+    assert _interval() is None
+    scheduler.cancel(scheduler.every(60, lambda: None, labels=LABELS))